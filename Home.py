@@ -1,19 +1,12 @@
 # Import libraries
+import time
+import uuid
 import streamlit as st
-import numpy as np
-import json
-from gensim.models import word2vec
-import modules.scrape_dict as sd
-import modules.score_calc as sc
+import modules.registry as registry
+from modules.profiling import RingBufferSink, Tracer
 
-# Import necessary data
-co_matrix = np.load('trained_logs/M_matrix_final.npy')
-
-decoder = json.JSONDecoder()
-with open('trained_logs/dict_final.json', encoding='utf-8') as user_file:
-    w_dict, _ = decoder.raw_decode(user_file.read())
-
-word2vec_mod = word2vec.Word2Vec.load("trained_logs/word2vec_100dim_50000.model")
+# The models and the dictionary are loaded by the registry once per process, on first use,
+# and shared by all sessions and reruns (see modules/registry.py)
 
 # Set up page
 st.set_page_config(layout="wide")
@@ -29,12 +22,23 @@ st.markdown("""
 # Set up the session state
 if st.session_state.get('step') is None:
      st.session_state['step'] = 0
+if st.session_state.get('trace_sink') is None:
+     # Timings of the last requests of this session (see modules/profiling.py)
+     st.session_state['trace_sink'] = RingBufferSink(maxlen=20)
+if st.session_state.get('owner') is None:
+     # Identifies the scoring job of this session in the process-wide executor
+     st.session_state['owner'] = uuid.uuid4().hex
 
 # Homepage Content
 
 user = st.sidebar.text_input('Username')
 with st.sidebar.expander("Contact Us"):
     st.markdown('<p class="small-font">📧 pt.thao.1910@gmail.com</p>', unsafe_allow_html=True)
+with st.sidebar.expander("Startup time"):
+    for (name, seconds) in registry.startup_report().items():
+        st.markdown(f'<p class="small-font">{name}: {seconds:.2f}s</p>', unsafe_allow_html=True)
+profile = st.sidebar.checkbox('Profile requests')
+tracer = Tracer(sinks=[st.session_state['trace_sink']]) if profile else None
 
 # Title
 st.title('📖 Intelligent Vietnamese Dictionary')
@@ -49,25 +53,75 @@ with st.expander('For non-Vietnamese users to try out the application:'):
 st.header('Input form')
 context = st.text_input('Context Sentence')
 word = st.text_input('Keyword')
+fix_typos = st.checkbox('Match misspelled or unknown words in the context sentence to their closest known words')
 
+weight = st.slider('Weight of the word vector score (the co-occurrence score has a weight of 1)', 0.0, 5.0, 2.0, 0.5)
+
+columns = ['word', 'word_type', 'meaning', 'examples', 'score']
 if st.button('Submit'):
-     # Calculate scores for each meaning of the keyword and print out the results
-     res_list = sc.score_calc_phraser(word, context, co_matrix, w_dict, word2vec_mod, [1,2], sd.web_scraping)
-     if isinstance(res_list, str):
-          st.write("⚠️" + res_list)
-          st.session_state['step'] = 0
-          
-     else:
-          print_list = res_list[['word', 'word_type', 'meaning', 'examples', 'score']]
-          st.header('Output')
-          st.markdown(f'''
-             You have entered:
-             - Keyword: `{word}`
-             - Context sentence: `{context}`
-             ''')
-          st.dataframe(print_list)
-          st.session_state['step'] = 1
-          st.session_state['print_list'] = print_list
+     # Calculate scores for each meaning of the keyword in the background (see modules/scoring_jobs.py): a new query
+     # cancels the previous one of this session, and sessions submitting the same query share its job
+     executor = registry.get('scoring_executor')
+     st.session_state['job'] = executor.submit(st.session_state['owner'], word, context, fix_typos, tracer)
+     st.session_state['step'] = 1
+
+job = st.session_state.get('job')
+if st.session_state['step']==1 and not job.done():
+     # The script only polls the job. Streamlit stops a script for a rerun (new query or input) at its next st call, so
+     # the status is redrawn on every tick, while the job may stay in one stage (e.g. a slow dictionary lookup)
+     status = st.empty()
+     table = st.empty()
+     shown = None
+     while not job.wait(0.2):
+          with status.container():
+               st.progress(job.progress)
+               if job.scores is None:
+                    st.caption(f'Looking up `{job.key[0]}` and scoring its meanings... ({time.monotonic() - job.created:.1f}s)')
+               else:
+                    st.caption('Meanings ranked by co-occurrence only, computing the word vector scores...')
+          if job.stage!=shown and job.scores is not None:
+               # Meanings ranked by co-occurrence only, until the word vector scores are computed
+               table.dataframe(job.frame([1, weight])[columns])
+          shown = job.stage
+     status.empty()
+     table.empty()
+
+if st.session_state['step']==1 and job.state=='failed':
+     st.error(f'Could not score the meanings of `{job.key[0]}`: {job.error}')
+elif st.session_state['step']==1 and job.state=='done':
+     # Moving the weight slider only re-ranks the last scores
+     session = job.session
+     print_list = session.rank([1, weight], tracer)[columns]
+     st.header('Output')
+     st.markdown(f'''
+        You have entered:
+        - Keyword: `{session.word}`
+        - Context sentence: `{session.text}`
+        ''')
+     st.dataframe(print_list)
+     st.session_state['print_list'] = print_list
+
+     # Feedback: the context sentence becomes an example of the correct meaning (see modules/feedback.py)
+     with st.form('feedback'):
+          position = st.number_input('Position of the correct meaning in the list (0 if the first one is correct)',
+                                     min_value=0, max_value=max(len(print_list) - 1, 0), step=1)
+          if st.form_submit_button('Send feedback') and len(print_list)!=0:
+               correct = session.meanings([1, weight])[int(position)]
+               registry.get('feedback').record(session.word, session.text, correct.index, correct.meaning)
+               # Sessions of the keyword kept by the executor have read its previous feedback examples
+               registry.get('scoring_executor').forget(session.word)
+               # The next submitted query is scored with the new example
+               st.success(f'Thank you! Saved "{correct.meaning}" as the meaning of `{session.word}` in this sentence.')
+
+if profile:
+     with st.expander('Profiling ⬇️'):
+          # Most recent request first: total and per-stage wall/CPU times, and counts of processed items
+          for record in reversed(st.session_state['trace_sink'].records()):
+               counts = ', '.join(f'{name}: {n}' for (name, n) in record['counts'].items())
+               st.markdown(f"**{record['name']}** (`{record['tags'].get('word', '')}`): "
+                           f"{1000*record['wall']:.1f} ms wall, {1000*record['cpu']:.1f} ms CPU" + (f' - {counts}' if counts!='' else ''))
+               st.dataframe([{'stage': stage, 'wall (ms)': 1000*t['wall'], 'cpu (ms)': 1000*t['cpu']}
+                             for (stage, t) in record['stages'].items()])
 
 # To browse results for other keywords
 if st.session_state['step']==1:
@@ -75,5 +129,6 @@ if st.session_state['step']==1:
      submitted = st.button("Click here!")
 
      if submitted:
+          registry.get('scoring_executor').cancel(st.session_state['owner'])
           st.session_state['step']=0
           st.experimental_rerun()
@@ -0,0 +1,288 @@
+import argparse
+import json
+import multiprocessing
+import regex
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from underthesea import word_tokenize
+from modules.co_matrix import as_co_store
+from modules.pos_tagging import PosTagger
+from modules.score_calc import (clean_context, clean_test_dat, co_occur_score_reduce, co_occur_sums, embed_tokens,
+                                index_tokens, predict_pos_tag, rank_senses, vector_scores)
+from modules.sense_index import SenseIndex
+
+# underthesea POS tags of the words annotated by default: nouns, verbs and adjectives
+CONTENT_TAGS = ('N', 'V', 'A')
+
+# End of a sentence: ".", "!", "?" or "…" followed by a space
+sentence_end = regex.compile(r'(?<=[.!?…])\s+')
+
+# Annotator of the worker processes, set in the parent before the pool is forked and shared copy-on-write
+_state = {}
+
+
+def split_sentences(lines, max_chars=2000):
+    '''
+    Split a stream of text lines into sentences, keeping at most one unfinished sentence in memory
+
+    Sentences end with ".", "!", "?" or "…" followed by a space, at an empty line or when they reach max_chars characters.
+
+    Input:
+    + lines (iterable of string): lines of text
+    + max_chars (int): maximum length of a sentence
+    Output: generator of string - sentences
+    '''
+    buffer = ''
+    for line in lines:
+        line = line.strip()
+        if line=='':
+            if buffer!='':
+                yield buffer
+            buffer = ''
+            continue
+        parts = sentence_end.split(buffer + ' ' + line if buffer!='' else line)
+        for part in parts[:-1]:
+            yield part
+        buffer = parts[-1]
+        while len(buffer)>max_chars:
+            cut = buffer.rfind(' ', 0, max_chars)
+            cut = cut if cut>0 else max_chars
+            yield buffer[:cut]
+            buffer = buffer[cut:].strip()
+    if buffer!='':
+        yield buffer
+
+
+def read_sentences(paths):
+    '''
+    Return the sentences of text files, read line by line (standard input if paths is empty or "-")
+    '''
+    if paths==[] or paths==['-']:
+        yield from split_sentences(sys.stdin)
+        return
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            yield from split_sentences(f)
+
+
+def window_tokens(word, tokens):
+    '''
+    Return the context words of a keyword from the tokens of the whole sentence
+
+    The window is the one of score_calc.context_window (8 syllables on each side of the first occurrence of the keyword,
+    without the keyword, the last 8 syllables if the keyword is missing) taken from the tokens of the whole sentence,
+    so that a sentence is tokenized once for all its keywords. Tokens can differ from clean_context at the edges of the
+    window, where tokenizing the window alone may split words differently.
+
+    The keyword is matched as a whole syllable, whereas context_window matches it anywhere in the text: when it is part
+    of an earlier syllable ("ăn" in "văn" in "tôi thích văn học và ăn cơm"), context_window centres the window on that
+    syllable and removes the keyword from it ("v"), while window_tokens centres it on the keyword and keeps "văn".
+    The Annotator with exact=True (--exact) uses clean_context, as score_calc_phraser.
+
+    Input:
+    + word (string): keyword
+    + tokens (list of string): tokens of the cleaned sentence (word_tokenize(clean_test_dat(text)))
+    Output: cleaned_text (list of string) - tokenized context words
+    '''
+    # As context_window, a keyword of several syllables is never found (it is searched with "_" between its syllables)
+    syllables = [t.split(" ") for t in tokens]
+    w_idx = sum(len(parts) for parts in syllables)
+    if " " not in word:
+        position = 0
+        for parts in syllables:
+            if word in parts:
+                w_idx = position + parts.index(word) + 1
+                # The keyword is removed from the text before tokenization: remove it from the tokens that include it
+                syllables = [[p for p in parts if p!=word] for parts in syllables]
+                break
+            position += len(parts)
+    (lo, hi) = (max(w_idx-8, 0), w_idx+8)
+    window = []
+    position = 0
+    for parts in syllables:
+        if parts!=[] and lo<=position<hi:
+            window.append(" ".join(parts))
+        position += len(parts)
+    return window
+
+
+class Annotator:
+    '''
+    Disambiguation of every content word of a text, sentence by sentence.
+
+    Each sentence is POS tagged and tokenized once; the tags give the content words to annotate and their predicted
+    POS tags, and the tokens give the context words of each of them (see window_tokens). The meanings of each content
+    word are ranked as score_calc_phraser ranks them.
+    '''
+    def __init__(self, co_matrix, w_dict, word2vec_model, scrape, weights=[1,2], sense_cache=None, tagger=None, keywords=None,
+                 content_tags=CONTENT_TAGS, min_meanings=2, top_n=3, exact=False):
+        '''
+        Input:
+        + co_matrix, w_dict, word2vec_model, weights, scrape: see score_calc_phraser
+        + sense_cache (SenseIndex): optional index of preprocessed keywords, a new one is used if not given
+        + tagger (PosTagger): optional cached POS tagger, a new one is used if not given
+        + keywords (container of string): optional keywords of the dictionary (e.g. a DictStore), other words are not
+          looked up; all content words are looked up if None
+        + content_tags (list of string): underthesea POS tags of the annotated words
+        + min_meanings (int): minimum number of meanings of an annotated word (2: polysemous words only)
+        + top_n (int): number of meanings written for each word, all if None
+        + exact (bool): clean and tokenize the window of each word separately, as score_calc_phraser
+        '''
+        self.store = as_co_store(co_matrix)
+        self.size = min(self.store.shape)
+        self.w_dict = w_dict
+        self.word2vec_model = word2vec_model
+        self.weights = weights
+        self.sense_cache = sense_cache if sense_cache is not None else SenseIndex(scrape, w_dict, self.store, word2vec_model)
+        self.tagger = tagger if tagger is not None else PosTagger()
+        self.keywords = keywords
+        self.content_tags = set(content_tags)
+        self.min_meanings = min_meanings
+        self.top_n = top_n
+        self.exact = exact
+
+    def candidates(self, pos_res):
+        '''
+        Return the distinct content words of a tagged sentence, in order
+        '''
+        words = []
+        for (w, w_type) in pos_res:
+            if w_type in self.content_tags and w.strip()!='' and clean_test_dat(w)==w and w not in words:
+                if self.keywords is None or w in self.keywords:
+                    words.append(w)
+        return words
+
+    def annotate(self, text):
+        '''
+        Rank the meanings of every content word of a sentence
+
+        Input: text (string) - sentence
+        Output: (annotations, n_tokens) - one dict per annotated word (word, predicted POS tag, number of meanings and
+          ordered meanings), and number of tokens of the sentence
+        '''
+        pos_res = self.tagger(text.lower())
+        tokens = word_tokenize(clean_test_dat(text)) if not self.exact else None
+        annotations = []
+        for word in self.candidates(pos_res):
+            senses = self.sense_cache.get(word)
+            if len(senses)<self.min_meanings:
+                continue
+            cleaned_text = clean_context(word, text) if self.exact else window_tokens(word, tokens)
+            co_occur_scores = co_occur_score_reduce(*co_occur_sums(index_tokens(cleaned_text, self.w_dict, self.size),
+                                                                    senses.meaning_idx, self.store, senses.co_profile))
+            w_vector_scores = vector_scores(embed_tokens(cleaned_text, self.word2vec_model), senses.ex_vectors,
+                                            senses.ex_starts, senses.ex_owners, len(senses), senses.ex_sq_norms)
+            pred_word_type = predict_pos_tag(text, word, pos_res=pos_res, tag=self.tagger)
+            meanings = rank_senses(senses, pred_word_type, co_occur_scores, w_vector_scores, self.weights)
+            annotations.append({'word': word, 'pred_word_type': pred_word_type, 'n_meanings': len(meanings),
+                                'meanings': [{'index': m.index, 'word_type': m.word_type, 'meaning': m.meaning,
+                                              'score': float(m.score)} for m in meanings[:self.top_n]]})
+        return (annotations, len(pos_res))
+
+    def annotate_many(self, sentences, workers=1, max_pending=None):
+        '''
+        Annotate a stream of sentences, yielding the results in the input order
+
+        With several workers, the sentences are annotated in a process pool; at most max_pending sentences are read ahead,
+        so that memory stays bounded whatever the length of the text.
+
+        Input:
+        + sentences (iterable of string): sentences
+        + workers (int): number of worker processes, 1 to annotate in this process
+        + max_pending (int): maximum number of sentences being annotated, 4 per worker if None
+        Output: generator of dict - sentence number, sentence, number of tokens and annotations (see annotate)
+        '''
+        if workers==1:
+            for (i, text) in enumerate(sentences):
+                (annotations, n_tokens) = self.annotate(text)
+                yield {'sentence': i, 'text': text, 'tokens': n_tokens, 'words': annotations}
+            return
+        _state['annotator'] = self
+        max_pending = max_pending if max_pending is not None else 4*workers
+        pending = deque()
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            for (i, text) in enumerate(sentences):
+                pending.append((i, text, pool.submit(_annotate_one, text)))
+                if len(pending)>=max_pending:
+                    yield _result(*pending.popleft())
+            while pending:
+                yield _result(*pending.popleft())
+
+
+def _annotate_one(text):
+    # Run in a worker process
+    return _state['annotator'].annotate(text)
+
+
+def _result(i, text, future):
+    (annotations, n_tokens) = future.result()
+    return {'sentence': i, 'text': text, 'tokens': n_tokens, 'words': annotations}
+
+
+def annotate_stream(sentences, out, annotator, workers=1):
+    '''
+    Write the annotations of a stream of sentences as json lines (one line per sentence)
+
+    Input:
+    + sentences (iterable of string): sentences
+    + out (file): output file
+    + annotator (Annotator): annotator
+    + workers (int): number of worker processes
+    Output: report (dict) - numbers of sentences, tokens and annotated words, time in seconds, tokens and annotated
+      words per second
+    '''
+    report = {'sentences': 0, 'tokens': 0, 'annotated_words': 0}
+    start = time.perf_counter()
+    for record in annotator.annotate_many(sentences, workers):
+        out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        report['sentences'] += 1
+        report['tokens'] += record['tokens']
+        report['annotated_words'] += len(record['words'])
+    report['seconds'] = time.perf_counter() - start
+    report['tokens_per_second'] = report['tokens']/report['seconds'] if report['seconds']>0 else 0.0
+    report['annotated_words_per_second'] = report['annotated_words']/report['seconds'] if report['seconds']>0 else 0.0
+    return report
+
+
+def main(argv=None):
+    from modules import registry
+    parser = argparse.ArgumentParser(description='Rank the meanings of every content word of a text, one json line per sentence')
+    parser.add_argument('files', nargs='*', help='text files, standard input if none')
+    parser.add_argument('--out', help='output jsonl file, standard output if not given')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--fixtures', help='json file of saved dictionary entries, used instead of the dictionary database')
+    parser.add_argument('--db', default=registry.DICT_DB_PATH, help='dictionary database (DictStore), never scraped')
+    parser.add_argument('--test-data', action='store_true',
+                        help='annotate the context sentences of the test data (sample corpus for benchmarks)')
+    parser.add_argument('--top-n', type=int, default=3)
+    parser.add_argument('--weights', type=float, nargs=2, default=[1, 2], metavar=('CO', 'VEC'))
+    parser.add_argument('--exact', action='store_true', help='tokenize the window of each word separately')
+    args = parser.parse_args(argv)
+
+    if args.fixtures is not None:
+        from modules.benchmark import FixtureScraper
+        scrape = FixtureScraper(args.fixtures)
+    else:
+        from modules.dict_store import DictStore
+        scrape = DictStore(args.db)
+    # A new sense index over the database alone: the one of the application scrapes the keywords missing from it
+    annotator = Annotator(registry.get('co_matrix'), registry.get('w_dict'), registry.get('word_vectors'), scrape,
+                          list(args.weights), keywords=scrape, top_n=args.top_n, exact=args.exact)
+    if args.test_data:
+        from modules.evaluation import load_eval_data
+        sentences = (r['context'] for r in load_eval_data())
+    else:
+        sentences = read_sentences(args.files)
+    if args.out is not None:
+        with open(args.out, 'w', encoding='utf-8') as out:
+            report = annotate_stream(sentences, out, annotator, args.workers)
+    else:
+        report = annotate_stream(sentences, sys.stdout, annotator, args.workers)
+    print(json.dumps(report), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from modules.scrape_dict import dict_key, parse_dict_page, src_url
+
+
+class CircuitOpenError(Exception):
+    '''
+    Raised when the dictionary website is considered down and requests are not sent
+    '''
+
+
+class CircuitBreaker:
+    '''
+    Stops sending requests after failure_threshold consecutive failures, for reset_timeout seconds.
+    After that, a single trial request is let through: its success closes the circuit, its failure opens it again.
+    '''
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        '''
+        Return True if a request may be sent now
+        '''
+        return self.acquire() is not None
+
+    def acquire(self):
+        '''
+        Return "request" if a request may be sent now, "trial" if it is the trial request of an open circuit
+        (which must end with record_success, record_failure or release_trial), None if it may not be sent
+        '''
+        with self._lock:
+            if self.opened_at is None:
+                return 'request'
+            if not self.trial and self.clock() - self.opened_at >= self.reset_timeout:
+                self.trial = True
+                return 'trial'
+            return None
+
+    def release_trial(self):
+        '''
+        Let another trial request through, when the trial request ended without an outcome (e.g. it was cancelled)
+        '''
+        with self._lock:
+            self.trial = False
+
+    def record_success(self):
+        with self._lock:
+            (self.failures, self.opened_at, self.trial) = (0, None, False)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures>=self.failure_threshold:
+                (self.opened_at, self.trial) = (self.clock(), False)
+
+
+class DictFetcher:
+    '''
+    Asynchronous client of the Tra Tu dictionary website: pooled HTTP connections, bounded concurrency,
+    per-request timeouts, retries with exponential backoff and a circuit breaker.
+
+    The blocking HTTP calls (requests.Session) run in a thread pool sized to the concurrency limit.
+    fetcher.scrape(word, results) is a synchronous adapter with the same contract as web_scraping.
+    '''
+    def __init__(self, base_url=src_url, max_concurrency=8, timeout=5.0, retries=3, backoff=0.5, breaker=None):
+        '''
+        Input:
+        + base_url (string): url of the dictionary pages, the keyword key is appended to it
+        + max_concurrency (int): maximum number of requests in flight
+        + timeout (float): timeout of one request in seconds (connect and read)
+        + retries (int): number of retries after a failed request (connection error, timeout or 5xx status)
+        + backoff (float): delay before the first retry in seconds, doubled at each retry (with jitter)
+        + breaker (CircuitBreaker): circuit breaker shared by all requests, a default one if None
+        '''
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix='dict-fetch')
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def _semaphore(self):
+        # One semaphore per event loop, created in that loop
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    def _get(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        if response.status_code>=500:
+            response.raise_for_status()
+        return response
+
+    async def fetch(self, word):
+        '''
+        Fetch and parse the dictionary page of a keyword
+
+        Input: word (string) - keyword to search
+        Output: rows (list) - rows [word, word_type, meaning, examples]
+        '''
+        url = self.base_url + dict_key(word)
+        loop = asyncio.get_running_loop()
+        response = None
+        async with self._semaphore():
+            for attempt in range(self.retries + 1):
+                permit = self.breaker.acquire()
+                if permit is None:
+                    raise CircuitOpenError(f'dictionary website unavailable, "{word}" not fetched')
+                recorded = False
+                try:
+                    response = await asyncio.wait_for(loop.run_in_executor(self._executor, self._get, url), self.timeout*2)
+                    self.breaker.record_success()
+                    recorded = True
+                except (requests.RequestException, asyncio.TimeoutError):
+                    # Any error of requests (including redirect loops or broken responses) counts as a failure
+                    self.breaker.record_failure()
+                    recorded = True
+                    if attempt==self.retries:
+                        raise
+                finally:
+                    # A trial request cancelled or stopped by another error must not keep the circuit open forever
+                    if permit=='trial' and not recorded:
+                        self.breaker.release_trial()
+                if response is not None:
+                    break
+                await asyncio.sleep(self.backoff*(2**attempt)*(0.5 + random.random()/2))
+        response.raise_for_status()
+        rows = []
+        parse_dict_page(word, response.content, rows)
+        return rows
+
+    async def fetch_many(self, words):
+        '''
+        Fetch many keywords concurrently (e.g. to warm a cache or the local dictionary database)
+
+        Input: words (iterable of string) - keywords
+        Output: entries (dict) - {word: rows, or the exception raised while fetching it}
+        '''
+        words = list(words)
+        rows = await asyncio.gather(*[self.fetch(w) for w in words], return_exceptions=True)
+        return dict(zip(words, rows))
+
+    def _run(self, coroutine):
+        # Run a coroutine on the fetcher's background event loop, from any thread
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def scrape(self, word, results):
+        '''
+        Scrape dictionary database for the searched keyword (synchronous adapter)
+
+        Input:
+        + word (string): keyword to search
+        + results (list): result list to update the browsed results
+        Output: results (list) - updated result list after appending results of the searched keyword
+        '''
+        results.extend(self._run(self.fetch(word)))
+
+    __call__ = scrape
+
+    def warm(self, words, store):
+        '''
+        Fetch the keywords missing from a local dictionary database and save them
+
+        Input:
+        + words (iterable of string): keywords
+        + store (DictStore): local dictionary database
+        Output: failed (dict) - {word: exception} for the keywords which could not be fetched
+        '''
+        missing = [w for w in words if w not in store]
+        entries = self._run(self.fetch_many(missing))
+        failed = {}
+        for (word, rows) in entries.items():
+            if isinstance(rows, Exception):
+                failed[word] = rows
+            else:
+                store.add_word(word, rows)
+        return failed
+
+
+if __name__ == '__main__':
+    # Warm the local dictionary database with a list of keywords (one per line)
+    import sys
+    from modules.dict_store import DictStore
+    with open(sys.argv[1], encoding='utf-8') as f:
+        words = [line.strip() for line in f if line.strip()!='']
+    failed = DictFetcher().warm(words, DictStore(sys.argv[2]))
+    for (word, error) in failed.items():
+        print(f'{word}: {error!r}')
+    print(f'{len(words) - len(failed)} keywords available, {len(failed)} failed')
@@ -0,0 +1,110 @@
+import numpy as np
+from modules.co_matrix import as_co_store
+from modules.score_calc import (clean_context, closest_distances, co_occur_score_reduce, co_occur_sums_many, embed_tokens,
+                                index_tokens, meanings_frame, predict_pos_tag, rank_senses, vector_score_reduce)
+from modules.pos_tagging import PosTagger
+from modules.sense_index import SenseIndex
+
+
+def disambiguate_many(pairs, co_matrix, w_dict, word2vec_model, weights, scrape, sense_cache=None, batch_size=256,
+                      tagger=None, frames=True, tokenizer=None):
+    '''
+    Rank the meanings of many (keyword, context sentence) pairs, streaming the results in the input order
+
+    The pairs are read in batches of batch_size. Within a batch, each keyword is looked up and preprocessed once,
+    each distinct sentence is POS tagged once, and the co-occurrence counts of all context sentences of a keyword
+    are read from the matrix together. Results are the same as score_calc_phraser for each pair.
+
+    Input:
+    + pairs (iterable of (string, string)): pairs of keyword - context sentence
+    + co_matrix, w_dict, word2vec_model, weights, scrape: see score_calc_phraser
+    + sense_cache (SenseIndex): optional index of preprocessed keywords, a new one is used if not given
+    + batch_size (int): number of pairs processed together
+    + tagger (PosTagger): optional cached POS tagger shared with other callers, a new one is used if not given
+    + frames (bool): return the results as dataframes, or as lists of score_calc.Meaning if False
+    + tokenizer (ContextTokenizer): optional cached context tokenizer built on the same w_dict and matrix (see modules/tokenizing.py)
+    Output: generator of (word, text, results) - results is the ordered list of meanings of each pair
+    '''
+    store = as_co_store(co_matrix)
+    if sense_cache is None:
+        sense_cache = SenseIndex(scrape, w_dict, store, word2vec_model)
+    if tagger is None:
+        tagger = PosTagger()
+
+    batch = []
+    for pair in pairs:
+        batch.append(pair)
+        if len(batch)==batch_size:
+            yield from _disambiguate_batch(batch, store, w_dict, word2vec_model, weights, sense_cache, tagger, frames, tokenizer)
+            batch = []
+    if batch!=[]:
+        yield from _disambiguate_batch(batch, store, w_dict, word2vec_model, weights, sense_cache, tagger, frames, tokenizer)
+
+
+def _disambiguate_batch(batch, store, w_dict, word2vec_model, weights, sense_cache, tagger, frames, tokenizer):
+    size = min(store.shape)
+
+    # POS tag each distinct sentence once
+    sentences = sorted(set(text.lower() for (_, text) in batch))
+    tagged = dict(zip(sentences, tagger.tag_many(sentences)))
+
+    # Group the pairs by keyword, cleaning and tokenizing each distinct pair once
+    groups = {}
+    contexts = {}
+    for (word, text) in batch:
+        if (word, text) not in contexts:
+            contexts[(word, text)] = tokenizer.context(word, text) if tokenizer is not None else (clean_context(word, text), None)
+            groups.setdefault(word, []).append(text)
+
+    ranked = {}
+    for (word, texts) in groups.items():
+        senses = sense_cache.get(word)
+        cleaned = [contexts[(word, text)][0] for text in texts]
+        ctx_idx = [contexts[(word, text)][1] for text in texts]
+        ctx_idx = [idx if idx is not None else index_tokens(c, w_dict, size) for (c, idx) in zip(cleaned, ctx_idx)]
+        co_sums = co_occur_sums_many(ctx_idx, senses.meaning_idx, store, senses.co_profile)
+        vec_scores = vector_scores_many([embed_tokens(c, word2vec_model) for c in cleaned], senses)
+        for (text, (sums, cnt), w_vector_scores) in zip(texts, co_sums, vec_scores):
+            pred_word_type = predict_pos_tag(text, word, pos_res=tagged[text.lower()], tag=tagger)
+            meanings = rank_senses(senses, pred_word_type, co_occur_score_reduce(sums, cnt), w_vector_scores, weights)
+            ranked[(word, text)] = meanings_frame(meanings) if frames else meanings
+
+    for (word, text) in batch:
+        # Repeated pairs share the same (read-only) result
+        yield (word, text, ranked[(word, text)])
+
+
+def vector_scores_many(ctx_vectors_list, senses, max_floats=2**22):
+    '''
+    Return the word vector scores of several context sentences against the examples of the same keyword
+
+    The distances from the words of all context sentences to the example words are computed together, in chunks of
+    context words bounded by max_floats (the distances are computed through a context word x example word x dimension
+    array); each context sentence then averages its own rows, as score_calc.vector_scores.
+
+    Input:
+    + ctx_vectors_list (list of numpy matrix): word vectors of the in-vocabulary words of each context sentence
+    + senses (Senses): preprocessed dictionary entry of the keyword
+    + max_floats (int): maximum size of the intermediate array of a chunk
+    Output: list of list of float - word vector scores of each context sentence (see score_calc.vector_scores)
+    '''
+    n = len(senses)
+    lengths = [len(ctx) for ctx in ctx_vectors_list]
+    if len(senses.ex_starts)==0 or sum(lengths)==0:
+        return [vector_score_reduce(np.zeros(0), senses.ex_owners[:0], n) for _ in ctx_vectors_list]
+
+    rows = np.concatenate([ctx for ctx in ctx_vectors_list if len(ctx)!=0])
+    chunk = max(1, max_floats//max(senses.ex_vectors.shape[0]*senses.ex_vectors.shape[1], 1))
+    closest = np.concatenate([closest_distances(rows[i:i+chunk], senses.ex_vectors, senses.ex_starts, senses.ex_sq_norms)
+                              for i in range(0, len(rows), chunk)])
+    scores = []
+    start = 0
+    for length in lengths:
+        if length==0:
+            # Out-of-vocabulary context words are skipped, so an empty context leaves every meaning unscored
+            scores.append(vector_score_reduce(np.zeros(0), senses.ex_owners[:0], n))
+            continue
+        ex_scores = closest[start:start+length].sum(axis=0)/length
+        scores.append(vector_score_reduce(ex_scores, senses.ex_owners, n))
+        start += length
+    return scores
@@ -0,0 +1,566 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import numpy as np
+import pandas as pd
+from modules.profiling import Tracer
+from modules.scrape_dict import dict_key
+
+TEST_DATA = 'pages/analysis_data/test_100.xlsx'
+# Saved dictionary entries of the benchmarks, recorded from a dictionary database (see fixture_scraper)
+FIXTURES_PATH = 'trained_logs/bench_fixtures.json'
+STAGES = ['scrape', 'senses', 'pos_tag', 'clean_tokenize', 'co_occur', 'vector', 'sort', 'frame']
+
+
+class FixtureScraper:
+    '''
+    Scrape function backed by a json file of saved dictionary entries ({keyword key: rows}), so benchmarks never hit the network
+    '''
+    def __init__(self, path):
+        with open(path, encoding='utf-8') as f:
+            self.entries = json.load(f)
+
+    def __contains__(self, word):
+        return dict_key(word) in self.entries
+
+    def __call__(self, word, results):
+        key = dict_key(word)
+        if key not in self.entries:
+            raise KeyError(f'"{word}" is missing from the fixtures, record it first (see fixture_scraper)')
+        for row in self.entries[key]:
+            results.append([word] + row[1:])
+
+
+def record_fixtures(words, scrape, path):
+    '''
+    Save the dictionary entries of keywords into a fixtures file, keeping the entries already saved
+
+    Input:
+    + words (iterable of string): keywords
+    + scrape (function): scrape function to record from (DictStore, web_scraping, ...)
+    + path (string): fixtures json file
+    Output: n (int) - number of newly recorded keywords
+    '''
+    entries = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    n = 0
+    for word in words:
+        if dict_key(word) not in entries:
+            rows = []
+            scrape(word, rows)
+            entries[dict_key(word)] = rows
+            n += 1
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=1)
+    return n
+
+
+def context_variant(word, text, rng):
+    '''
+    Return a variant of a context sentence with one word removed at random, the keyword and its neighbours kept
+
+    Input:
+    + word (string): keyword
+    + text (string): context sentence
+    + rng (random.Random): random generator
+    Output: text (string) - context sentence with one word less (unchanged if it has 4 words or less around the keyword)
+    '''
+    words = text.split(" ")
+    syllables = [w.strip('.,;:!?"()').lower() for w in words]
+    keyword = word.lower().split(" ")
+    positions = [i for i in range(len(words)) if syllables[i:i+len(keyword)]==keyword]
+    # Keep the keyword and the word on each side of its first occurrence
+    kept = set(range(positions[0]-1, positions[0]+len(keyword)+1)) if positions!=[] else set()
+    candidates = [i for i in range(len(words)) if i not in kept and words[i]!='']
+    if len(candidates)<=4:
+        return text
+    del words[rng.choice(candidates)]
+    return " ".join(words)
+
+
+def load_test_data(path=TEST_DATA, scale=1, seed=0):
+    '''
+    Return the (keyword, context sentence, correct meaning) records of the test data, scaled up to scale times its size
+
+    Copies after the first one are variants of the test data, in shuffled order: each context sentence loses one word
+    at random (see context_variant), so that the caches of the sentences and of their tokens do not see the same inputs
+    again. The correct meaning of a variant is the one of its original sentence.
+
+    Input:
+    + path (string): test data (xlsx file with columns "word", "context_sentence" and "correct_meaning")
+    + scale (int): number of copies of the test data
+    + seed (int): seed of the variants and of the shuffling of the copies after the first one
+    Output: records (list of (string, string, string))
+    '''
+    df = pd.read_excel(path, header=0)
+    records = list(zip(df['word'].astype(str), df['context_sentence'].astype(str), df['correct_meaning'].astype(str)))
+    rng = random.Random(seed)
+    scaled = list(records)
+    for _ in range(scale - 1):
+        copy = [(word, context_variant(word, text, rng), meaning) for (word, text, meaning) in records]
+        rng.shuffle(copy)
+        scaled.extend(copy)
+    return scaled
+
+
+def load_pairs(path=TEST_DATA, scale=1, seed=0):
+    '''
+    Return the (keyword, context sentence) pairs of the test data, scaled up with variants in shuffled order (see load_test_data)
+    '''
+    return [(word, text) for (word, text, _) in load_test_data(path, scale, seed)]
+
+
+def fixture_scraper(path=FIXTURES_PATH, words=None, record_from=None):
+    '''
+    Return the scrape function of the benchmarks, backed by a fixtures file, first recording the keywords missing from it
+
+    The fixtures file is not part of the repository: it is recorded from a local dictionary database (DictStore),
+    never from the website, so that runs on different machines replay the same entries. Later runs are offline.
+
+    Input:
+    + path (string): fixtures json file
+    + words (iterable of string): keywords needed, those of the test data if None
+    + record_from (string): dictionary database (DictStore) to record the missing keywords from
+    Output: scrape (FixtureScraper)
+    '''
+    words = sorted(set(words if words is not None else (w for (w, _, _) in load_test_data())))
+    entries = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    missing = [w for w in words if dict_key(w) not in entries]
+    if missing!=[]:
+        if record_from is None:
+            raise ValueError(f'{len(missing)} keywords are missing from the fixtures {path} (e.g. "{missing[0]}"): '
+                             f'record them from a dictionary database with --record-from')
+        from modules.dict_store import DictStore
+        store = DictStore(record_from)
+        absent = [w for w in missing if w not in store]
+        if absent!=[]:
+            raise ValueError(f'{len(absent)} keywords are missing from the dictionary database {record_from} '
+                             f'(e.g. "{absent[0]}"): add them with modules/dict_store.py first')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        n = record_fixtures(missing, store, path)
+        print(f'Recorded {n} keywords into {path}', file=sys.stderr)
+    return FixtureScraper(path)
+
+
+def add_fixtures_arguments(parser):
+    '''
+    Add the --fixtures and --record-from options of the commands replaying saved dictionary entries
+    '''
+    parser.add_argument('--fixtures', default=FIXTURES_PATH,
+                        help='json file of saved dictionary entries (see benchmark.fixture_scraper)')
+    parser.add_argument('--record-from', help='dictionary database (DictStore) to record the keywords missing from the fixtures')
+
+
+def fixtures_from_args(parser, args, words):
+    '''
+    Return the fixture scraper of the parsed --fixtures and --record-from options, exiting with the error if keywords are missing
+    '''
+    try:
+        return fixture_scraper(args.fixtures, words, args.record_from)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def summarize(seconds):
+    '''
+    Return the count, mean and p50/p95/p99 (in milliseconds) of a list of durations in seconds
+    '''
+    ms = np.array(seconds)*1000
+    if len(ms)==0:
+        return {'count': 0}
+    return {'count': len(ms), 'mean': float(ms.mean()), 'p50': float(np.percentile(ms, 50)),
+            'p95': float(np.percentile(ms, 95)), 'p99': float(np.percentile(ms, 99))}
+
+
+def run_benchmark(pairs, co_matrix, w_dict, word2vec_model, scrape, weights=[1,2], mode='single', sense_cache=None, warmup=5,
+                  oov=None, expected=None, tagger=None, tokenizer=None):
+    '''
+    Replay pairs through score_calc_phraser (mode "single") or disambiguate_many (mode "batch") and time them
+
+    Input:
+    + pairs (list of (string, string)): pairs of keyword - context sentence
+    + co_matrix, w_dict, word2vec_model, scrape, weights, sense_cache: see score_calc_phraser
+    + mode (string): "single" or "batch"
+    + warmup (int): number of pairs run before timing (loads the underthesea models)
+    + oov (OOVResolver): optional fallback for unknown context words (mode "single" only)
+    + expected (list of string): optional correct meaning of each pair, to report the top-1 accuracy
+    + tagger (PosTagger): optional cached POS tagger, its counters are added to the report
+    + tokenizer (ContextTokenizer): optional cached context tokenizer, its counters are added to the report
+    Output: report (dict) - json-serializable report with per-pair and per-stage latencies (wall and CPU) in milliseconds
+      and counts of the processed meanings, examples and tokens
+    '''
+    from modules import batch, score_calc as sc
+
+    for (word, text) in pairs[:warmup]:
+        sc.score_calc_phraser(word, text, co_matrix, w_dict, word2vec_model, weights, scrape)
+
+    tracer = Tracer()
+    totals = []
+    top_meanings = []
+    start = time.perf_counter()
+    if mode=='single':
+        for (word, text) in pairs:
+            t = time.perf_counter()
+            results = sc.score_calc_phraser(word, text, co_matrix, w_dict, word2vec_model, weights, scrape,
+                                            sense_cache=sense_cache, tracer=tracer, oov=oov, tagger=tagger, tokenizer=tokenizer)
+            totals.append(time.perf_counter() - t)
+            top_meanings.append(results['meaning'].iloc[0] if len(results)!=0 else None)
+    else:
+        for (_, _, results) in batch.disambiguate_many(pairs, co_matrix, w_dict, word2vec_model, weights, scrape,
+                                                          sense_cache=sense_cache, tagger=tagger, tokenizer=tokenizer):
+            top_meanings.append(results['meaning'].iloc[0] if len(results)!=0 else None)
+    elapsed = time.perf_counter() - start
+
+    accuracy = None
+    if expected is not None:
+        accuracy = float(np.mean([str(top).strip()==str(exp).strip() for (top, exp) in zip(top_meanings, expected)]))
+
+    return {'mode': mode, 'n_pairs': len(pairs), 'sense_cache': sense_cache is not None, 'oov': oov is not None,
+            'accuracy': accuracy, 'total_seconds': elapsed, 'pairs_per_second': len(pairs)/elapsed,
+            'latency': summarize(totals), 'pos_tagger': tagger.stats() if tagger is not None else None,
+            'context_tokenizer': tokenizer.stats() if tokenizer is not None else None,
+            'stages': {name: summarize(tracer.timings[name]) for name in STAGES if name in tracer.timings},
+            'stages_cpu': {name: summarize(tracer.cpu_timings[name]) for name in STAGES if name in tracer.cpu_timings},
+            'counts': tracer.counts,
+            'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine()}}
+
+
+def pandas_rank_senses(senses, pred_word_type, co_occur_scores, w_vector_scores, weights):
+    '''
+    Previous pandas implementation of score_calc.rank_senses, kept as the reference of compare_ranking
+    '''
+    results = pd.DataFrame(senses.rows, columns=['word', 'word_type', 'meaning', 'examples'])
+    results['pred_word_type'] = pred_word_type
+    results['cleaned_meaning'] = pd.Series(senses.cleaned_meanings, index=results.index, dtype=object)
+    results['cleaned_examples'] = pd.Series(senses.cleaned_examples, index=results.index, dtype=object)
+    results['co_occur_score'] = list(co_occur_scores)
+    results['w_vector_score'] = list(w_vector_scores)
+    results['score'] = (results['co_occur_score'].fillna(1)*weights[0] + results['w_vector_score'].fillna(1)*weights[1])/sum(weights)
+    results['word_type_check'] = (results['word_type']!= results['pred_word_type'])
+    results.sort_values(by=['word_type_check', 'score'], ascending=[True, True], inplace=True)
+    results.reset_index(inplace=True)
+    return results
+
+
+def compare_ranking(pairs, co_matrix, w_dict, word2vec_model, scrape, weights=[1,2], repeat=20):
+    '''
+    Time the ranking of the scored meanings with the pandas reference and with score_calc.rank_senses (records),
+    and check that both give the same order
+
+    Input:
+    + pairs (list of (string, string)): pairs of keyword - context sentence
+    + co_matrix, w_dict, word2vec_model, scrape, weights: see score_calc_phraser
+    + repeat (int): number of times the pairs are ranked
+    Output: report (dict) - mean ranking time per pair in microseconds of each path, and whether the orders are identical
+    '''
+    from modules import score_calc as sc
+    from modules.co_matrix import as_co_store
+    from modules.sense_index import SenseIndex
+    store = as_co_store(co_matrix)
+    size = min(store.shape)
+    sense_cache = SenseIndex(scrape, w_dict, store, word2vec_model)
+    inputs = []
+    for (word, text) in pairs:
+        senses = sense_cache.get(word)
+        cleaned_text = sc.clean_context(word, text)
+        (sums, cnt) = sc.co_occur_sums(sc.index_tokens(cleaned_text, w_dict, size), senses.meaning_idx, store)
+        w_vector_scores = sc.vector_scores(sc.embed_tokens(cleaned_text, word2vec_model), senses.ex_vectors, senses.ex_starts,
+                                           senses.ex_owners, len(senses), senses.ex_sq_norms)
+        inputs.append((senses, sc.predict_pos_tag(text, word), sc.co_occur_score_reduce(sums, cnt), w_vector_scores))
+
+    identical = all(list(pandas_rank_senses(*x, weights)['index'])==[m.index for m in sc.rank_senses(*x, weights)] for x in inputs)
+    paths = {'pandas': lambda x: pandas_rank_senses(*x, weights), 'records': lambda x: sc.rank_senses(*x, weights),
+             'records_to_frame': lambda x: sc.meanings_frame(sc.rank_senses(*x, weights))}
+    report = {'n_pairs': len(pairs), 'identical_order': identical}
+    for (name, rank) in paths.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for x in inputs:
+                rank(x)
+        report[f'{name}_us'] = 1e6*(time.perf_counter() - start)/(repeat*max(len(inputs), 1))
+    return report
+
+
+def compare_top_k(pairs, co_matrix, w_dict, word2vec_model, scrape, k=3, weights=[1,2], repeat=5):
+    '''
+    Time the word vector scoring and ranking of all meanings and of the first k meanings only (score_calc.TopKRanking),
+    check that the first k meanings are the same and report how much word vector work was skipped
+
+    Input:
+    + pairs (list of (string, string)): pairs of keyword - context sentence
+    + co_matrix, w_dict, word2vec_model, scrape, weights: see score_calc_phraser
+    + k (int): number of meanings
+    + repeat (int): number of times the pairs are ranked
+    Output: report (dict) - mean time per pair in microseconds of each path, whether the first k meanings are identical,
+      share of pairs whose ranking was pruned and share of the distances between context and example words skipped
+    '''
+    from modules import score_calc as sc
+    from modules.co_matrix import as_co_store
+    from modules.sense_index import SenseIndex
+    store = as_co_store(co_matrix)
+    size = min(store.shape)
+    sense_cache = SenseIndex(scrape, w_dict, store, word2vec_model)
+    inputs = []
+    for (word, text) in pairs:
+        senses = sense_cache.get(word)
+        cleaned_text = sc.clean_context(word, text)
+        (sums, cnt) = sc.co_occur_sums(sc.index_tokens(cleaned_text, w_dict, size), senses.meaning_idx, store)
+        inputs.append((senses, sc.predict_pos_tag(text, word), sc.co_occur_score_reduce(sums, cnt),
+                       sc.embed_tokens(cleaned_text, word2vec_model)))
+
+    def full(senses, pred_word_type, co_occur_scores, ctx_vectors):
+        w_vector_scores = sc.vector_scores(ctx_vectors, senses.ex_vectors, senses.ex_starts, senses.ex_owners, len(senses),
+                                           senses.ex_sq_norms)
+        return sc.rank_senses(senses, pred_word_type, co_occur_scores, w_vector_scores, weights)[:k]
+
+    rankings = [sc.TopKRanking(*x, weights) for x in inputs]
+    identical = all([m.index for m in full(*x)]==[m.index for m in r.top(k)] for (x, r) in zip(inputs, rankings))
+    reports = [r.report() for r in rankings]
+    distances = sum(r['distances'] for r in reports)
+    report = {'n_pairs': len(pairs), 'k': k, 'identical_top_k': identical,
+              'pruned_share': sum(r['pruned'] for r in reports)/max(len(reports), 1),
+              'distances_skipped_share': sum(r['distances_skipped'] for r in reports)/distances if distances!=0 else 0.0,
+              'examples_skipped': sum(r['examples_skipped'] for r in reports)}
+    paths = {'full': lambda x: full(*x), 'top_k': lambda x: sc.TopKRanking(*x, weights).top(k)}
+    for (name, rank) in paths.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for x in inputs:
+                rank(x)
+        report[f'{name}_us'] = 1e6*(time.perf_counter() - start)/(repeat*max(len(inputs), 1))
+    return report
+
+
+def compare_batch(pairs, co_matrix, w_dict, word2vec_model, scrape, weights=[1,2], batch_size=256, repeat=3):
+    '''
+    Time the ranking of the pairs with score_calc_phraser in a loop (the baseline of the batch API), with
+    score_calc.rank_meanings in a loop sharing a sense index and a cached POS tagger, and in batches with
+    batch.disambiguate_many (dataframes as score_calc_phraser, or lists of meanings), and check that all give the same order
+
+    Each path starts from an empty sense index and a new POS tagger on each repetition, so that no path is favoured
+    by work cached by another one.
+
+    Input:
+    + pairs (list of (string, string)): pairs of keyword - context sentence
+    + co_matrix, w_dict, word2vec_model, scrape, weights: see score_calc_phraser
+    + batch_size (int): number of pairs processed together by disambiguate_many
+    + repeat (int): number of times the pairs are ranked (the fastest repetition is reported)
+    Output: report (dict) - pairs per second of each path, speedup of the batch path over the score_calc_phraser loop
+      (and over the cached loop, and without dataframes), whether it reaches the 10x target and whether the orders are identical
+    '''
+    from modules import batch, score_calc as sc
+    from modules.co_matrix import as_co_store
+    from modules.pos_tagging import PosTagger
+    from modules.sense_index import SenseIndex
+    store = as_co_store(co_matrix)
+
+    def phraser_loop():
+        return [list(sc.score_calc_phraser(word, text, store, w_dict, word2vec_model, weights, scrape)['index'])
+                for (word, text) in pairs]
+
+    def cached_loop():
+        (sense_cache, tagger) = (SenseIndex(scrape, w_dict, store, word2vec_model), PosTagger())
+        return [[m.index for m in sc.rank_meanings(word, text, store, w_dict, word2vec_model, weights, scrape,
+                                                   sense_cache=sense_cache, tagger=tagger)] for (word, text) in pairs]
+
+    def batched():
+        (sense_cache, tagger) = (SenseIndex(scrape, w_dict, store, word2vec_model), PosTagger())
+        return [list(results['index']) for (_, _, results) in
+                batch.disambiguate_many(pairs, store, w_dict, word2vec_model, weights, scrape, sense_cache=sense_cache,
+                                        batch_size=batch_size, tagger=tagger)]
+
+    def batched_records():
+        (sense_cache, tagger) = (SenseIndex(scrape, w_dict, store, word2vec_model), PosTagger())
+        return [[m.index for m in meanings] for (_, _, meanings) in
+                batch.disambiguate_many(pairs, store, w_dict, word2vec_model, weights, scrape, sense_cache=sense_cache,
+                                        batch_size=batch_size, tagger=tagger, frames=False)]
+
+    paths = {'phraser_loop': phraser_loop, 'cached_loop': cached_loop, 'batch': batched, 'batch_records': batched_records}
+    orders = [run() for run in paths.values()]
+    report = {'n_pairs': len(pairs), 'batch_size': batch_size, 'identical_order': all(o==orders[0] for o in orders)}
+    for (name, run) in paths.items():
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+        report[f'{name}_pairs_per_second'] = len(pairs)/min(seconds)
+    report['speedup'] = report['batch_pairs_per_second']/report['phraser_loop_pairs_per_second']
+    report['speedup_vs_cached_loop'] = report['batch_pairs_per_second']/report['cached_loop_pairs_per_second']
+    report['speedup_records'] = report['batch_records_pairs_per_second']/report['phraser_loop_pairs_per_second']
+    report['target_reached'] = report['speedup']>=10
+    return report
+
+
+def reference_clean_context(word, text):
+    '''
+    Previous implementation of score_calc.clean_context, kept as the reference of compare_preprocessing
+    '''
+    import regex
+    from underthesea import word_tokenize
+    from modules.score_calc import remove_items
+    cleaned_text = regex.sub(r'[^\p{Latin}\s]+', u'', text.lower().strip())
+    word = "_".join(word.split(" "))
+    w_idx = len(cleaned_text.split(word)[0].split(" "))
+    cleaned_text = cleaned_text.replace(word, "")
+    cleaned_text = remove_items(cleaned_text.split(" "), "")
+    cleaned_text = cleaned_text[max(w_idx-8, 0):min(w_idx+8, len(cleaned_text))]
+    return word_tokenize(" ".join(cleaned_text))
+
+
+def compare_preprocessing(pairs, co_matrix, w_dict, repeat=5):
+    '''
+    Time the preprocessing of the context sentences (cleaning, tokenization and co-occurrence matrix indices)
+    with the previous implementation, score_calc.clean_context and the cached tokenizer, and check that the tokens are identical
+
+    Input:
+    + pairs (list of (string, string)): pairs of keyword - context sentence
+    + co_matrix, w_dict: see score_calc_phraser
+    + repeat (int): number of times the pairs are preprocessed (the cached tokenizer is cold on the first pass only)
+    Output: report (dict) - mean preprocessing time per sentence in microseconds of each path, and whether the tokens are identical
+    '''
+    from modules import score_calc as sc
+    from modules.co_matrix import as_co_store
+    from modules.tokenizing import ContextTokenizer
+    size = min(as_co_store(co_matrix).shape)
+    tokenizer = ContextTokenizer(w_dict, size)
+    identical = all(reference_clean_context(w, t)==sc.clean_context(w, t)==tokenizer.tokens(w, t) for (w, t) in pairs)
+    tokenizer = ContextTokenizer(w_dict, size)
+    paths = {'reference': lambda w, t: sc.index_tokens(reference_clean_context(w, t), w_dict, size),
+             'clean_context': lambda w, t: sc.index_tokens(sc.clean_context(w, t), w_dict, size),
+             'cached_cold': tokenizer.context}
+    report = {'n_pairs': len(pairs), 'identical_tokens': identical}
+    for (name, preprocess) in paths.items():
+        start = time.perf_counter()
+        for _ in range(1 if name=='cached_cold' else repeat):
+            for (word, text) in pairs:
+                preprocess(word, text)
+        report[f'{name}_us'] = 1e6*(time.perf_counter() - start)/((1 if name=='cached_cold' else repeat)*max(len(pairs), 1))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for (word, text) in pairs:
+            tokenizer.context(word, text)
+    report['cached_warm_us'] = 1e6*(time.perf_counter() - start)/(repeat*max(len(pairs), 1))
+    report['context_tokenizer'] = tokenizer.stats()
+    return report
+
+
+def check_regressions(report, baseline=None, max_regression=0.2, limits=None, percentile='p95'):
+    '''
+    Return the list of stages whose latency regressed
+
+    Input:
+    + report (dict): output of run_benchmark
+    + baseline (dict): optional previous report; a stage fails if it is more than max_regression slower
+    + max_regression (float): allowed relative slow-down compared with the baseline
+    + limits (dict): optional absolute limits in milliseconds, {stage: ms}; "total" refers to the whole request
+    + percentile (string): "p50", "p95" or "p99"
+    Output: failures (list of string) - one message per failing stage
+    '''
+    stages = dict(report['stages'], total=report['latency'])
+    failures = []
+    for (name, stats) in stages.items():
+        if stats.get('count', 0)==0:
+            continue
+        value = stats[percentile]
+        if baseline is not None:
+            base = dict(baseline['stages'], total=baseline['latency']).get(name, {})
+            if base.get('count', 0)!=0 and value > base[percentile]*(1 + max_regression):
+                failures.append(f'{name}: {percentile} {value:.2f}ms vs {base[percentile]:.2f}ms in the baseline')
+        if limits is not None and name in limits and value > limits[name]:
+            failures.append(f'{name}: {percentile} {value:.2f}ms above the limit of {limits[name]:.2f}ms')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Latency/throughput benchmark of score_calc_phraser over the test data')
+    add_fixtures_arguments(parser)
+    parser.add_argument('--test-data', default=TEST_DATA)
+    parser.add_argument('--scale', type=int, default=1, help='size of the replayed data in copies of the test data '
+                                                             '(copies after the first are variants of the sentences)')
+    parser.add_argument('--mode', choices=['single', 'batch'], default='single')
+    parser.add_argument('--sense-index', action='store_true', help='use an in-memory sense index')
+    parser.add_argument('--pos-cache', action='store_true', help='use a cached POS tagger')
+    parser.add_argument('--token-cache', action='store_true', help='use a cached context tokenizer')
+    parser.add_argument('--oov', action='store_true', help='resolve unknown context words with the OOV fallback')
+    parser.add_argument('--output', help='write the json report to this file')
+    parser.add_argument('--baseline', help='json report of a previous run to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    parser.add_argument('--percentile', choices=['p50', 'p95', 'p99'], default='p95')
+    parser.add_argument('--limit', action='append', default=[], metavar='STAGE=MS', help='absolute latency limit of a stage')
+    parser.add_argument('--compare-ranking', action='store_true', help='only compare the pandas and records ranking paths')
+    parser.add_argument('--compare-top-k', type=int, metavar='K',
+                        help='only compare the ranking of all meanings with the pruned ranking of the first K meanings')
+    parser.add_argument('--compare-preprocessing', action='store_true',
+                        help='only compare the previous, current and cached preprocessing of the context sentences')
+    parser.add_argument('--compare-batch', action='store_true',
+                        help='only compare the throughput of score_calc_phraser in a loop and of disambiguate_many')
+    args = parser.parse_args(argv)
+
+    from modules import registry
+    from modules.co_matrix import as_co_store
+    from modules.pos_tagging import PosTagger
+    from modules.sense_index import SenseIndex
+    from modules.tokenizing import ContextTokenizer
+
+    records = load_test_data(args.test_data, args.scale)
+    pairs = [(word, text) for (word, text, _) in records]
+    scrape = fixtures_from_args(parser, args, [w for (w, _) in pairs])
+
+    co_matrix = registry.get('co_matrix')
+    w_dict = registry.get('w_dict')
+    word2vec_mod = registry.get('word_vectors')
+    if args.compare_ranking:
+        report = compare_ranking(pairs, co_matrix, w_dict, word2vec_mod, scrape)
+        print(json.dumps(report, indent=2))
+        return 0 if report['identical_order'] else 1
+    if args.compare_top_k is not None:
+        report = compare_top_k(pairs, co_matrix, w_dict, word2vec_mod, scrape, args.compare_top_k)
+        print(json.dumps(report, indent=2))
+        return 0 if report['identical_top_k'] else 1
+    if args.compare_preprocessing:
+        report = compare_preprocessing(pairs, co_matrix, w_dict)
+        print(json.dumps(report, indent=2))
+        return 0 if report['identical_tokens'] else 1
+    if args.compare_batch:
+        report = compare_batch(pairs, co_matrix, w_dict, word2vec_mod, scrape)
+        print(json.dumps(report, indent=2))
+        return 0 if report['identical_order'] else 1
+    sense_cache = SenseIndex(scrape, w_dict, co_matrix, word2vec_mod) if args.sense_index else None
+
+    oov = registry.get('oov') if args.oov else None
+    tagger = PosTagger() if args.pos_cache else None
+    tokenizer = ContextTokenizer(w_dict, min(as_co_store(co_matrix).shape)) if args.token_cache else None
+    report = run_benchmark(pairs, co_matrix, w_dict, word2vec_mod, scrape, mode=args.mode, sense_cache=sense_cache,
+                           oov=oov, expected=[meaning for (_, _, meaning) in records], tagger=tagger,
+                           tokenizer=tokenizer)
+    report['scale'] = args.scale
+    report['startup'] = registry.startup_report()
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    limits = {name: float(ms) for (name, ms) in (limit.split('=') for limit in args.limit)}
+    failures = check_regressions(report, baseline, args.max_regression, limits, args.percentile)
+    for failure in failures:
+        print('REGRESSION', failure, file=sys.stderr)
+    return 1 if failures!=[] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
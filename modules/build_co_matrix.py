@@ -0,0 +1,235 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter, deque
+from itertools import islice
+from multiprocessing import Pool
+import numpy as np
+import scipy.sparse as sp
+
+START, END = '<START>', '<END>'
+
+
+def read_corpus(paths):
+    '''
+    Read the corpus line by line
+
+    Input: paths (list of string) - text files, one sentence or paragraph per line
+    Output: generator of string - non-empty lines
+    '''
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line!='':
+                    yield line
+
+
+def chunked(iterable, size):
+    '''
+    Split an iterable into lists of at most size items
+    '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if chunk==[]:
+            return
+        yield chunk
+
+
+def bounded_imap(pool, func, chunks, max_pending):
+    '''
+    Like pool.imap, but reads at most max_pending chunks ahead of the results, so that memory stays bounded
+    (pool.imap reads its whole input into the task queue as fast as it can)
+    '''
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(func, (chunk,)))
+        if len(pending)>=max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def tokenize_lines(lines):
+    '''
+    Clean and tokenize lines as in the application (compound words joined with "_")
+
+    Input: lines (list of string) - raw lines
+    Output: tokens (list of list of string)
+    '''
+    from underthesea import word_tokenize
+    from modules.score_calc import clean_test_dat
+    return [word_tokenize(clean_test_dat(line), format='text').split() for line in lines]
+
+
+_vocab = None
+_window = None
+
+
+def _init_counter(vocab, window):
+    global _vocab, _window
+    (_vocab, _window) = (vocab, window)
+
+
+def count_pairs(sentences):
+    '''
+    Return the windowed co-occurrence pairs of tokenized sentences (run in the worker processes)
+
+    Input: sentences (list of list of string) - tokenized sentences (padded here with <START> and <END>)
+    Output: (rows, cols) - numpy arrays of word indices, one item per co-occurrence in both directions
+    '''
+    (rows, cols) = ([], [])
+    for tokens in sentences:
+        idx = np.array([_vocab[w] for w in [START] + tokens + [END] if w in _vocab], dtype=np.int32)
+        for d in range(1, min(_window, len(idx) - 1) + 1):
+            rows.extend((idx[:-d], idx[d:]))
+            cols.extend((idx[d:], idx[:-d]))
+    if rows==[]:
+        return (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+    return (np.concatenate(rows), np.concatenate(cols))
+
+
+class ShardedCounts:
+    '''
+    Co-occurrence counts accumulated in a bounded buffer of pairs, spilled to disk as sparse row shards
+    '''
+    def __init__(self, size, tmp_dir, n_shards=16, spill_pairs=20000000):
+        self.size = size
+        self.tmp_dir = tmp_dir
+        self.bounds = np.linspace(0, size, n_shards + 1).astype(np.int64)
+        self.spill_pairs = spill_pairs
+        self.buffer = []
+        self.buffered = 0
+        self.n_spills = 0
+
+    def add(self, rows, cols):
+        self.buffer.append((rows, cols))
+        self.buffered += len(rows)
+        if self.buffered>=self.spill_pairs:
+            self.spill()
+
+    def spill(self):
+        if self.buffered==0:
+            return
+        rows = np.concatenate([r for (r, _) in self.buffer])
+        cols = np.concatenate([c for (_, c) in self.buffer])
+        (self.buffer, self.buffered) = ([], 0)
+        for s in range(len(self.bounds) - 1):
+            (lo, hi) = (self.bounds[s], self.bounds[s+1])
+            mask = (rows>=lo) & (rows<hi)
+            shard = sp.coo_matrix((np.ones(mask.sum(), dtype=np.int64), (rows[mask] - lo, cols[mask])),
+                                  shape=(hi - lo, self.size)).tocsr()
+            sp.save_npz(os.path.join(self.tmp_dir, f'spill{self.n_spills}_shard{s}.npz'), shard)
+        self.n_spills += 1
+
+    def merge(self, out_path, dtype=np.int64):
+        '''
+        Sum the spilled shards, one row shard at a time, into a dense ".npy" (written through a memory map) or a sparse ".npz"
+        '''
+        self.spill()
+        dense = None
+        if out_path.endswith('.npy'):
+            dense = np.lib.format.open_memmap(out_path, mode='w+', dtype=dtype, shape=(self.size, self.size))
+        blocks = []
+        for s in range(len(self.bounds) - 1):
+            block = sp.csr_matrix((self.bounds[s+1] - self.bounds[s], self.size), dtype=np.int64)
+            for k in range(self.n_spills):
+                block = block + sp.load_npz(os.path.join(self.tmp_dir, f'spill{k}_shard{s}.npz'))
+            if dense is not None:
+                dense[self.bounds[s]:self.bounds[s+1]] = block.toarray()
+            else:
+                blocks.append(block.astype(dtype))
+        if dense is not None:
+            dense.flush()
+        else:
+            sp.save_npz(out_path, sp.vstack(blocks, format='csr'))
+
+
+def build_co_matrix(paths, out_dir, vocab_size=20000, vocab=None, window=5, workers=None, chunk_lines=2000,
+                    matrix_name='M_matrix_final.npy', dict_name='dict_final.json', spill_pairs=20000000):
+    '''
+    Build the corpus dictionary and the word co-occurrence matrix from a corpus, with bounded memory
+
+    Pass 1 tokenizes the corpus in a process pool, counts word frequencies and saves the tokenized corpus.
+    Pass 2 counts windowed co-occurrences in the process pool; counts are spilled to disk as sparse row shards
+    and summed shard by shard at the end.
+
+    Input:
+    + paths (list of string): corpus text files
+    + out_dir (string): folder of the outputs
+    + vocab_size (int): number of most frequent words kept (when vocab is not given)
+    + vocab (dict): optional existing dictionary {word: index} (e.g. dict_final.json) to build a compatible matrix
+    + window (int): maximum distance between two co-occurring words (counted in both directions)
+    + workers (int): number of worker processes, all cores if None
+    + chunk_lines (int): number of lines sent to a worker at a time
+    + matrix_name (string): file name of the matrix, ".npy" (dense) or ".npz" (sparse, see modules/co_matrix.py)
+    + dict_name (string): file name of the dictionary
+    + spill_pairs (int): number of buffered co-occurrence pairs before spilling to disk
+    Output: stats (dict) - number of lines, words, vocabulary size and time of each pass
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=out_dir, prefix='co_matrix_tmp_')
+    tokens_path = os.path.join(tmp_dir, 'tokens.txt')
+    stats = {'lines': 0, 'words': 0}
+    n_workers = workers if workers is not None else os.cpu_count()
+    try:
+        start = time.perf_counter()
+        freq = Counter()
+        with Pool(n_workers) as pool, open(tokens_path, 'w', encoding='utf-8') as tokens_file:
+            for sentences in bounded_imap(pool, tokenize_lines, chunked(read_corpus(paths), chunk_lines), 4*n_workers):
+                for tokens in sentences:
+                    freq.update(tokens)
+                    tokens_file.write(' '.join(tokens) + '\n')
+                    stats['lines'] += 1
+                    stats['words'] += len(tokens)
+        stats['tokenize_seconds'] = time.perf_counter() - start
+
+        if vocab is None:
+            words = [w for (w, _) in freq.most_common(vocab_size)] + [START, END]
+            vocab = {w: i for (i, w) in enumerate(sorted(set(words)))}
+        size = max(vocab.values()) + 1
+        stats['vocab_size'] = size
+        del freq
+
+        start = time.perf_counter()
+        counts = ShardedCounts(size, tmp_dir, spill_pairs=spill_pairs)
+        with Pool(n_workers, initializer=_init_counter, initargs=(vocab, window)) as pool, open(tokens_path, encoding='utf-8') as tokens_file:
+            lines = (line.split() for line in tokens_file)
+            for (rows, cols) in bounded_imap(pool, count_pairs, chunked(lines, chunk_lines), 4*n_workers):
+                counts.add(rows, cols)
+        counts.merge(os.path.join(out_dir, matrix_name))
+        stats['count_seconds'] = time.perf_counter() - start
+
+        with open(os.path.join(out_dir, dict_name), 'w', encoding='utf-8') as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        return stats
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the corpus dictionary and word co-occurrence matrix from a text corpus')
+    parser.add_argument('corpus', nargs='+', help='corpus text files (glob patterns allowed)')
+    parser.add_argument('--out-dir', default='trained_logs')
+    parser.add_argument('--vocab-size', type=int, default=20000)
+    parser.add_argument('--vocab', help='existing dictionary json, to build a matrix indexed by it')
+    parser.add_argument('--window', type=int, default=5)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--matrix-name', default='M_matrix_final.npy')
+    parser.add_argument('--dict-name', default='dict_final.json')
+    parser.add_argument('--spill-pairs', type=int, default=20000000)
+    args = parser.parse_args()
+
+    paths = sorted(p for pattern in args.corpus for p in glob.glob(pattern))
+    vocab = None
+    if args.vocab is not None:
+        with open(args.vocab, encoding='utf-8') as f:
+            vocab = json.load(f)
+    stats = build_co_matrix(paths, args.out_dir, args.vocab_size, vocab, args.window, args.workers,
+                            matrix_name=args.matrix_name, dict_name=args.dict_name, spill_pairs=args.spill_pairs)
+    print(json.dumps(stats, indent=2))
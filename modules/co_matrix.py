@@ -0,0 +1,107 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+class DenseCoMatrix:
+    '''
+    Co-occurrence store backed by a dense numpy matrix (in RAM or memory-mapped with np.load(mmap_mode='r'))
+    '''
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.shape = matrix.shape
+
+    def block(self, rows, cols):
+        '''
+        Return the dense sub-matrix M[rows][:, cols]
+
+        Input: rows, cols (numpy array of int) - row and column indices, duplicates allowed
+        Output: block (numpy matrix) - block[i, j] = M[rows[i], cols[j]]
+        '''
+        return np.asarray(self.matrix[np.ix_(rows, cols)])
+
+
+class SparseCoMatrix:
+    '''
+    Co-occurrence store backed by a scipy CSR/CSC sparse matrix
+    '''
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.shape = matrix.shape
+
+    def block(self, rows, cols):
+        '''
+        Return the dense sub-matrix M[rows][:, cols]
+
+        Input: rows, cols (numpy array of int) - row and column indices, duplicates allowed
+        Output: block (numpy matrix) - block[i, j] = M[rows[i], cols[j]]
+        '''
+        if self.matrix.format=='csc':
+            return self.matrix[:, cols][rows, :].toarray()
+        return self.matrix[rows, :][:, cols].toarray()
+
+
+def as_co_store(co_matrix):
+    '''
+    Wrap a co-occurrence matrix into a co-occurrence store
+
+    Input: co_matrix - numpy matrix, memory-mapped matrix, scipy sparse matrix or an existing store
+    Output: store (DenseCoMatrix or SparseCoMatrix)
+    '''
+    if isinstance(co_matrix, (DenseCoMatrix, SparseCoMatrix)):
+        return co_matrix
+    if sp.issparse(co_matrix):
+        return SparseCoMatrix(co_matrix.asformat('csr') if co_matrix.format not in ('csr', 'csc') else co_matrix)
+    return DenseCoMatrix(co_matrix)
+
+
+def load_co_matrix(path, mmap=True):
+    '''
+    Load a co-occurrence store from disk
+
+    Input:
+    + path (string): ".npz" file written by convert_to_sparse, or ".npy" dense matrix
+    + mmap (bool): memory-map the ".npy" matrix instead of reading it into RAM
+    Output: store (DenseCoMatrix or SparseCoMatrix)
+    '''
+    if path.endswith('.npz'):
+        return SparseCoMatrix(sp.load_npz(path))
+    return DenseCoMatrix(np.load(path, mmap_mode='r' if mmap else None))
+
+
+def convert_to_sparse(npy_path, npz_path, fmt='csr', chunk_rows=512):
+    '''
+    Convert a dense ".npy" co-occurrence matrix into a compressed sparse ".npz" file
+
+    Input:
+    + npy_path (string): path of the dense matrix, e.g. trained_logs/M_matrix_final.npy
+    + npz_path (string): path of the sparse matrix to write
+    + fmt (string): "csr" or "csc"
+    + chunk_rows (int): number of rows read from the memory-mapped matrix at a time
+    Output: matrix (scipy sparse matrix) - the converted matrix
+    '''
+    dense = np.load(npy_path, mmap_mode='r')
+    chunks = []
+    for i in range(0, dense.shape[0], chunk_rows):
+        chunks.append(sp.csr_matrix(np.asarray(dense[i:i+chunk_rows])))
+    matrix = sp.vstack(chunks, format=fmt)
+    sp.save_npz(npz_path, matrix)
+    return matrix
+
+
+def pair_sums(store, rows, cols):
+    '''
+    Return the symmetric co-occurrence counts M[i, j] + M[j, i] for all pairs of rows x cols
+
+    Input:
+    + store: co-occurrence store
+    + rows, cols (numpy array of int) - word indices
+    Output: sums (numpy matrix of int) - sums[a, b] = int(M[rows[a], cols[b]]) + int(M[cols[b], rows[a]])
+    '''
+    forward = store.block(rows, cols).astype(np.int64)
+    backward = store.block(cols, rows).astype(np.int64)
+    return forward + backward.T
+
+
+if __name__ == '__main__':
+    import sys
+    convert_to_sparse(sys.argv[1], sys.argv[2], *sys.argv[3:4])
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import threading
+from modules.scrape_dict import dict_key, parse_dict_page
+
+
+class DictStore:
+    '''
+    Local dictionary database (SQLite) holding the word type, meaning and examples of each keyword,
+    in the same order as on the Tra Tu dictionary pages.
+
+    A DictStore can be used directly as the "scrape" function of score_calc_phraser: store(word, results)
+    '''
+    def __init__(self, db_path, fallback=None):
+        '''
+        Input:
+        + db_path (string): path of the SQLite database file, created if it does not exist
+        + fallback (function): optional scrape function called for keywords missing from the store;
+          its results are saved into the store
+        '''
+        self.db_path = db_path
+        self.fallback = fallback
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+                                key TEXT NOT NULL,
+                                position INTEGER NOT NULL,
+                                word_type TEXT,
+                                meaning TEXT,
+                                examples TEXT,
+                                PRIMARY KEY (key, position))''')
+            conn.execute('CREATE TABLE IF NOT EXISTS words (key TEXT PRIMARY KEY)')
+
+    def _connect(self):
+        # SQLite connections cannot be shared between threads (Streamlit runs one thread per session)
+        # nor with forked processes (worker pool of modules/service.py)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid!=os.getpid():
+            conn = sqlite3.connect(self.db_path)
+            (self._local.conn, self._local.pid) = (conn, os.getpid())
+        return conn
+
+    def add_word(self, word, rows):
+        '''
+        Save the dictionary entry of a keyword, replacing any previous entry
+
+        Input:
+        + word (string): keyword
+        + rows (list): rows [word, word_type, meaning, examples] as appended by a scrape function
+        '''
+        key = dict_key(word)
+        with self._connect() as conn:
+            conn.execute('DELETE FROM entries WHERE key=?', (key,))
+            conn.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                             [(key, i, r[1], r[2], r[3]) for (i, r) in enumerate(rows)])
+            # Keywords without any meaning are kept too, so that they are not looked up again
+            conn.execute('INSERT OR IGNORE INTO words VALUES (?)', (key,))
+
+    def __contains__(self, word):
+        row = self._connect().execute('SELECT 1 FROM words WHERE key=?', (dict_key(word),)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM words').fetchone()[0]
+
+    def __call__(self, word, results):
+        '''
+        Look up the searched keyword in the local dictionary database
+
+        Input:
+        + word (string): keyword to search
+        + results (list): result list to update the browsed results
+        Output: results (list) - updated result list after appending results of the searched keyword
+        '''
+        rows = self._connect().execute('SELECT word_type, meaning, examples FROM entries WHERE key=? ORDER BY position',
+                                       (dict_key(word),)).fetchall()
+        if rows==[] and self.fallback is not None and word not in self:
+            fetched = []
+            self.fallback(word, fetched)
+            self.add_word(word, fetched)
+            results.extend(fetched)
+            return
+        for (word_type, mn, exps) in rows:
+            results.append([word, word_type, mn, exps])
+
+
+def ingest_html_dir(src_dir, db_path):
+    '''
+    Parse saved Tra Tu dictionary pages into a local dictionary database
+
+    Input:
+    + src_dir (string): folder of saved pages, one "<key>.html" file per keyword (e.g. "thay_đổi.html")
+    + db_path (string): path of the SQLite database file
+    Output: (n_words, failed) - number of ingested keywords and list of files which could not be parsed
+    '''
+    store = DictStore(db_path)
+    (n_words, failed) = (0, [])
+    for file_name in sorted(os.listdir(src_dir)):
+        (key, ext) = os.path.splitext(file_name)
+        if ext.lower() not in ('.html', '.htm'):
+            continue
+        word = " ".join(key.split("_"))
+        with open(os.path.join(src_dir, file_name), 'rb') as f:
+            content = f.read()
+        rows = []
+        try:
+            parse_dict_page(word, content, rows)
+        except AttributeError:
+            # Not a dictionary page (e.g. "word not found" page)
+            failed.append(file_name)
+            continue
+        store.add_word(word, rows)
+        n_words += 1
+    return (n_words, failed)
+
+
+if __name__ == '__main__':
+    import sys
+    (n_words, failed) = ingest_html_dir(sys.argv[1], sys.argv[2])
+    print(f'Ingested {n_words} keywords into {sys.argv[2]}, {len(failed)} files skipped')
@@ -0,0 +1,346 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+
+class QuantizedRows:
+    '''
+    Matrix of int8 vectors with one scale per vector, dequantized to float32 rows when indexed
+    (vectors[i] or vectors[list of i], like the vectors of KeyedVectors)
+    '''
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, data, scales):
+        '''
+        Input:
+        + data (numpy matrix of int8): quantized vectors, one per row
+        + scales (numpy array of float32): scale of each vector (vector = data*scale)
+        '''
+        self.data = data
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        rows = np.asarray(self.data[idx], dtype=np.float32)
+        return rows*np.asarray(self.scales[idx], dtype=np.float32)[..., None]
+
+
+class HalfRows:
+    '''
+    Matrix of float16 vectors, converted to float32 rows when indexed
+    '''
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        return np.asarray(self.data[idx], dtype=np.float32)
+
+
+class EmbeddingStore:
+    '''
+    Word vectors stored in float32, float16 or int8 (with one scale per vector), with the interface of gensim
+    KeyedVectors used by the application (index_to_key, key_to_index, vectors, vector_size, wv[word], word in wv).
+
+    If dot_distances is True, the squared norms of the example vectors are computed once per keyword
+    (see score_calc.build_senses) and distances come from a single dot-product matrix (see score_calc.pairwise_distances).
+    '''
+    def __init__(self, index_to_key, data, scales=None, dot_distances=False):
+        '''
+        Input:
+        + index_to_key (list of string): word of each vector
+        + data (numpy matrix): vectors (float32 or float16), or quantized vectors (int8, then scales is required)
+        + scales (numpy array): scale of each int8 vector
+        + dot_distances (bool): compute distances from dot products
+        '''
+        self.index_to_key = list(index_to_key)
+        self.key_to_index = {w: i for (i, w) in enumerate(self.index_to_key)}
+        self.data = data
+        self.scales = scales
+        self.precision = str(data.dtype)
+        if self.precision=='int8':
+            self.vectors = QuantizedRows(data, scales)
+        elif self.precision=='float16':
+            self.vectors = HalfRows(data)
+        else:
+            self.vectors = data
+        self.vector_size = data.shape[1]
+        self.dot_distances = dot_distances
+
+    @property
+    def nbytes(self):
+        '''
+        Memory footprint of the vectors (and scales) in bytes
+        '''
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.index_to_key)
+
+    def __contains__(self, word):
+        return word in self.key_to_index
+
+    def __getitem__(self, word):
+        return self.vectors[self.key_to_index[word]]
+
+
+def quantize(vectors, precision):
+    '''
+    Return the vectors converted to a precision
+
+    Input:
+    + vectors (numpy matrix): float32 vectors, one per row
+    + precision (string): "float32", "float16" or "int8"
+    Output: (data, scales) - converted vectors, and the scale of each vector (int8 only, None otherwise)
+    '''
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if precision=='int8':
+        # Symmetric quantization: the largest component of each vector is mapped to +/-127
+        scales = np.abs(vectors).max(axis=1)/127
+        scales[scales==0] = 1
+        data = np.clip(np.rint(vectors/scales[:, None]), -127, 127).astype(np.int8)
+        return (data, scales.astype(np.float32))
+    if precision in ('float32', 'float16'):
+        return (vectors.astype(precision), None)
+    raise ValueError(f'unknown precision {precision}, expected one of {PRECISIONS}')
+
+
+def from_keyed_vectors(word2vec_model, precision, dot_distances=False):
+    '''
+    Return an embedding store with the vectors of a Word2Vec model (or its KeyedVectors) in a precision
+    '''
+    from modules.score_calc import keyed_vectors
+    wv = keyed_vectors(word2vec_model)
+    (data, scales) = quantize(wv.vectors, precision)
+    return EmbeddingStore(wv.index_to_key, data, scales, dot_distances)
+
+
+def save_store(store, out_dir):
+    '''
+    Save an embedding store in a folder: "vectors.npy", "scales.npy" (int8 only) and "meta.json" (words and options)
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, 'vectors.npy'), store.data)
+    if store.scales is not None:
+        np.save(os.path.join(out_dir, 'scales.npy'), store.scales)
+    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'precision': store.precision, 'dot_distances': store.dot_distances, 'index_to_key': store.index_to_key},
+                  f, ensure_ascii=False)
+
+
+def load_store(store_dir, mmap=True):
+    '''
+    Load an embedding store saved with save_store
+
+    Input:
+    + store_dir (string): folder of the store
+    + mmap (bool): memory-map the vectors instead of reading them
+    Output: store (EmbeddingStore)
+    '''
+    with open(os.path.join(store_dir, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    mmap_mode = 'r' if mmap else None
+    data = np.load(os.path.join(store_dir, 'vectors.npy'), mmap_mode=mmap_mode)
+    scales = None
+    if meta['precision']=='int8':
+        scales = np.load(os.path.join(store_dir, 'scales.npy'), mmap_mode=mmap_mode)
+    return EmbeddingStore(meta['index_to_key'], data, scales, meta['dot_distances'])
+
+
+def export_store(model_path, out_dir, precision='float16', dot_distances=False):
+    '''
+    Export the vectors of a trained Word2Vec model as an embedding store
+    '''
+    from gensim.models import word2vec
+    store = from_keyed_vectors(word2vec.Word2Vec.load(model_path), precision, dot_distances)
+    save_store(store, out_dir)
+    return store
+
+
+def accuracy_report(records, variants, co_matrix, w_dict, scrape, weights=[1,2], tagger=None):
+    '''
+    Compare the ranking of the test data with word vectors of each precision to the ranking with the first one
+
+    Input:
+    + records (list of dict): test data (see evaluation.load_eval_data)
+    + variants (dict): name -> word vectors (Word2Vec model, KeyedVectors or EmbeddingStore), the first is the reference
+    + co_matrix, w_dict, scrape, weights: see score_calc_phraser
+    + tagger (PosTagger): optional cached POS tagger shared by all variants
+    Output: report (dict) - for each variant:
+      + accuracy (%): share of pairs whose first meaning is the correct one
+      + prediction_score: mean position of the correct meaning (over the pairs where it is found)
+      + top1_agreement, order_agreement (%): share of pairs with the same first meaning / the same order as the reference
+      + max_vector_score_diff: largest absolute difference of a word vector score with the reference
+      + seconds: mean scoring time of a pair
+    '''
+    from modules.score_calc import rank_meanings
+    from modules.sense_index import SenseIndex
+    if tagger is None:
+        from modules.pos_tagging import PosTagger
+        tagger = PosTagger()
+    reference = None
+    report = {}
+    for (name, wv) in variants.items():
+        sense_cache = SenseIndex(scrape, w_dict, co_matrix, wv)
+        orders = []
+        vector_scores = []
+        ranks = []
+        seconds = 0.0
+        for record in records:
+            start = time.perf_counter()
+            meanings = rank_meanings(record['word'], record['context'], co_matrix, w_dict, wv, weights, scrape,
+                                     sense_cache=sense_cache, tagger=tagger)
+            seconds += time.perf_counter() - start
+            orders.append([m.index for m in meanings])
+            vector_scores.append({m.index: m.w_vector_score for m in meanings})
+            listed = [str(m.meaning).strip() for m in meanings]
+            correct = record['correct_meaning'].strip()
+            ranks.append(listed.index(correct) + 1 if correct in listed else 0)
+        if reference is None:
+            reference = (orders, vector_scores)
+        found = [r for r in ranks if r!=0]
+        diffs = [abs(float(s) - float(ref[i])) for (scores, ref) in zip(vector_scores, reference[1])
+                 for (i, s) in scores.items() if s is not None and ref.get(i) is not None]
+        n = max(len(records), 1)
+        report[name] = {'accuracy': 100*sum(r==1 for r in ranks)/n,
+                        'prediction_score': float(np.mean(found)) if found!=[] else None,
+                        'top1_agreement': 100*sum(o[:1]==r[:1] for (o, r) in zip(orders, reference[0]))/n,
+                        'order_agreement': 100*sum(o==r for (o, r) in zip(orders, reference[0]))/n,
+                        'max_vector_score_diff': max(diffs) if diffs!=[] else 0.0,
+                        'seconds': seconds/n}
+    return report
+
+
+def benchmark_store(variants, n_context=12, n_examples=300, repeat=200, seed=0):
+    '''
+    Measure the memory footprint and the distance throughput of word vectors of each precision
+
+    The distances are the ones of the word vector score: n_context context words against n_examples example words
+    drawn at random from the vocabulary (the same words for every variant).
+
+    Input:
+    + variants (dict): name -> word vectors (KeyedVectors or EmbeddingStore)
+    + n_context, n_examples (int): number of context and example words
+    + repeat (int): number of timed runs
+    Output: report (dict) - for each variant: footprint in MB, lookup time of the example vectors in microseconds,
+      distances per second (and the precomputed norms in MB if the variant uses dot-product distances)
+    '''
+    from modules.score_calc import embed_tokens, keyed_vectors, pairwise_distances
+    rng = np.random.default_rng(seed)
+    report = {}
+    for (name, model) in variants.items():
+        wv = keyed_vectors(model)
+        vocab = wv.index_to_key
+        context = [vocab[i] for i in rng.integers(0, len(vocab), n_context)]
+        examples = [vocab[i] for i in rng.integers(0, len(vocab), n_examples)]
+        nbytes = getattr(wv, 'nbytes', None)
+        if nbytes is None:
+            nbytes = wv.vectors.nbytes
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            ex_vectors = embed_tokens(examples, wv)
+        lookup = (time.perf_counter() - start)/repeat
+
+        ctx_vectors = embed_tokens(context, wv)
+        sq_norms = None
+        if getattr(wv, 'dot_distances', False):
+            sq_norms = np.einsum('ij,ij->i', ex_vectors, ex_vectors)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            pairwise_distances(ctx_vectors, ex_vectors, sq_norms)
+        elapsed = time.perf_counter() - start
+        report[name] = {'footprint_mb': nbytes/2**20, 'lookup_us': 1e6*lookup,
+                        'distances_per_second': len(ctx_vectors)*len(ex_vectors)*repeat/elapsed}
+    return report
+
+
+def variants_of(word2vec_model, precisions, dot=False):
+    '''
+    Return the full-precision word vectors (reference) and their conversion to each precision, with and without
+    dot-product distances if dot is True
+    '''
+    from modules.score_calc import keyed_vectors
+    variants = {'reference': keyed_vectors(word2vec_model)}
+    for precision in precisions:
+        variants[precision] = from_keyed_vectors(word2vec_model, precision)
+        if dot:
+            variants[precision + '+dot'] = from_keyed_vectors(word2vec_model, precision, dot_distances=True)
+    return variants
+
+
+def main(argv=None):
+    from modules import registry
+    parser = argparse.ArgumentParser(description='Reduced-precision word vector store: export, accuracy report and benchmark')
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help='export the Word2Vec vectors as a store (used by the application if present)')
+    export.add_argument('--precision', choices=PRECISIONS, default='float16')
+    export.add_argument('--dot', action='store_true', help='compute distances from dot products with precomputed norms')
+    export.add_argument('--model', default=registry.WORD2VEC_MODEL_PATH)
+    export.add_argument('--out-dir', default=registry.WORD2VEC_STORE_DIR)
+    for command in ('report', 'bench'):
+        p = sub.add_parser(command, help='accuracy on the test data' if command=='report' else 'memory and throughput')
+        p.add_argument('--model', default=registry.WORD2VEC_MODEL_PATH)
+        p.add_argument('--precisions', nargs='+', choices=PRECISIONS, default=list(PRECISIONS))
+        p.add_argument('--dot', action='store_true', help='also measure each precision with dot-product distances')
+        p.add_argument('--output', help='write the json report to this file')
+        if command=='report':
+            from modules.benchmark import TEST_DATA, add_fixtures_arguments
+            p.add_argument('--test-data', default=TEST_DATA)
+            add_fixtures_arguments(p)
+            report_parser = p
+    args = parser.parse_args(argv)
+
+    if args.command=='export':
+        store = export_store(args.model, args.out_dir, args.precision, args.dot)
+        print(f'Exported {len(store)} vectors ({store.precision}, {store.nbytes/2**20:.1f} MB) to {args.out_dir}')
+        return 0
+
+    from gensim.models import word2vec
+    variants = variants_of(word2vec.Word2Vec.load(args.model), args.precisions, args.dot)
+    if args.command=='report':
+        from modules.benchmark import fixtures_from_args
+        from modules.evaluation import load_eval_data
+        records = load_eval_data(args.test_data)
+        scrape = fixtures_from_args(report_parser, args, [r['word'] for r in records])
+        report = accuracy_report(records, variants, registry.get('co_matrix'), registry.get('w_dict'), scrape,
+                                 tagger=registry.get('pos_tagger'))
+    else:
+        report = benchmark_store(variants)
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from modules.benchmark import TEST_DATA
+
+EVAL_CACHE_DIR = 'trained_logs/eval_cache'
+
+# Scoring state of the worker processes, set in the parent before the pool is forked and shared copy-on-write
+_state = {}
+
+
+def load_eval_data(path=TEST_DATA):
+    '''
+    Return the test data: keyword, correct POS tag (underthesea tag), correct meaning and context sentence of each pair
+
+    Input: path (string) - test data (xlsx file with columns "word", "word_type", "correct_meaning" and "context_sentence")
+    Output: records (list of dict)
+    '''
+    df = pd.read_excel(path, header=0)
+    return [{'word': str(r['word']), 'word_type': str(r['word_type']), 'correct_meaning': str(r['correct_meaning']),
+             'context': str(r['context_sentence'])} for (_, r) in df.iterrows()]
+
+
+def _raw_key(word, text):
+    return hashlib.sha1(json.dumps([word, text], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _float_or_none(v):
+    return None if v is None or pd.isna(v) else float(v)
+
+
+def _score_pair(pair):
+    # Run in a worker process: raw scores of each meaning, in the order of the dictionary
+    from modules.score_calc import rank_meanings
+    (word, text) = pair
+    start = time.perf_counter()
+    meanings = rank_meanings(word, text, _state['co_matrix'], _state['w_dict'], _state['word_vectors'], [1,2],
+                                 _state['scrape'], sense_cache=_state['sense_cache'], tagger=_state['tagger'])
+    seconds = time.perf_counter() - start
+    meanings = sorted(meanings, key=lambda m: m.index)
+    return {'meanings': [m.meaning for m in meanings], 'word_types': [m.word_type for m in meanings],
+            'pred_word_type': _state['predict'](text, word),
+            'co_occur_score': [_float_or_none(m.co_occur_score) for m in meanings],
+            'w_vector_score': [_float_or_none(m.w_vector_score) for m in meanings], 'seconds': seconds}
+
+
+def load_state(fixtures=None, cache_dir=EVAL_CACHE_DIR):
+    '''
+    Load the models and the dictionary source used by the workers (in the parent process, before forking).
+    The preprocessed keywords are persisted in cache_dir, so that later runs do not preprocess them again.
+
+    Input:
+    + fixtures (string): optional fixtures json file (see benchmark.FixtureScraper) used instead of the dictionary
+    + cache_dir (string): folder of the evaluation cache
+    '''
+    from modules import registry
+    from modules.sense_index import SenseIndex
+    registry.preload(['co_matrix', 'w_dict', 'word_vectors', 'pos_tagger'])
+    for name in ['co_matrix', 'w_dict', 'word_vectors']:
+        _state[name] = registry.get(name)
+    _state['tagger'] = registry.get('pos_tagger')
+    _state['predict'] = _state['tagger'].predict
+    if fixtures is not None:
+        from modules.benchmark import FixtureScraper
+        _state['scrape'] = FixtureScraper(fixtures)
+    else:
+        _state['scrape'] = registry.get('dictionary')
+    _state['sense_cache'] = SenseIndex(_state['scrape'], _state['w_dict'], _state['co_matrix'], _state['word_vectors'],
+                                       cache_dir=os.path.join(cache_dir, 'senses'))
+
+
+def score_pairs(pairs, workers=None, cache_dir=EVAL_CACHE_DIR, refresh=False):
+    '''
+    Return the raw scores of each pair, computed in a process pool or read from the cache of previous runs
+
+    Input:
+    + pairs (list of (string, string)): pairs of keyword - context sentence
+    + workers (int): number of worker processes, all cores if None
+    + cache_dir (string): folder of the evaluation cache (see load_state, which must be called first)
+    + refresh (bool): score all pairs again, ignoring the cached raw scores
+    Output: raws (list of dict) - meanings, word types, predicted POS tag, co-occurrence and word vector scores
+      of each meaning (in the order of the dictionary) and scoring time of each pair
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(cache_dir, 'raw_scores.json')
+    cache = {}
+    if os.path.exists(cache_path) and not refresh:
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+    missing = list(dict.fromkeys(p for p in pairs if _raw_key(*p) not in cache))
+    if missing!=[]:
+        n_workers = workers if workers is not None else os.cpu_count()
+        with ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            for (pair, raw) in zip(missing, pool.map(_score_pair, missing, chunksize=max(1, len(missing)//(4*n_workers)))):
+                cache[_raw_key(*pair)] = raw
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    return [cache[_raw_key(*p)] for p in pairs]
+
+
+class RawScores:
+    '''
+    Raw scores of all meanings of all pairs, flattened into arrays for the vectorized ranking of many weight settings
+
+    + co, vec (numpy array of float): co-occurrence and word vector score of each meaning (1 when missing, as in the ranking)
+    + check (numpy array of bool): True if the word type of the meaning differs from the predicted POS tag
+    + starts, lengths (numpy array of int): first meaning and number of meanings of each pair
+    + correct (numpy array of int): flat index of the correct meaning of each pair, -1 if it is not in the dictionary entry
+    + pos_correct (numpy array of bool): True if the POS tag of the keyword was predicted correctly
+    + seconds (numpy array of float): scoring time of each pair
+    '''
+    def __init__(self, records, raws):
+        '''
+        Input:
+        + records (list of dict): test data (see load_eval_data)
+        + raws (list of dict): raw scores of each pair (see score_pairs)
+        '''
+        from modules.score_calc import vn_pos_tag
+        self.lengths = np.array([len(raw['meanings']) for raw in raws], dtype=np.int64)
+        self.starts = np.cumsum(self.lengths) - self.lengths
+        score = lambda values: np.array([1.0 if v is None else v for raw in raws for v in raw[values]], dtype=np.float64)
+        (self.co, self.vec) = (score('co_occur_score'), score('w_vector_score'))
+        self.check = np.array([t!=raw['pred_word_type'] for raw in raws for t in raw['word_types']], dtype=bool)
+        self.correct = np.full(len(raws), -1, dtype=np.int64)
+        for (k, (record, raw)) in enumerate(zip(records, raws)):
+            meanings = [str(mn).strip() for mn in raw['meanings']]
+            if record['correct_meaning'].strip() in meanings:
+                self.correct[k] = self.starts[k] + meanings.index(record['correct_meaning'].strip())
+        self.pos_correct = np.array([vn_pos_tag(record['word_type'])==raw['pred_word_type']
+                                     for (record, raw) in zip(records, raws)], dtype=bool)
+        self.seconds = np.array([raw['seconds'] for raw in raws], dtype=np.float64)
+
+    def ranks(self, weights):
+        '''
+        Return the position of the correct meaning in the ordered list of meanings of each pair, for each weight setting
+
+        The ordering is the one of score_calc_phraser: meanings of the predicted POS tag first, then by increasing
+        final score, ties kept in the order of the dictionary.
+
+        Input: weights (numpy matrix) - one row [co-occurrence weight, word vector weight] per weight setting
+        Output: ranks (numpy matrix of int) - one row per weight setting, one column per pair: 1 for the first meaning,
+          0 when the correct meaning is not in the dictionary entry
+        '''
+        weights = np.asarray(weights, dtype=np.float64).reshape(-1, 2)
+        scores = (weights[:, :1]*self.co + weights[:, 1:]*self.vec)/weights.sum(axis=1, keepdims=True)
+        ranks = np.zeros((len(weights), len(self.lengths)), dtype=np.int64)
+        found = np.flatnonzero(self.correct>=0)
+        if len(found)==0:
+            return ranks
+        # Compare every meaning with the correct meaning of its pair
+        owner = np.repeat(np.arange(len(self.lengths)), self.lengths)
+        correct = self.correct[owner]
+        position = np.arange(len(owner))
+        correct_scores = scores[:, np.maximum(correct, 0)]
+        same_check = self.check==self.check[np.maximum(correct, 0)]
+        before = ((self.check < self.check[np.maximum(correct, 0)])
+                  | (same_check & ((scores<correct_scores) | ((scores==correct_scores) & (position<correct)))))
+        # Number of meanings ranked before the correct one in each pair, from the cumulative sum over all meanings
+        cum = np.concatenate([np.zeros((len(weights), 1), dtype=np.int64), np.cumsum(before, axis=1)], axis=1)
+        ends = self.starts[found] + self.lengths[found]
+        ranks[:, found] = 1 + cum[:, ends] - cum[:, self.starts[found]]
+        return ranks
+
+    def metrics(self, weights):
+        '''
+        Return the metrics of the Evaluation page for each weight setting
+
+        Input: weights (numpy matrix) - one row [co-occurrence weight, word vector weight] per weight setting
+        Output: metrics (dataframe) - one row per weight setting:
+        + accuracy (%): share of pairs whose first meaning is the correct one
+        + absolute_accuracy (%): accuracy over the pairs whose POS tag was predicted correctly
+        + prediction_score: mean position of the correct meaning (over the pairs where it is found)
+        + ratio_score: mean of the position of the correct meaning divided by the number of meanings
+        + time (s): mean scoring time of a pair
+        '''
+        weights = np.asarray(weights, dtype=np.float64).reshape(-1, 2)
+        ranks = self.ranks(weights)
+        top = ranks==1
+        found = self.correct>=0
+        n_pos = max(int(self.pos_correct.sum()), 1)
+        return pd.DataFrame({'co_occur_weight': weights[:, 0], 'w_vector_weight': weights[:, 1],
+                             'accuracy': 100*top.mean(axis=1),
+                             'absolute_accuracy': 100*top[:, self.pos_correct].sum(axis=1)/n_pos,
+                             'prediction_score': ranks[:, found].mean(axis=1) if found.any() else np.nan,
+                             'ratio_score': (ranks[:, found]/self.lengths[found]).mean(axis=1) if found.any() else np.nan,
+                             'time': self.seconds.mean() if len(self.seconds)!=0 else np.nan})
+
+
+def weight_grid(co_weights, vec_weights):
+    '''
+    Return every combination of co-occurrence and word vector weights, leaving out the combination (0, 0)
+    '''
+    grid = np.array([(a, b) for a in co_weights for b in vec_weights if a + b>0], dtype=np.float64)
+    return grid.reshape(-1, 2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluation metrics (accuracy, absolute accuracy, prediction and ratio scores) on the test data')
+    parser.add_argument('--test-data', default=TEST_DATA)
+    parser.add_argument('--fixtures', help='json file of saved dictionary entries, used instead of the dictionary')
+    parser.add_argument('--cache-dir', default=EVAL_CACHE_DIR)
+    parser.add_argument('--refresh', action='store_true', help='score all pairs again instead of using the cached raw scores')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--weights', type=float, nargs=2, default=[1, 2], metavar=('CO', 'VEC'))
+    parser.add_argument('--grid', type=float, nargs=3, metavar=('START', 'STOP', 'STEP'),
+                        help='also sweep both weights over numpy.arange(START, STOP, STEP)')
+    args = parser.parse_args(argv)
+
+    records = load_eval_data(args.test_data)
+    start = time.perf_counter()
+    load_state(args.fixtures, args.cache_dir)
+    raws = score_pairs([(r['word'], r['context']) for r in records], args.workers, args.cache_dir, args.refresh)
+    raw_scores = RawScores(records, raws)
+    print(f'Scored {len(records)} pairs in {time.perf_counter() - start:.2f}s '
+          f'(POS tag correct for {int(raw_scores.pos_correct.sum())}, correct meaning found for {int((raw_scores.correct>=0).sum())})')
+    print(raw_scores.metrics([args.weights]).to_string(index=False))
+
+    if args.grid is not None:
+        values = np.arange(*args.grid)
+        start = time.perf_counter()
+        grid = raw_scores.metrics(weight_grid(values, values))
+        print(f'\nSwept {len(grid)} weight settings in {time.perf_counter() - start:.3f}s, best settings:')
+        grid = grid.sort_values(['accuracy', 'prediction_score'], ascending=[False, True], kind='stable')
+        print(grid.head(10).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
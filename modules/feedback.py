@@ -0,0 +1,351 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import numpy as np
+from underthesea import word_tokenize
+from modules.score_calc import context_window, embed_tokens, keyed_vectors
+
+
+class FeedbackLog:
+    '''
+    Append-only log of user feedback, one json record per line (no user name is stored):
+    {"time": ..., "word": ..., "context": ..., "meaning_index": ..., "meaning": ...}
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder!='':
+            os.makedirs(folder, exist_ok=True)
+
+    def append(self, record):
+        '''
+        Append a record (the time is added) and return it
+        '''
+        record = dict(record, time=time.time())
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+        return record
+
+    def read(self, offset=0):
+        '''
+        Return the records appended after a position of the log
+
+        Input: offset (int) - position in bytes (0 for the whole log)
+        Output: (records, offset) - records, and the position after the last complete record
+        '''
+        if not os.path.exists(self.path):
+            return ([], offset)
+        records = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Record being written
+                    break
+                offset += len(line)
+                try:
+                    records.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    continue
+        return (records, offset)
+
+
+class KeywordExamples:
+    '''
+    Feedback examples of the meanings of one keyword, as slots of word vectors padded to max_tokens words
+
+    Slots are only appended (the arrays double when full) or marked removed (owner -1), so that the arrays returned
+    to readers are never modified; removed slots are dropped by compact, which builds new arrays.
+    Each meaning keeps at most max_examples examples, a uniform sample of all its feedback (reservoir sampling).
+    '''
+    def __init__(self, max_tokens, vector_size, max_examples, rng):
+        self.vectors = np.zeros((4, max_tokens, vector_size), dtype=np.float32)
+        self.owners = np.full(4, -1, dtype=np.int64)
+        self.used = 0
+        self.removed = 0
+        self.max_examples = max_examples
+        self.rng = rng
+        # Slots of the kept examples and number of feedback of each meaning
+        self.slots = {}
+        self.seen = {}
+
+    def _append(self, meaning_index, vectors):
+        if self.used==len(self.owners):
+            grown = np.zeros((2*len(self.owners),) + self.vectors.shape[1:], dtype=np.float32)
+            grown[:self.used] = self.vectors[:self.used]
+            owners = np.full(2*len(self.owners), -1, dtype=np.int64)
+            owners[:self.used] = self.owners[:self.used]
+            (self.vectors, self.owners) = (grown, owners)
+        slot = self.used
+        # Padding with the first word leaves the closest distances unchanged
+        self.vectors[slot] = vectors[0]
+        self.vectors[slot, :len(vectors)] = vectors
+        self.owners[slot] = meaning_index
+        self.used += 1
+        return slot
+
+    def add(self, meaning_index, vectors):
+        '''
+        Add an example of a meaning
+
+        Input:
+        + meaning_index (int): position of the meaning in the dictionary entry
+        + vectors (numpy matrix): word vectors of the example, at most max_tokens
+        Output: kept (bool) - False if the reservoir of the meaning is full and the example was not sampled
+        '''
+        self.seen[meaning_index] = self.seen.get(meaning_index, 0) + 1
+        slots = self.slots.setdefault(meaning_index, [])
+        if len(slots)<self.max_examples:
+            slots.append(self._append(meaning_index, vectors))
+            return True
+        j = self.rng.randrange(self.seen[meaning_index])
+        if j>=self.max_examples:
+            return False
+        self.owners[slots[j]] = -1
+        self.removed += 1
+        slots[j] = self._append(meaning_index, vectors)
+        return True
+
+    def examples(self):
+        return (self.vectors[:self.used], self.owners[:self.used].copy())
+
+    def compact(self):
+        '''
+        Drop the removed slots, return their number
+        '''
+        if self.removed==0:
+            return 0
+        live = np.flatnonzero(self.owners[:self.used]>=0)
+        capacity = max(4, len(live))
+        vectors = np.zeros((capacity,) + self.vectors.shape[1:], dtype=np.float32)
+        vectors[:len(live)] = self.vectors[live]
+        owners = np.full(capacity, -1, dtype=np.int64)
+        owners[:len(live)] = self.owners[live]
+        new_slot = {int(old): new for (new, old) in enumerate(live)}
+        self.slots = {i: [new_slot[s] for s in slots] for (i, slots) in self.slots.items()}
+        (self.vectors, self.owners, self.used) = (vectors, owners, len(live))
+        (removed, self.removed) = (self.removed, 0)
+        return removed
+
+
+class FeedbackIndex:
+    '''
+    Pre-embedded feedback examples of each keyword, updated incrementally: an example is embedded once when it is added
+    (at most max_tokens words, the window of the context sentence around the keyword) and is searchable at once.
+    As each meaning keeps at most max_examples examples, the cost of scoring a keyword stays bounded as feedback grows.
+    '''
+    def __init__(self, word2vec_model, max_examples=20, max_tokens=16, seed=0):
+        '''
+        Input:
+        + word2vec_model: trained Word2Vec model (or its KeyedVectors)
+        + max_examples (int): maximum number of feedback examples kept per meaning
+        + max_tokens (int): maximum number of words of a feedback example
+        + seed (int): seed of the reservoir sampling
+        '''
+        self.word2vec_model = word2vec_model
+        self.vector_size = keyed_vectors(word2vec_model).vector_size
+        self.max_examples = max_examples
+        self.max_tokens = max_tokens
+        self.rng = random.Random(seed)
+        self._keywords = {}
+        self._lock = threading.Lock()
+        self.counters = {'added': 0, 'kept': 0, 'empty': 0, 'compacted': 0}
+
+    def embed(self, word, text):
+        '''
+        Return the word vectors of the feedback example made of a context sentence, cleaned as the dictionary examples
+        '''
+        example = " ".join(word_tokenize(context_window(word, text)))
+        return embed_tokens(example.split(" "), self.word2vec_model)[:self.max_tokens]
+
+    def add(self, word, meaning_index, text, vectors=None):
+        '''
+        Add a context sentence as an example of a meaning of a keyword
+
+        Input:
+        + word (string): keyword
+        + meaning_index (int): position of the meaning in the dictionary entry
+        + text (string): context sentence
+        + vectors (numpy matrix): word vectors of the example, computed with embed if not given
+        Output: kept (bool) - False if the example has no known word or was not sampled
+        '''
+        if vectors is None:
+            vectors = self.embed(word, text)
+        key = "_".join(word.split(" "))
+        with self._lock:
+            self.counters['added'] += 1
+            if len(vectors)==0:
+                self.counters['empty'] += 1
+                return False
+            examples = self._keywords.get(key)
+            if examples is None:
+                examples = KeywordExamples(self.max_tokens, self.vector_size, self.max_examples, self.rng)
+                self._keywords[key] = examples
+            kept = examples.add(int(meaning_index), vectors)
+            self.counters['kept'] += kept
+            return kept
+
+    def examples(self, word):
+        '''
+        Return the feedback examples of a keyword (see score_calc.vector_scores)
+
+        Input: word (string) - keyword
+        Output: (vectors, owners) - padded word vectors of the examples and their meaning (-1 for removed examples),
+          None if the keyword has no feedback
+        '''
+        with self._lock:
+            examples = self._keywords.get("_".join(word.split(" ")))
+            return examples.examples() if examples is not None else None
+
+    def compact(self, min_removed=0.25):
+        '''
+        Drop the removed examples of the keywords where they are at least a share min_removed of the slots
+
+        Output: n (int) - number of dropped slots
+        '''
+        with self._lock:
+            keywords = list(self._keywords.values())
+        n = 0
+        for examples in keywords:
+            with self._lock:
+                if examples.removed!=0 and examples.removed>=min_removed*examples.used:
+                    n += examples.compact()
+        with self._lock:
+            self.counters['compacted'] += n
+        return n
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, keywords=len(self._keywords))
+            stats['slots'] = sum(e.used for e in self._keywords.values())
+            stats['removed_slots'] = sum(e.removed for e in self._keywords.values())
+        return stats
+
+
+class FeedbackStore:
+    '''
+    User feedback: the append-only log (source of truth) and the index of feedback examples built from it.
+    At startup the log is replayed into the index; a background thread compacts the index periodically.
+    '''
+    def __init__(self, path, word2vec_model, max_examples=20, compact_interval=60.0):
+        '''
+        Input:
+        + path (string): feedback log (jsonl file)
+        + word2vec_model: trained Word2Vec model (or its KeyedVectors)
+        + max_examples (int): maximum number of feedback examples kept per meaning
+        + compact_interval (float): seconds between two compactions of the index, None for no background compaction
+        '''
+        self.log = FeedbackLog(path)
+        self.index = FeedbackIndex(word2vec_model, max_examples)
+        self._offset = 0
+        self._lock = threading.Lock()
+        self.replay()
+        self._stop = threading.Event()
+        self._thread = None
+        if compact_interval is not None:
+            self._thread = threading.Thread(target=self._compact_loop, args=(compact_interval,), daemon=True)
+            self._thread.start()
+
+    def replay(self):
+        '''
+        Add the records appended to the log since the last replay (by this or another process) to the index,
+        return their number
+        '''
+        with self._lock:
+            (records, self._offset) = self.log.read(self._offset)
+            for record in records:
+                self.index.add(record['word'], record['meaning_index'], record['context'])
+            return len(records)
+
+    def record(self, word, text, meaning_index, meaning=None):
+        '''
+        Save the correct meaning of a keyword in a context sentence, given by a user, and add the sentence as an example
+
+        Input:
+        + word (string): keyword
+        + text (string): context sentence
+        + meaning_index (int): position of the correct meaning in the dictionary entry (Meaning.index)
+        + meaning (string): text of the correct meaning, saved for reference
+        Output: record (dict) - saved record
+        '''
+        record = self.log.append({'word': word, 'context': text, 'meaning_index': int(meaning_index),
+                                  'meaning': meaning})
+        # The index follows the order of the log
+        self.replay()
+        return record
+
+    def examples(self, word):
+        return self.index.examples(word)
+
+    def _compact_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.index.compact()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def latency_curve(word, text, senses, word2vec_model, feedback_counts=(0, 100, 1000, 10000), max_examples=20, repeat=50,
+                  seed=0):
+    '''
+    Measure the word vector scoring time of a keyword as its feedback grows
+
+    Input:
+    + word, text (string): keyword and context sentence
+    + senses (Senses): preprocessed dictionary entry of the keyword
+    + word2vec_model: trained Word2Vec model (or its KeyedVectors)
+    + feedback_counts (list of int): numbers of feedback examples (random meanings, random vocabulary words)
+    + max_examples (int): maximum number of feedback examples kept per meaning
+    + repeat (int): number of timed runs
+    Output: report (list of dict) - for each number of feedback: kept slots and mean scoring time in microseconds
+    '''
+    from modules.score_calc import clean_context, vector_scores
+    wv = keyed_vectors(word2vec_model)
+    index = FeedbackIndex(word2vec_model, max_examples)
+    ctx_vectors = embed_tokens(clean_context(word, text), word2vec_model)
+    rng = np.random.default_rng(seed)
+    report = []
+    added = 0
+    for count in feedback_counts:
+        while added<count:
+            vectors = wv.vectors[rng.integers(0, len(wv.index_to_key), rng.integers(1, index.max_tokens + 1))]
+            index.add(word, int(rng.integers(0, max(len(senses), 1))), text, vectors)
+            added += 1
+        index.compact(0)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            vector_scores(ctx_vectors, senses.ex_vectors, senses.ex_starts, senses.ex_owners, len(senses), senses.ex_sq_norms,
+                          index.examples(word))
+        report.append({'feedback': count, 'slots': index.stats()['slots'],
+                       'vector_us': 1e6*(time.perf_counter() - start)/repeat})
+    return report
+
+
+def main(argv=None):
+    from modules import registry
+    parser = argparse.ArgumentParser(description='Word vector scoring time as the feedback of a keyword grows')
+    parser.add_argument('word')
+    parser.add_argument('context')
+    parser.add_argument('--max-examples', type=int, default=20)
+    from modules.benchmark import add_fixtures_arguments, fixtures_from_args
+    add_fixtures_arguments(parser)
+    args = parser.parse_args(argv)
+    from modules.sense_index import SenseIndex
+    word_vectors = registry.get('word_vectors')
+    senses = SenseIndex(fixtures_from_args(parser, args, [args.word]), registry.get('w_dict'), registry.get('co_matrix'), word_vectors).get(args.word)
+    print(json.dumps(latency_curve(args.word, args.context, senses, word_vectors, max_examples=args.max_examples), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
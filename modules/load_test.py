@@ -0,0 +1,122 @@
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from modules.benchmark import TEST_DATA, add_fixtures_arguments, fixtures_from_args, load_pairs, summarize
+
+
+def wait_ready(url, timeout=300.0):
+    '''
+    Wait until the service answers its health check (loading the models can take a while)
+    '''
+    deadline = time.monotonic() + timeout
+    while time.monotonic()<deadline:
+        try:
+            if requests.get(url + '/health', timeout=1).status_code==200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f'{url} not ready after {timeout}s')
+
+
+def run_load(url, pairs, concurrency=8, batch_size=0, weights=[1,2], retries=0):
+    '''
+    Send the pairs to the service from concurrent clients and measure the latencies
+
+    Input:
+    + url (string): base url of the service
+    + pairs (list of (string, string)): pairs of keyword - context sentence
+    + concurrency (int): number of concurrent clients (one keep-alive connection each)
+    + batch_size (int): number of pairs per request to the batch endpoint, 0 to send each pair to the single endpoint
+    + weights (list): weights of the scores
+    + retries (int): number of retries of a request rejected by the service (503), with exponential backoff
+    Output: report (dict) - latencies of successful requests in milliseconds (including retries), throughput,
+      count of each final status and number of retries
+    '''
+    if batch_size>0:
+        requests_ = [('/disambiguate/batch', {'pairs': [list(p) for p in pairs[i:i+batch_size]], 'weights': weights})
+                     for i in range(0, len(pairs), batch_size)]
+    else:
+        requests_ = [('/disambiguate', {'word': w, 'context': t, 'weights': weights}) for (w, t) in pairs]
+    local = threading.local()
+
+    def send(request):
+        if getattr(local, 'session', None) is None:
+            local.session = requests.Session()
+        (path, payload) = request
+        start = time.perf_counter()
+        for attempt in range(retries + 1):
+            response = local.session.post(url + path, json=payload, timeout=60)
+            if response.status_code!=503 or attempt==retries:
+                break
+            # Back off, at most as long as the service asks for
+            time.sleep(min(0.01*2**attempt, float(response.headers.get('Retry-After', 1))))
+        return (response.status_code, time.perf_counter() - start, attempt)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        responses = list(pool.map(send, requests_))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for (status, _, _) in responses:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {'n_requests': len(requests_), 'n_pairs': len(pairs), 'concurrency': concurrency, 'batch_size': batch_size,
+            'total_seconds': elapsed, 'pairs_per_second': len(pairs)/elapsed, 'statuses': statuses,
+            'retries': sum(attempt for (_, _, attempt) in responses),
+            'latency': summarize([seconds for (status, seconds, _) in responses if status==200])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of the scoring service (modules/service.py)')
+    parser.add_argument('--url', help='url of a running service; if not given, a service is started on --port')
+    parser.add_argument('--port', type=int, default=8765)
+    # The started service reads the fixtures instead of the dictionary
+    add_fixtures_arguments(parser)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--max-pending', type=int)
+    parser.add_argument('--test-data', default=TEST_DATA)
+    parser.add_argument('--scale', type=int, default=1, help='size of the replayed data in copies of the test data '
+                                                             '(copies after the first are variants of the sentences)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=0)
+    parser.add_argument('--retries', type=int, default=0, help='retries of requests rejected by the service (503)')
+    parser.add_argument('--output', help='write the json report to this file')
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.url
+    pairs = load_pairs(args.test_data, args.scale)
+    if url is None:
+        fixtures_from_args(parser, args, [w for (w, _) in pairs])
+        command = [sys.executable, '-m', 'modules.service', '--port', str(args.port), '--fixtures', args.fixtures]
+        if args.workers is not None:
+            command += ['--workers', str(args.workers)]
+        if args.max_pending is not None:
+            command += ['--max-pending', str(args.max_pending)]
+        server = subprocess.Popen(command)
+        url = f'http://127.0.0.1:{args.port}'
+    try:
+        wait_ready(url)
+        report = run_load(url, pairs, args.concurrency, args.batch_size,
+                          retries=args.retries)
+        report['metrics'] = requests.get(url + '/metrics', timeout=5).text
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
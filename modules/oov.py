@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from modules.score_calc import keyed_vectors
+
+
+def char_ngrams(word, n=3):
+    '''
+    Return the set of character n-grams of a word, padded with "<" and ">"
+
+    Input:
+    + word (string): word
+    + n (int): length of the n-grams
+    Output: grams (set of string)
+    '''
+    padded = '<' + word + '>'
+    return set(padded[i:i+n] for i in range(max(len(padded) - n + 1, 1)))
+
+
+class NgramIndex:
+    '''
+    Character n-gram index over a vocabulary, returning the known words closest to an unknown token (Dice similarity)
+    '''
+    def __init__(self, vocab, n=3):
+        '''
+        Input:
+        + vocab (list of string): known words
+        + n (int): length of the n-grams
+        '''
+        self.vocab = list(vocab)
+        self.n = n
+        postings = {}
+        n_grams = np.zeros(len(self.vocab), dtype=np.int32)
+        for (i, w) in enumerate(self.vocab):
+            grams = char_ngrams(w, n)
+            n_grams[i] = len(grams)
+            for g in grams:
+                postings.setdefault(g, []).append(i)
+        self.postings = {g: np.array(ids, dtype=np.int32) for (g, ids) in postings.items()}
+        self.n_grams = n_grams
+
+    def nearest(self, token, k=3, min_similarity=0.0):
+        '''
+        Return the known words sharing the most n-grams with the token
+
+        Input:
+        + token (string): unknown token
+        + k (int): maximum number of neighbours
+        + min_similarity (float): neighbours with a lower Dice similarity are left out
+        Output: neighbours (list of (int, float)) - (index in vocab, similarity), most similar first
+        '''
+        grams = char_ngrams(token, self.n)
+        hits = [self.postings[g] for g in grams if g in self.postings]
+        if hits==[]:
+            return []
+        (ids, shared) = np.unique(np.concatenate(hits), return_counts=True)
+        similarity = 2*shared/(len(grams) + self.n_grams[ids])
+        if len(ids)>k:
+            top = np.argpartition(-similarity, k-1)[:k]
+            (ids, similarity) = (ids[top], similarity[top])
+        order = np.argsort(-similarity, kind='stable')
+        return [(int(ids[i]), float(similarity[i])) for i in order if similarity[i]>=min_similarity]
+
+
+class OOVResolver:
+    '''
+    Fallback for context words missing from the Word2Vec vocabulary or the corpus dictionary:
+    an unknown token is replaced by a vector synthesized from its nearest known words (by character n-grams),
+    and mapped to its nearest corpus dictionary word for the co-occurrence score. Results are cached per token.
+    '''
+    def __init__(self, word2vec_model, w_dict=None, size=None, k=3, min_similarity=0.5, maxsize=100000):
+        '''
+        Input:
+        + word2vec_model: trained Word2Vec model (or its KeyedVectors)
+        + w_dict (dict): optional dictionary of all words in the trained corpus
+        + size (int): number of rows of the co-occurrence matrix; dictionary words indexed beyond it are not used
+        + k (int): number of neighbours used to synthesize a vector
+        + min_similarity (float): minimum Dice similarity of a neighbour
+        + maxsize (int): maximum number of cached tokens
+        '''
+        self.wv = keyed_vectors(word2vec_model)
+        self.k = k
+        self.min_similarity = min_similarity
+        self.maxsize = maxsize
+        self.wv_index = NgramIndex(self.wv.index_to_key)
+        self.dict_index = None
+        if w_dict is not None:
+            self.dict_index = NgramIndex([w for (w, i) in w_dict.items() if size is None or i<size])
+        self._vectors = OrderedDict()
+        self._words = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, cache, token, compute):
+        with self._lock:
+            if token in cache:
+                cache.move_to_end(token)
+                return cache[token]
+        value = compute(token)
+        with self._lock:
+            cache[token] = value
+            while len(cache)>self.maxsize:
+                cache.popitem(last=False)
+        return value
+
+    def _synthesize(self, token):
+        neighbours = self.wv_index.nearest(token, self.k, self.min_similarity)
+        if neighbours==[]:
+            return None
+        ids = [i for (i, _) in neighbours]
+        weights = np.array([s for (_, s) in neighbours], dtype=np.float32)
+        return (weights[:, None]*self.wv.vectors[ids]).sum(axis=0)/weights.sum()
+
+    def _closest_word(self, token):
+        neighbours = self.dict_index.nearest(token, 1, self.min_similarity)
+        return self.dict_index.vocab[neighbours[0][0]] if neighbours!=[] else None
+
+    def vector(self, token):
+        '''
+        Return the synthesized vector of an unknown token, None if it has no close enough known word
+        '''
+        return self._cached(self._vectors, token, self._synthesize)
+
+    def dict_word(self, token):
+        '''
+        Return the corpus dictionary word closest to an unknown token, None if there is none (or no dictionary)
+        '''
+        if self.dict_index is None:
+            return None
+        return self._cached(self._words, token, self._closest_word)
+
+
+def benchmark_lookup(resolver, n=1000, seed=0):
+    '''
+    Return the mean and p99 lookup latency (in milliseconds) of uncached tokens, made by adding a typo to known words
+
+    Input:
+    + resolver (OOVResolver): resolver to benchmark
+    + n (int): number of tokens
+    + seed (int): random seed
+    Output: stats (dict) - {'mean_ms': ..., 'p99_ms': ..., 'resolved': fraction of tokens with a synthesized vector}
+    '''
+    rng = np.random.default_rng(seed)
+    vocab = resolver.wv.index_to_key
+    letters = 'abcdeghiklmnopqrstuvxyăâđêôơư'
+    timings = []
+    resolved = 0
+    for j in rng.choice(len(vocab), size=n):
+        word = vocab[j]
+        pos = int(rng.integers(len(word) + 1))
+        token = word[:pos] + letters[int(rng.integers(len(letters)))] + word[pos:]
+        start = time.perf_counter()
+        vec = resolver._synthesize(token)
+        timings.append(time.perf_counter() - start)
+        resolved += vec is not None
+    ms = np.array(timings)*1000
+    return {'mean_ms': float(ms.mean()), 'p99_ms': float(np.percentile(ms, 99)), 'resolved': resolved/n}
+
+
+if __name__ == '__main__':
+    from modules import registry
+    resolver = registry.get('oov')
+    print(f"Index built in {registry.startup_report()['oov']:.2f}s")
+    print(benchmark_lookup(resolver))
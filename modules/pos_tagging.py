@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from underthesea import pos_tag
+from modules.score_calc import predict_pos_tag
+
+
+class PosTagger:
+    '''
+    POS tagging service: underthesea pos_tag behind an LRU cache, with a batch mode and timing counters.
+
+    Sentences are cached by their exact lowercased text (the input of pos_tag in predict_pos_tag), so the tags
+    are identical to calling pos_tag directly. The returned lists are shared with the cache and must not be modified.
+    '''
+    def __init__(self, maxsize=10000, tag=pos_tag):
+        '''
+        Input:
+        + maxsize (int): maximum number of cached sentences
+        + tag (function): POS tagging function
+        '''
+        self.maxsize = maxsize
+        self._tag = tag
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'hits': 0, 'misses': 0, 'tag_seconds': 0.0}
+
+    def _lookup(self, sentence):
+        # Called with the lock held
+        self.counters['calls'] += 1
+        if sentence in self._cache:
+            self._cache.move_to_end(sentence)
+            self.counters['hits'] += 1
+            return self._cache[sentence]
+        return None
+
+    def _store(self, sentence, tags, seconds):
+        with self._lock:
+            self.counters['misses'] += 1
+            self.counters['tag_seconds'] += seconds
+            self._cache[sentence] = tags
+            while len(self._cache)>self.maxsize:
+                self._cache.popitem(last=False)
+
+    def tag(self, sentence):
+        '''
+        Return the POS tags of a sentence, from the cache if it was already tagged
+
+        Input: sentence (string) - sentence to tag
+        Output: pos_res (list of (string, string)) - tokenized words and their POS tags
+        '''
+        with self._lock:
+            tags = self._lookup(sentence)
+        if tags is None:
+            start = time.perf_counter()
+            tags = self._tag(sentence)
+            self._store(sentence, tags, time.perf_counter() - start)
+        return tags
+
+    __call__ = tag
+
+    def tag_many(self, sentences):
+        '''
+        Return the POS tags of many sentences, tagging each distinct uncached sentence once
+
+        Input: sentences (iterable of string) - sentences to tag
+        Output: pos_res (list) - POS tags of each sentence, in order
+        '''
+        sentences = list(sentences)
+        tagged = {}
+        with self._lock:
+            for sentence in dict.fromkeys(sentences):
+                tags = self._lookup(sentence)
+                if tags is not None:
+                    tagged[sentence] = tags
+        for sentence in dict.fromkeys(sentences):
+            if sentence not in tagged:
+                start = time.perf_counter()
+                tagged[sentence] = self._tag(sentence)
+                self._store(sentence, tagged[sentence], time.perf_counter() - start)
+        return [tagged[sentence] for sentence in sentences]
+
+    def predict(self, text, word):
+        '''
+        Return the Vietnamese POS tag of the keyword in the context sentence (see score_calc.predict_pos_tag)
+        '''
+        return predict_pos_tag(text, word, tag=self.tag)
+
+    def stats(self):
+        '''
+        Return the counters, the hit rate, the mean tagging time of a cache miss in milliseconds and the cache size
+        '''
+        with self._lock:
+            stats = dict(self.counters, size=len(self._cache))
+        stats['hit_rate'] = stats['hits']/stats['calls'] if stats['calls']!=0 else 0.0
+        stats['mean_tag_ms'] = 1000*stats['tag_seconds']/stats['misses'] if stats['misses']!=0 else 0.0
+        return stats
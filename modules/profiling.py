@@ -0,0 +1,199 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+
+class Tracer:
+    '''
+    Records the wall and CPU time of each named stage of a computation, and counts of the items it processed
+
+    Usage:
+        tracer = Tracer(sinks=[RingBufferSink()])
+        with tracer.request('score_calc_phraser', word='rơi'):
+            with tracer.stage('scrape'):
+                ...
+            tracer.count('meanings', 12)
+        tracer.timings       # {'scrape': [0.012, ...]} (wall time of every run of each stage)
+        tracer.cpu_timings   # {'scrape': [0.001, ...]} (CPU time of the calling thread)
+
+    At the end of each request, a structured record (see request) is sent to every sink.
+    A tracer is meant to be used by one thread at a time.
+    '''
+    def __init__(self, sinks=None):
+        '''
+        Input: sinks (list) - objects with an emit(record) method receiving the record of each request
+        '''
+        self.sinks = list(sinks) if sinks is not None else []
+        self.timings = {}
+        self.cpu_timings = {}
+        self.counts = {}
+        self._record = None
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Context manager timing one run of the stage name
+        '''
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - cpu_start
+            self.timings.setdefault(name, []).append(wall)
+            self.cpu_timings.setdefault(name, []).append(cpu)
+            if self._record is not None:
+                stage = self._record['stages'].setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+                stage['wall'] += wall
+                stage['cpu'] += cpu
+
+    def count(self, name, n):
+        '''
+        Record the number of items of a kind (meanings, examples, tokens, ...) processed by the current request
+        '''
+        self.counts[name] = self.counts.get(name, 0) + n
+        if self._record is not None:
+            self._record['counts'][name] = self._record['counts'].get(name, 0) + n
+
+    @contextmanager
+    def request(self, name, **tags):
+        '''
+        Context manager grouping the stages and counts of one request into a record sent to the sinks:
+        {'name': ..., 'time': start (epoch seconds), 'wall': ..., 'cpu': ..., 'stages': {stage: {'wall': ..., 'cpu': ...}},
+         'counts': {...}, 'tags': tags, 'error': exception name or None}
+        Nested requests are counted in the outer request only.
+        '''
+        if self._record is not None:
+            yield
+            return
+        record = {'name': name, 'time': time.time(), 'stages': {}, 'counts': {}, 'tags': tags, 'error': None}
+        self._record = record
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['wall'] = time.perf_counter() - start
+            record['cpu'] = time.thread_time() - cpu_start
+            self._record = None
+            for sink in self.sinks:
+                sink.emit(record)
+
+    def reset(self):
+        self.timings = {}
+        self.cpu_timings = {}
+        self.counts = {}
+
+
+class NullTracer:
+    '''
+    Tracer doing nothing, used when tracing is disabled
+    '''
+    _null = nullcontext()
+
+    def stage(self, name):
+        return self._null
+
+    def count(self, name, n):
+        pass
+
+    def request(self, name, **tags):
+        return self._null
+
+
+NULL_TRACER = NullTracer()
+
+
+class RingBufferSink:
+    '''
+    Keeps the records of the last maxlen requests in memory
+    '''
+    def __init__(self, maxlen=1000):
+        self._records = deque(maxlen=maxlen)
+
+    def emit(self, record):
+        self._records.append(record)
+
+    def records(self):
+        '''
+        Return the kept records, oldest first
+        '''
+        return list(self._records)
+
+    def last(self):
+        return self._records[-1] if len(self._records)!=0 else None
+
+
+class LoggingSink:
+    '''
+    Writes each record as a json log message (the record itself is also attached to the log record as "trace")
+    '''
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger if logger is not None else logging.getLogger('vn_dict.trace')
+        self.level = level
+
+    def emit(self, record):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, json.dumps(record, ensure_ascii=False), extra={'trace': record})
+
+
+class PrometheusSink:
+    '''
+    Aggregates the records into counters, exported in the Prometheus text format (render)
+    '''
+    def __init__(self, prefix='vn_dict'):
+        self.prefix = prefix
+        self.requests = {}
+        self.errors = {}
+        self.seconds = {}
+        self.stage_calls = {}
+        self.stage_seconds = {}
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        name = record['name']
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+            if record['error'] is not None:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            for clock in ('wall', 'cpu'):
+                self.seconds[(name, clock)] = self.seconds.get((name, clock), 0.0) + record[clock]
+            for (stage, times) in record['stages'].items():
+                self.stage_calls[(name, stage)] = self.stage_calls.get((name, stage), 0) + 1
+                for clock in ('wall', 'cpu'):
+                    key = (name, stage, clock)
+                    self.stage_seconds[key] = self.stage_seconds.get(key, 0.0) + times[clock]
+            for (item, n) in record['counts'].items():
+                self.items[(name, item)] = self.items.get((name, item), 0) + n
+
+    def render(self):
+        '''
+        Return the counters in the Prometheus text format
+        '''
+        p = self.prefix
+        with self._lock:
+            lines = [f'# TYPE {p}_trace_requests_total counter']
+            lines += [f'{p}_trace_requests_total{{request="{name}"}} {n}' for (name, n) in sorted(self.requests.items())]
+            lines.append(f'# TYPE {p}_trace_errors_total counter')
+            lines += [f'{p}_trace_errors_total{{request="{name}"}} {n}' for (name, n) in sorted(self.errors.items())]
+            lines.append(f'# TYPE {p}_trace_request_seconds_total counter')
+            lines += [f'{p}_trace_request_seconds_total{{request="{name}",clock="{clock}"}} {s}'
+                      for ((name, clock), s) in sorted(self.seconds.items())]
+            lines.append(f'# TYPE {p}_trace_stage_calls_total counter')
+            lines += [f'{p}_trace_stage_calls_total{{request="{name}",stage="{stage}"}} {n}'
+                      for ((name, stage), n) in sorted(self.stage_calls.items())]
+            lines.append(f'# TYPE {p}_trace_stage_seconds_total counter')
+            lines += [f'{p}_trace_stage_seconds_total{{request="{name}",stage="{stage}",clock="{clock}"}} {s}'
+                      for ((name, stage, clock), s) in sorted(self.stage_seconds.items())]
+            lines.append(f'# TYPE {p}_trace_items_total counter')
+            lines += [f'{p}_trace_items_total{{request="{name}",item="{item}"}} {n}'
+                      for ((name, item), n) in sorted(self.items.items())]
+        return '\n'.join(lines) + '\n'
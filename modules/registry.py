@@ -0,0 +1,188 @@
+import json
+import os
+import pickle
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CO_MATRIX_PATH = os.path.join(ROOT, 'trained_logs', 'M_matrix_final.npy')
+W_DICT_JSON_PATH = os.path.join(ROOT, 'trained_logs', 'dict_final.json')
+W_DICT_PATH = os.path.join(ROOT, 'trained_logs', 'dict_final.pkl')
+WORD2VEC_MODEL_PATH = os.path.join(ROOT, 'trained_logs', 'word2vec_100dim_50000.model')
+WORD2VEC_KV_PATH = os.path.join(ROOT, 'trained_logs', 'word2vec_100dim_50000.kv')
+WORD2VEC_STORE_DIR = os.path.join(ROOT, 'trained_logs', 'word2vec_store')
+DICT_DB_PATH = os.path.join(ROOT, 'trained_logs', 'dict_store.db')
+SENSE_INDEX_DIR = os.path.join(ROOT, 'trained_logs', 'sense_index')
+SENSE_PROFILES_PATH = os.path.join(ROOT, 'trained_logs', 'sense_profiles.npz')
+# User feedback is data of the deployment, not of the repository: kept in the home folder unless VN_DICT_FEEDBACK_LOG is set
+FEEDBACK_LOG_PATH = os.environ.get('VN_DICT_FEEDBACK_LOG', os.path.join(os.path.expanduser('~'), '.vn_dict_app', 'feedback.jsonl'))
+
+# Artifacts are loaded once per process, on first use, and shared by all callers (e.g. all Streamlit sessions and reruns)
+_loaders = {}
+_artifacts = {}
+_locks = {}
+_registry_lock = threading.Lock()
+load_times = {}
+
+
+def register(name, loader):
+    '''
+    Register the loader of an artifact
+
+    Input:
+    + name (string): name of the artifact
+    + loader (function): function without arguments returning the artifact
+    '''
+    with _registry_lock:
+        _loaders[name] = loader
+        _locks.setdefault(name, threading.Lock())
+
+
+def get(name):
+    '''
+    Return an artifact, loading it if this is its first use in the process
+
+    Input: name (string) - name of the artifact
+    Output: the loaded artifact
+    '''
+    if name in _artifacts:
+        return _artifacts[name]
+    with _locks[name]:
+        if name not in _artifacts:
+            start = time.perf_counter()
+            _artifacts[name] = _loaders[name]()
+            load_times[name] = time.perf_counter() - start
+    return _artifacts[name]
+
+
+def preload(names=None):
+    '''
+    Load artifacts eagerly (e.g. before forking worker processes)
+
+    Input: names (list of string) - artifacts to load, all registered artifacts if None
+    '''
+    for name in (names if names is not None else list(_loaders)):
+        get(name)
+
+
+def startup_report():
+    '''
+    Return the load time of each loaded artifact in seconds
+    (the time of an artifact includes the first load of the artifacts it depends on)
+    '''
+    return dict(load_times)
+
+
+def _load_co_matrix():
+    from modules.co_matrix import load_co_matrix
+    sparse_path = os.path.splitext(CO_MATRIX_PATH)[0] + '.npz'
+    return load_co_matrix(sparse_path if os.path.exists(sparse_path) else CO_MATRIX_PATH)
+
+
+def _load_w_dict():
+    if os.path.exists(W_DICT_PATH):
+        with open(W_DICT_PATH, 'rb') as f:
+            return pickle.load(f)
+    decoder = json.JSONDecoder()
+    with open(W_DICT_JSON_PATH, encoding='utf-8') as user_file:
+        w_dict, _ = decoder.raw_decode(user_file.read())
+    return w_dict
+
+
+def _load_word_vectors():
+    if os.path.exists(WORD2VEC_STORE_DIR):
+        # Reduced-precision vectors exported with modules/embedding_store.py
+        from modules.embedding_store import load_store
+        return load_store(WORD2VEC_STORE_DIR)
+    if os.path.exists(WORD2VEC_KV_PATH):
+        from gensim.models import KeyedVectors
+        return KeyedVectors.load(WORD2VEC_KV_PATH, mmap='r')
+    from gensim.models import word2vec
+    return word2vec.Word2Vec.load(WORD2VEC_MODEL_PATH).wv
+
+
+def _load_dictionary():
+    from modules.async_scrape import DictFetcher
+    from modules.dict_store import DictStore
+    from modules.scrape_cache import ScrapeCache
+    # Keywords missing from the local dictionary database are scraped once (with timeouts and retries) and saved
+    return ScrapeCache(DictStore(DICT_DB_PATH, fallback=DictFetcher()), maxsize=1024, ttl=24*3600)
+
+
+def _load_sense_index():
+    from modules.sense_index import SenseIndex
+    word_vectors = get('word_vectors')
+    # The persisted example vectors depend on the precision of the word vectors
+    precision = getattr(word_vectors, 'precision', None)
+    cache_dir = SENSE_INDEX_DIR if precision is None else f'{SENSE_INDEX_DIR}_{precision}'
+    profiles = None
+    if os.path.exists(SENSE_PROFILES_PATH):
+        # Co-occurrence profiles built offline with modules/sense_profiles.py
+        from modules.sense_profiles import load_profiles
+        profiles = load_profiles(SENSE_PROFILES_PATH)
+    return SenseIndex(get('dictionary'), get('w_dict'), get('co_matrix'), word_vectors, cache_dir=cache_dir, profiles=profiles)
+
+
+def _load_oov():
+    from modules.co_matrix import as_co_store
+    from modules.oov import OOVResolver
+    return OOVResolver(get('word_vectors'), get('w_dict'), min(as_co_store(get('co_matrix')).shape))
+
+
+def _load_pos_tagger():
+    from modules.pos_tagging import PosTagger
+    return PosTagger()
+
+
+def _load_context_tokenizer():
+    from modules.co_matrix import as_co_store
+    from modules.tokenizing import ContextTokenizer
+    return ContextTokenizer(get('w_dict'), min(as_co_store(get('co_matrix')).shape))
+
+
+def _load_feedback():
+    from modules.feedback import FeedbackStore
+    # The feedback log is replayed into the index of feedback examples, compacted in the background
+    return FeedbackStore(FEEDBACK_LOG_PATH, get('word_vectors'))
+
+
+def _load_scoring_executor():
+    from modules.scoring_jobs import ScoringExecutor
+    from modules.scoring_session import ScoringSession
+
+    def make_session(word, fix_typos, tracer):
+        return ScoringSession(word, get('co_matrix'), get('w_dict'), get('word_vectors'), get('dictionary'),
+                              sense_cache=get('sense_index'), oov=get('oov') if fix_typos else None, tagger=get('pos_tagger'),
+                              tracer=tracer, tokenizer=get('context_tokenizer'), feedback=get('feedback'))
+    # Scoring jobs of all Streamlit sessions run in this pool, off the script threads (see modules/scoring_jobs.py)
+    return ScoringExecutor(make_session, max_workers=4)
+
+
+register('co_matrix', _load_co_matrix)
+register('w_dict', _load_w_dict)
+register('word_vectors', _load_word_vectors)
+register('dictionary', _load_dictionary)
+register('sense_index', _load_sense_index)
+register('oov', _load_oov)
+register('pos_tagger', _load_pos_tagger)
+register('context_tokenizer', _load_context_tokenizer)
+register('feedback', _load_feedback)
+register('scoring_executor', _load_scoring_executor)
+
+
+def export_artifacts():
+    '''
+    Export the Word2Vec vectors alone (memory-mappable KeyedVectors) and the corpus dictionary as a pickle,
+    which are then used instead of the full model and the json file
+    '''
+    from gensim.models import word2vec
+    word2vec.Word2Vec.load(WORD2VEC_MODEL_PATH).wv.save(WORD2VEC_KV_PATH)
+    with open(W_DICT_JSON_PATH, encoding='utf-8') as f:
+        w_dict = json.load(f)
+    with open(W_DICT_PATH, 'wb') as f:
+        pickle.dump(w_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+if __name__ == '__main__':
+    export_artifacts()
+    print(f'Exported {WORD2VEC_KV_PATH} and {W_DICT_PATH}')
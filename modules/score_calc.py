@@ -4,7 +4,11 @@ from underthesea import pos_tag, word_tokenize
 import requests
 import regex
 import json
+from modules.co_matrix import as_co_store, pair_sums
+from modules.profiling import NULL_TRACER
 
+# Characters removed from the text data (anything but Latin letters and whitespace), compiled once
+non_latin = regex.compile(r'[^\p{Latin}\s]+')
 
 def clean_test_dat(text):
     '''
@@ -14,7 +18,7 @@ def clean_test_dat(text):
     Output: cleaned_text (string) - the text after cleaning
     '''
     cleaned_text = text.lower().strip()
-    cleaned_text = regex.sub(r'[^\p{Latin}\s]+', u'', cleaned_text)
+    cleaned_text = non_latin.sub(u'', cleaned_text)
     return cleaned_text
 
 
@@ -31,76 +35,177 @@ def remove_items(test_list, item):
     return res
 
 
+pos_dict = {
+           ('N', 'Np', 'Nc', 'Ny', 'Nu', 'M', 'L'): 'Danh từ',
+           'A': 'Tính từ',
+           ('V', 'Vy'): 'Động từ',
+           'P': 'Đại từ',
+           'R': 'Phụ từ', 
+           'T': 'Trợ từ',
+           'I': 'Cảm từ', 
+            ('E', 'C', 'CC'): 'Kết từ', 
+            ('Z', 'X'): 'Không rõ'
+           }
+
+# Flat lookup table {English POS tag: Vietnamese word type}, built once from pos_dict
+vn_pos_table = {tag: vn_tag for (en_tag, vn_tag) in pos_dict.items()
+                for tag in ((en_tag,) if isinstance(en_tag, str) else en_tag)}
+
+
 def vn_pos_tag(tag):
     '''
     Return corresponding Vietnamese word type in Tra Tu dictionary from inputted English POS tag
     
     Input: tag (string) - English POS tag
-    Output: vn_tag (string) - corresponding Vietnamese POS tag
-    '''
-    pos_dict = {
-               ('N', 'Np', 'Nc', 'Ny', 'Nu', 'M', 'L'): 'Danh từ',
-               'A': 'Tính từ',
-               ('V', 'Vy'): 'Động từ',
-               'P': 'Đại từ',
-               'R': 'Phụ từ', 
-               'T': 'Trợ từ',
-               'I': 'Cảm từ', 
-                ('E', 'C', 'CC'): 'Kết từ', 
-                ('Z', 'X'): 'Không rõ'
-               }
-    for (en_tag, vn_tag) in pos_dict.items():
-        if (tag==en_tag) or (tag in en_tag):
-            return vn_tag
+    Output: vn_tag (string) - corresponding Vietnamese POS tag, None for unknown tags
+    '''
+    return vn_pos_table.get(tag)
 
     
+def keyed_vectors(word2vec_model):
+    '''
+    Return the word vectors of a model
+    
+    Input: word2vec_model - trained Word2Vec model, or its KeyedVectors (e.g. loaded memory-mapped)
+    Output: wv (KeyedVectors) - the word vectors
+    '''
+    return getattr(word2vec_model, 'wv', word2vec_model)
+
+
 def distance(w1, w2, word2vec_model):
     '''
     Return the Euclidean distance between 2 words given their word vectors
     
     Input: 
     + w1, w2 (string) - 2 words to calculate distance
-    + word2vec_model: trained Word2Vec model
+    + word2vec_model: trained Word2Vec model (or its KeyedVectors)
     Output: dist (float) - Euclidean distance between 2 given words
     '''
-    dist = np.linalg.norm(word2vec_model.wv[w1] - word2vec_model.wv[w2])
+    wv = keyed_vectors(word2vec_model)
+    dist = np.linalg.norm(wv[w1] - wv[w2])
     return dist
 
 
-def vector_score_calc(text, examples, word2vec_model):
+def embed_tokens(tokens, word2vec_model, oov=None):
     '''
-    Return the word vector scores between context sentence and example sentences for each meaning
+    Return the word vectors of all tokens found in the Word2Vec vocabulary
     
     Input: 
-    + text (string): context sentence
-    + examples (list of list of string): list of example sentences for each meaning
-    + word2vec_model: trained Word2Vec model
-    Output: scores (list of float) - list of word vector scores between context sentence and example sentences of each meaning
+    + tokens (list of string): tokens to look up
+    + word2vec_model: trained Word2Vec model (or its KeyedVectors)
+    + oov (OOVResolver): optional fallback synthesizing vectors for unknown tokens (see modules/oov.py)
+    Output: vectors (numpy matrix) - one row per in-vocabulary (or resolved) token, in the order of tokens
     '''
-    n = len(examples) # number of meanings
-    scores = np.array([None]*n)
+    wv = keyed_vectors(word2vec_model)
+    if oov is None:
+        idx = [wv.key_to_index[w] for w in tokens if w in wv.key_to_index]
+        return wv.vectors[idx]
     
-    for i in range(n):
-        ex_score = []
-        ex_i = examples[i]
-        ex_i = ex_i.split("\n")
-        for ex in ex_i:
-            ex = ex.split(" ")
-            (ex_sum, ex_cnt) = (0, 0)
-            for w in text:
-                w_sum = []
-                for w2 in ex:
-                    try:
-                        w_sum.append(distance(w, w2, word2vec_model))
-                    except:
-                        continue 
-                if w_sum!=[]:
-                    ex_sum+=min(w_sum)
-                    ex_cnt+=1
-            if (ex_cnt!=0):
-                ex_score.append(ex_sum/ex_cnt)
-        if ex_score!=[]:        
-            scores[i] = min(ex_score)
+    vectors = []
+    for w in tokens:
+        if w in wv.key_to_index:
+            vectors.append(wv.vectors[wv.key_to_index[w]])
+        else:
+            vec = oov.vector(w)
+            if vec is not None:
+                vectors.append(vec)
+    return np.array(vectors, dtype=wv.vectors.dtype).reshape(len(vectors), wv.vector_size)
+
+
+def embed_examples(examples, word2vec_model):
+    '''
+    Look up the word vectors of all example sentences of all meanings at once
+    
+    Input: 
+    + examples (list of string): example sentences of each meaning, separated by "\\n"
+    + word2vec_model: trained Word2Vec model (or its KeyedVectors)
+    Output: (vectors, starts, owners)
+    + vectors (numpy matrix): word vectors of all in-vocabulary example words, example after example
+    + starts (numpy array): row of vectors where each example begins
+    + owners (numpy array): index of the meaning each example belongs to
+    Examples without any in-vocabulary word are left out, as they never receive a score.
+    '''
+    vectors, starts, owners = [], [], []
+    n_rows = 0
+    for i in range(len(examples)):
+        for ex in examples[i].split("\n"):
+            ex_vectors = embed_tokens(ex.split(" "), word2vec_model)
+            if len(ex_vectors)==0:
+                continue
+            vectors.append(ex_vectors)
+            starts.append(n_rows)
+            owners.append(i)
+            n_rows += len(ex_vectors)
+    if vectors==[]:
+        dim = keyed_vectors(word2vec_model).vector_size
+        return (np.zeros((0, dim), dtype=np.float32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    return (np.concatenate(vectors), np.array(starts), np.array(owners))
+
+
+def pairwise_distances(vectors1, vectors2, sq_norms2=None):
+    '''
+    Return the Euclidean distances between every row of vectors1 and every row of vectors2
+    
+    Input: 
+    + vectors1, vectors2 (numpy matrix): word vectors, one word per row
+    + sq_norms2 (numpy array): optional precomputed squared norms of vectors2; if given, the squared distances
+      come from a single dot-product matrix (|a|^2 + |b|^2 - 2a.b), faster but less exact for very close vectors
+    Output: dist (numpy matrix) - dist[i, j] is the distance between vectors1[i] and vectors2[j]
+    '''
+    if sq_norms2 is not None:
+        sq_norms1 = np.einsum('ij,ij->i', vectors1, vectors1)
+        sq_dist = sq_norms1[:, None] + sq_norms2[None, :] - 2*(vectors1 @ vectors2.T)
+        return np.sqrt(np.maximum(sq_dist, 0))
+    diff = vectors1[:, None, :] - vectors2[None, :, :]
+    dist = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+    return dist
+
+
+def example_scores(ctx_vectors, vectors, starts, sq_norms=None):
+    '''
+    Return the score of every example sentence against the context sentence
+    
+    Input: 
+    + ctx_vectors (numpy matrix): word vectors of the in-vocabulary context words
+    + vectors, starts: output of embed_examples
+    + sq_norms (numpy array): optional precomputed squared norms of vectors (see pairwise_distances)
+    Output: ex_scores (numpy array) - mean over context words of the distance to the closest example word
+    '''
+    closest = closest_distances(ctx_vectors, vectors, starts, sq_norms)
+    ex_scores = closest.sum(axis=0)/len(ctx_vectors)
+    return ex_scores
+
+
+def closest_distances(ctx_vectors, vectors, starts, sq_norms=None):
+    '''
+    Return the distance from every context word to the closest word of every example sentence
+    
+    Input: 
+    + ctx_vectors (numpy matrix): word vectors of the in-vocabulary context words
+    + vectors, starts: output of embed_examples
+    + sq_norms (numpy array): optional precomputed squared norms of vectors (see pairwise_distances)
+    Output: closest (numpy matrix) - one row per context word, one column per example sentence
+    '''
+    dist = pairwise_distances(ctx_vectors, vectors, sq_norms)
+    return np.minimum.reduceat(dist, starts, axis=1)
+
+
+def vector_score_reduce(ex_scores, owners, n):
+    '''
+    Return the normalized word vector score of each meaning from the scores of its examples
+    
+    Input: 
+    + ex_scores (numpy array): score of each example sentence
+    + owners (numpy array): index of the meaning each example belongs to
+    + n (int): number of meanings
+    Output: scores (list of float) - best (lowest) example score of each meaning, None if the meaning has no scored example
+    '''
+    scores = np.array([None]*n)
+    if len(ex_scores)!=0:
+        best = np.full(n, np.inf, dtype=ex_scores.dtype)
+        np.minimum.at(best, owners, ex_scores)
+        for i in np.unique(owners):
+            scores[i] = best[i]
   
     try:
         norm = np.linalg.norm(np.array(scores)[scores!=None])
@@ -113,7 +218,183 @@ def vector_score_calc(text, examples, word2vec_model):
         return scores    
 
 
-def co_occur_score_calc(text, meanings, w_dict, co_matrix):
+def feedback_closest(ctx_vectors, vectors):
+    '''
+    Return the distance from every context word to the closest word of every feedback example
+    
+    Input: 
+    + ctx_vectors (numpy matrix): word vectors of the in-vocabulary context words
+    + vectors (numpy array): word vectors of the feedback examples, padded to the same number of words with copies of
+      their first word (one example x word x dimension, see modules/feedback.py)
+    Output: closest (numpy matrix) - one row per context word, one column per feedback example
+    '''
+    (k, t, d) = vectors.shape
+    dist = pairwise_distances(ctx_vectors, vectors.reshape(k*t, d))
+    return dist.reshape(len(ctx_vectors), k, t).min(axis=2)
+
+
+def vector_scores(ctx_vectors, vectors, starts, owners, n, sq_norms=None, feedback=None):
+    '''
+    Return the word vector scores of each meaning from pre-embedded context and example words
+    
+    Input: 
+    + ctx_vectors (numpy matrix): word vectors of the in-vocabulary context words (see embed_tokens)
+    + vectors, starts, owners: embedded example sentences (see embed_examples)
+    + n (int): number of meanings
+    + sq_norms (numpy array): optional precomputed squared norms of vectors (see pairwise_distances)
+    + feedback ((numpy array, numpy array)): optional examples added from user feedback, scored as the other examples:
+      padded word vectors and meaning of each example, -1 for removed examples (see FeedbackIndex.examples in modules/feedback.py)
+    Output: scores (list of float) - list of word vector scores between context sentence and example sentences of each meaning
+    '''
+    if feedback is not None and len(feedback[1])!=0 and len(ctx_vectors)!=0:
+        (fb_vectors, fb_owners) = feedback
+        live = (fb_owners>=0) & (fb_owners<n)
+        fb_scores = feedback_closest(ctx_vectors, fb_vectors).sum(axis=0)/len(ctx_vectors)
+        if len(starts)!=0:
+            ex_scores = example_scores(ctx_vectors, vectors, starts, sq_norms)
+        else:
+            ex_scores = np.zeros(0, dtype=fb_scores.dtype)
+        return vector_score_reduce(np.concatenate([ex_scores, fb_scores[live]]), np.concatenate([owners, fb_owners[live]]), n)
+    
+    # Out-of-vocabulary context words are skipped, so an empty context leaves every meaning unscored
+    if len(ctx_vectors)==0 or len(starts)==0:
+        return vector_score_reduce(np.zeros(0), owners[:0], n)
+    
+    ex_scores = example_scores(ctx_vectors, vectors, starts, sq_norms)
+    return vector_score_reduce(ex_scores, owners, n)
+
+
+def vector_score_calc(text, examples, word2vec_model, oov=None):
+    '''
+    Return the word vector scores between context sentence and example sentences for each meaning
+    
+    Input: 
+    + text (string): context sentence
+    + examples (list of list of string): list of example sentences for each meaning
+    + word2vec_model: trained Word2Vec model (or its KeyedVectors)
+    + oov (OOVResolver): optional fallback for context words missing from the Word2Vec vocabulary
+    Output: scores (list of float) - list of word vector scores between context sentence and example sentences of each meaning
+    
+    The distances are computed together in float32, not pair by pair: scores equal the ones of a loop over every pair
+    of words up to float32 rounding (relative difference below 1e-5, see tests/test_vector_score.py).
+    '''
+    n = len(examples) # number of meanings
+    ctx_vectors = embed_tokens(text, word2vec_model, oov)
+    (vectors, starts, owners) = embed_examples(examples, word2vec_model)
+    return vector_scores(ctx_vectors, vectors, starts, owners, n)
+
+
+def index_tokens(tokens, w_dict, size, oov=None):
+    '''
+    Return the co-occurrence matrix indices of all tokens found in the corpus dictionary
+    
+    Input: 
+    + tokens (list of string): tokens to look up
+    + w_dict (dict): dictionary of all words in the trained corpus
+    + size (int): number of rows of the co-occurrence matrix; words indexed beyond it are skipped
+    + oov (OOVResolver): optional fallback mapping unknown tokens to their closest dictionary word (see modules/oov.py)
+    Output: idx (numpy array of int) - indices of the known tokens, in the order of tokens
+    '''
+    if oov is None:
+        idx = [w_dict[w] for w in tokens if w in w_dict]
+        idx = np.array(idx, dtype=np.int64)
+        return idx[idx<size]
+    
+    idx = []
+    for w in tokens:
+        if w not in w_dict or w_dict[w]>=size:
+            w = oov.dict_word(w)
+        if w is not None:
+            idx.append(w_dict[w])
+    return np.array(idx, dtype=np.int64)
+
+
+def co_occur_sums(ctx_idx, meaning_idx, store, profile=None):
+    '''
+    Return the raw co-occurrence sums and pair counts between the context words and each meaning
+    
+    Input: 
+    + ctx_idx (numpy array of int): matrix indices of the context words
+    + meaning_idx (list of numpy array of int): matrix indices of the words of each meaning
+    + store: co-occurrence store (see modules/co_matrix.py)
+    + profile (CoProfile): optional co-occurrence profiles of the meanings (see modules/sense_profiles.py),
+      read instead of the matrix
+    Output: (sums, cnt) - lists of int, symmetric co-occurrence sum and number of word pairs for each meaning
+    '''
+    n = len(meaning_idx)
+    sums = [0]*n
+    cnt = [len(ctx_idx)*len(mn) for mn in meaning_idx]
+    
+    if profile is not None:
+        # One gather of the profile columns of the context words
+        if len(ctx_idx)!=0:
+            sums = [int(x) for x in co_occur_rows(ctx_idx, meaning_idx, store, profile).sum(axis=0)]
+        return (sums, cnt)
+    
+    all_idx = [mn for mn in meaning_idx if len(mn)!=0]
+    if len(ctx_idx)==0 or all_idx==[]:
+        return (sums, cnt)
+    
+    # One gather for every context word x meaning word pair, then a sum per meaning
+    pair = pair_sums(store, ctx_idx, np.concatenate(all_idx)).sum(axis=0)
+    bounds = np.cumsum([0] + [len(mn) for mn in meaning_idx])
+    for i in range(n):
+        sums[i] = int(pair[bounds[i]:bounds[i+1]].sum())
+    return (sums, cnt)
+
+
+def co_occur_rows(ctx_idx, meaning_idx, store, profile=None):
+    '''
+    Return the co-occurrence sum between every context word and every meaning
+    
+    Input: 
+    + ctx_idx (numpy array of int): matrix indices of the context words
+    + meaning_idx (list of numpy array of int): matrix indices of the words of each meaning
+    + store: co-occurrence store (see modules/co_matrix.py)
+    + profile (CoProfile): optional co-occurrence profiles of the meanings (see modules/sense_profiles.py)
+    Output: rows (numpy matrix of int) - one row per context word, one column per meaning
+    '''
+    if profile is not None:
+        return profile.rows(ctx_idx)
+    n = len(meaning_idx)
+    lengths = [len(mn) for mn in meaning_idx]
+    rows = np.zeros((len(ctx_idx), n), dtype=np.int64)
+    if len(ctx_idx)==0 or sum(lengths)==0:
+        return rows
+    
+    pair = pair_sums(store, ctx_idx, np.concatenate(meaning_idx))
+    # Sum the columns of each meaning
+    np.add.at(rows.T, np.repeat(np.arange(n), lengths), pair.T)
+    return rows
+
+
+def co_occur_sums_many(ctx_idx_list, meaning_idx, store, profile=None):
+    '''
+    Return the raw co-occurrence sums and pair counts of several context sentences against the same meanings
+    
+    Input: 
+    + ctx_idx_list (list of numpy array of int): matrix indices of the words of each context sentence
+    + meaning_idx (list of numpy array of int): matrix indices of the words of each meaning
+    + store: co-occurrence store (see modules/co_matrix.py)
+    + profile (CoProfile): optional co-occurrence profiles of the meanings (see modules/sense_profiles.py)
+    Output: list of (sums, cnt) - output of co_occur_sums for each context sentence, read with a single gather
+    '''
+    n = len(meaning_idx)
+    m = len(ctx_idx_list)
+    lengths = [len(mn) for mn in meaning_idx]
+    all_ctx = [ctx for ctx in ctx_idx_list if len(ctx)!=0]
+    if all_ctx==[] or sum(lengths)==0:
+        return [([0]*n, [len(ctx)*l for l in lengths]) for ctx in ctx_idx_list]
+    
+    per_meaning = co_occur_rows(np.concatenate(all_ctx), meaning_idx, store, profile)
+    # Sum the rows of each context sentence
+    row_owner = np.repeat(np.arange(m), [len(ctx) for ctx in ctx_idx_list])
+    per_context = np.zeros((m, n), dtype=np.int64)
+    np.add.at(per_context, row_owner, per_meaning)
+    return [([int(x) for x in per_context[k]], [len(ctx_idx_list[k])*l for l in lengths]) for k in range(m)]
+
+
+def co_occur_score_calc(text, meanings, w_dict, co_matrix, oov=None):
     '''
     Return the co-occurrence score between context sentence and each meaning
     
@@ -121,29 +402,27 @@ def co_occur_score_calc(text, meanings, w_dict, co_matrix):
     + text (string): context sentence
     + examples (list of string): list of meanings
     + w_dict (dict): dictionary of all words in the trained corpus
-    + co_matrix (numpy matrix): trained word co-occurrence matrix
+    + co_matrix (numpy matrix or co-occurrence store): trained word co-occurrence matrix
+    + oov (OOVResolver): optional fallback for context words missing from the corpus dictionary
     Output: scores (list of float) - list of co-occurrence scores between context sentence and each meaning
     '''
-    n = len(meanings)
-    sums = [0]*n
-    cnt = [0]*n
-    scores = []
-    
-    for w in text:
-        try:
-            w_idx = w_dict[w]
-            for i in range(n):
-                mn = meanings[i]
-                for w2 in mn:
-                    try:
-                        w2_idx = w_dict[w2]
-                        sums[i] += int(co_matrix[w_idx, w2_idx]) + int(co_matrix[w2_idx, w_idx])
-                        cnt[i] += 1
-                    except:
-                        continue
-        except:
-            continue   
+    store = as_co_store(co_matrix)
+    size = min(store.shape)
+    ctx_idx = index_tokens(text, w_dict, size, oov)
+    meaning_idx = [index_tokens(mn, w_dict, size) for mn in meanings]
+    (sums, cnt) = co_occur_sums(ctx_idx, meaning_idx, store)
+    return co_occur_score_reduce(sums, cnt)
+
+
+def co_occur_score_reduce(sums, cnt):
+    '''
+    Return the normalized co-occurrence score of each meaning from its raw sums and pair counts
     
+    Input: sums, cnt (list of int) - output of co_occur_sums
+    Output: scores (list of float) - None for meanings without pairs, 10 for meanings whose pairs never co-occur
+    '''
+    n = len(sums)
+    scores = []
     for i in range(n):
         if cnt[i]==0:
             scores.append(None)
@@ -151,6 +430,7 @@ def co_occur_score_calc(text, meanings, w_dict, co_matrix):
             scores.append(10)
         else:
             scores.append(cnt[i]/sums[i])
+    # Note: scores is a list here, so a single None makes the norm fail and leaves the scores unnormalized
     try:
         norm = np.linalg.norm(np.array(scores)[scores!=None])
         for i in range(n):
@@ -161,17 +441,20 @@ def co_occur_score_calc(text, meanings, w_dict, co_matrix):
     except:
         return scores    
 
-    
-def predict_pos_tag(text, word):
+
+def predict_pos_tag(text, word, pos_res=None, tag=pos_tag):
     '''
     Return the POS tag for the word in the context sentence
     
     Input: 
     + text (string): context sentence
     + word (string): keyword to find POS tag
+    + pos_res (list): optional result of pos_tag(text.lower()), when the sentence is already tagged
+    + tag (function): POS tagging function, underthesea pos_tag or a cached tagger (see modules/pos_tagging.py)
     Output: word_type (string) - the Vietnamese POS tag for the keyword in the context sentence
     '''
-    pos_res = pos_tag(text.lower())
+    if pos_res is None:
+        pos_res = tag(text.lower())
     
     # Case 1: keyword is matched with 1 tokenized word
     for (w, w_type) in pos_res:
@@ -181,7 +464,7 @@ def predict_pos_tag(text, word):
     # Case 2: keyword is included in the tokenized word
     for (w, w_type) in pos_res:
         if word in w:
-            pos_res2 = pos_tag(word)
+            pos_res2 = tag(word)
             for (w2, w_type2) in pos_res2:
                 if w2==word:
                     return vn_pos_tag(w_type2)               
@@ -199,55 +482,443 @@ def predict_pos_tag(text, word):
     return word_type
 
     
-def score_calc_phraser(word, text, co_matrix, w_dict, word2vec_model, weights, scrape):
+def context_window(word, text):
+    '''
+    Clean the context sentence and keep the window of 8 words on each side of the keyword, without the keyword
+    
+    Input: 
+    + word (string): keyword
+    + text (string): context sentence
+    Output: window (string) - cleaned words of the window separated by " ", the text given to the tokenizer
+    '''
+    cleaned_text = clean_test_dat(text)
+    word = "_".join(word.split(" "))
+    # Position of the keyword: number of " "-separated items up to its first occurrence (all items if it is missing)
+    w_idx = cleaned_text.split(word, 1)[0].count(" ") + 1
+    cleaned_text = [w for w in cleaned_text.replace(word, "").split(" ") if w!=""]
+    return " ".join(cleaned_text[max(w_idx-8, 0):w_idx+8])
+
+
+def clean_context(word, text):
+    '''
+    Clean and tokenize the context sentence: keep the window of 8 words on each side of the keyword, without the keyword
+    (see modules/tokenizing.py for a cached version)
+    
+    Input: 
+    + word (string): keyword
+    + text (string): context sentence
+    Output: cleaned_text (list of string) - tokenized context words
+    '''
+    return word_tokenize(context_window(word, text))
+
+
+class Senses:
+    '''
+    Preprocessed dictionary entry of a keyword: everything the scores need that does not depend on the context sentence
+    
+    + rows (list): rows [word, word_type, meaning, examples] returned by the scrape function
+    + cleaned_meanings (list of list of string): cleaned and tokenized meanings
+    + cleaned_examples (list of string): cleaned and tokenized example sentences, separated by "\\n"
+    + meaning_idx (list of numpy array of int): co-occurrence matrix indices of the words of each meaning
+    + ex_vectors, ex_starts, ex_owners: embedded example sentences (see embed_examples)
+    + ex_sq_norms (numpy array): squared norms of ex_vectors, None unless the word vectors ask for dot-product distances
+    + co_profile (CoProfile): co-occurrence profile of each meaning, None unless attached from precomputed
+      profiles (see modules/sense_profiles.py)
+    '''
+    def __init__(self, rows, cleaned_meanings, cleaned_examples, meaning_idx, ex_vectors, ex_starts, ex_owners, ex_sq_norms=None,
+                 co_profile=None):
+        self.rows = rows
+        self.cleaned_meanings = cleaned_meanings
+        self.cleaned_examples = cleaned_examples
+        self.meaning_idx = meaning_idx
+        self.ex_vectors = ex_vectors
+        self.ex_starts = ex_starts
+        self.ex_owners = ex_owners
+        self.ex_sq_norms = ex_sq_norms
+        self.co_profile = co_profile
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def build_senses(word, rows, w_dict, size, word2vec_model):
+    '''
+    Clean, tokenize, index and embed the meanings and examples of a keyword
+    
+    Input: 
+    + word (string): keyword
+    + rows (list): rows [word, word_type, meaning, examples] returned by the scrape function
+    + w_dict (dict): dictionary of all words in the trained corpus
+    + size (int): number of rows of the co-occurrence matrix
+    + word2vec_model: trained Word2Vec model (or its KeyedVectors)
+    Output: senses (Senses) - preprocessed dictionary entry
+    '''
+    word = "_".join(word.split(" "))
+    cleaned_meanings = [word_tokenize(clean_test_dat(r[2])) for r in rows]
+    cleaned_examples = [" ".join(word_tokenize(clean_test_dat(r[3].replace(word, "")))) for r in rows]
+    meaning_idx = [index_tokens(mn, w_dict, size) for mn in cleaned_meanings]
+    (ex_vectors, ex_starts, ex_owners) = embed_examples(cleaned_examples, word2vec_model)
+    ex_sq_norms = None
+    if getattr(keyed_vectors(word2vec_model), 'dot_distances', False):
+        # Computed once per keyword, see pairwise_distances (e.g. EmbeddingStore in modules/embedding_store.py)
+        ex_sq_norms = np.einsum('ij,ij->i', ex_vectors, ex_vectors)
+    return Senses(rows, cleaned_meanings, cleaned_examples, meaning_idx, ex_vectors, ex_starts, ex_owners, ex_sq_norms)
+
+
+def score_calc_phraser(word, text, co_matrix, w_dict, word2vec_model, weights, scrape, sense_cache=None, tracer=None, oov=None,
+                       tagger=None, tokenizer=None, top_k=None, feedback=None):
     '''
     Return the list of ordered meanings for the keyword in the context sentence based on calculated final scores
     
     Input: 
     + word (string): keyword
     + text (string): context sentence
-    + co_matrix (numpy matrix): trained word co-occurrence matrix
+    + co_matrix (numpy matrix or co-occurrence store): trained word co-occurrence matrix
     + w_dict (dict): dictionary of all words in the trained corpus
-    + word2vec_model: trained Word2Vec model
+    + word2vec_model: trained Word2Vec model (or its KeyedVectors)
     + weights (list): weights of co-occurrence score and word vector scores in the calculation of final score
     + scrape (function): function to scrape the Vietnamese dictionary database
+    + sense_cache (SenseIndex): optional index of preprocessed keywords (see modules/sense_index.py), used instead of scrape
+    + tracer (Tracer): optional tracer timing each stage and counting the meanings, examples and context tokens (see modules/profiling.py)
+    + oov (OOVResolver): optional fallback for context words missing from the corpus dictionary or the Word2Vec vocabulary
+    + tagger (PosTagger): optional cached POS tagger (see modules/pos_tagging.py), underthesea pos_tag is called if None
+    + tokenizer (ContextTokenizer): optional cached context tokenizer built on the same w_dict and matrix (see modules/tokenizing.py)
+    + top_k (int): only return the first top_k meanings, skipping the word vector scores of meanings ranked after them
+      when possible (see TopKRanking)
+    + feedback (FeedbackStore): optional examples added from user feedback, scored as the examples of the dictionary
+      (see modules/feedback.py)
     Output: results (dataframe) - ordered list of meanings
     '''
-    results = []
-    scrape(word, results)
-    results = pd.DataFrame(results, columns=['word', 'word_type', 'meaning', 'examples'])
-    #print(results)
+    if tracer is None:
+        tracer = NULL_TRACER
+    with tracer.request('score_calc_phraser', word=word):
+        meanings = rank_meanings(word, text, co_matrix, w_dict, word2vec_model, weights, scrape, sense_cache, tracer, oov, tagger,
+                                 tokenizer, top_k, feedback)
+        with tracer.stage('frame'):
+            return meanings_frame(meanings)
+
+
+def rank_meanings(word, text, co_matrix, w_dict, word2vec_model, weights, scrape, sense_cache=None, tracer=None, oov=None,
+                  tagger=None, tokenizer=None, top_k=None, feedback=None):
+    '''
+    Return the ordered meanings for the keyword in the context sentence, without pandas (see score_calc_phraser)
+    
+    Output: meanings (list of Meaning) - ordered meanings
+    '''
+    if tracer is None:
+        tracer = NULL_TRACER
+    store = as_co_store(co_matrix)
+    size = min(store.shape)
+    if sense_cache is None:
+        rows = []
+        with tracer.stage('scrape'):
+            scrape(word, rows)
+        with tracer.stage('senses'):
+            senses = build_senses(word, rows, w_dict, size, word2vec_model)
+    else:
+        with tracer.stage('scrape'):
+            senses = sense_cache.get(word)
+    tracer.count('meanings', len(senses))
+    tracer.count('examples', len(senses.ex_starts))
     
     # POS tagging
-    results['pred_word_type'] = predict_pos_tag(text, word)
+    with tracer.stage('pos_tag'):
+        pred_word_type = predict_pos_tag(text, word, tag=tagger if tagger is not None else pos_tag)
     
-    # Clean text
-    cleaned_text = clean_test_dat(text)
-    word = "_".join(word.split(" "))
-    w_idx = len(cleaned_text.split(word)[0].split(" "))
-    cleaned_text = cleaned_text.replace(word, "")
-    cleaned_text = remove_items(cleaned_text.split(" "), "")
-    cleaned_text = cleaned_text[max(w_idx-8, 0):min(w_idx+8, len(cleaned_text))]
-    results['cleaned_meaning'] = results['meaning'].map(lambda x: clean_test_dat(x))
-    results['cleaned_examples'] = results['examples'].map(lambda x: clean_test_dat(x.replace(word, "")))
-    
-    # Tokenize text
-    cleaned_text = word_tokenize(" ".join(cleaned_text))
-    results['cleaned_meaning'] = results['cleaned_meaning'].map(lambda x: word_tokenize(x))
-    results['cleaned_examples'] = results['cleaned_examples'].map(lambda x: " ".join(word_tokenize(x)))
+    # Clean and tokenize text (meanings and examples are preprocessed in senses)
+    with tracer.stage('clean_tokenize'):
+        if tokenizer is not None:
+            (cleaned_text, ctx_idx) = tokenizer.context(word, text)
+        else:
+            (cleaned_text, ctx_idx) = (clean_context(word, text), None)
+    tracer.count('tokens', len(cleaned_text))
         
     # Co-occurrence score
-    meanings = list(results['cleaned_meaning'])
-    co_occur_scores = co_occur_score_calc(cleaned_text, meanings, w_dict, co_matrix)
-    results['co_occur_score'] = list(co_occur_scores)
+    with tracer.stage('co_occur'):
+        if ctx_idx is None or oov is not None:
+            ctx_idx = index_tokens(cleaned_text, w_dict, size, oov)
+        (sums, cnt) = co_occur_sums(ctx_idx, senses.meaning_idx, store, senses.co_profile)
+        co_occur_scores = co_occur_score_reduce(sums, cnt)
     
     # Word vector score
-    examples = list(results['cleaned_examples'])
-    results['w_vector_score'] = list(vector_score_calc(cleaned_text, examples, word2vec_model))
-    
-    # Final score
-    results['score'] = (results['co_occur_score'].fillna(1)*weights[0] + results['w_vector_score'].fillna(1)*weights[1])/sum(weights)    
-    results['word_type_check'] = (results['word_type']!= results['pred_word_type'])
-    results.sort_values(by=['word_type_check', 'score'], ascending=[True, True], inplace=True)
-    results.reset_index(inplace=True)
-    return results
+    with tracer.stage('vector'):
+        ctx_vectors = embed_tokens(cleaned_text, word2vec_model, oov)
+        fb_examples = feedback.examples(word) if feedback is not None else None
+        if top_k is not None and fb_examples is None:
+            ranking = TopKRanking(senses, pred_word_type, co_occur_scores, ctx_vectors, weights)
+            meanings = ranking.top(top_k)
+            tracer.count('examples_skipped', ranking.report()['examples_skipped'])
+            return meanings
+        w_vector_scores = vector_scores(ctx_vectors, senses.ex_vectors, senses.ex_starts, senses.ex_owners, len(senses),
+                                        senses.ex_sq_norms, fb_examples)
+    
+    with tracer.stage('sort'):
+        meanings = rank_senses(senses, pred_word_type, co_occur_scores, w_vector_scores, weights)
+        return meanings if top_k is None else meanings[:top_k]
+
+
+class Meaning:
+    '''
+    Scored meaning of a keyword (one row of the results, without pandas)
+    
+    + index (int): position of the meaning in the dictionary entry
+    + word, word_type, meaning, examples (string): row of the dictionary entry
+    + pred_word_type (string): predicted Vietnamese POS tag of the keyword
+    + cleaned_meaning (list of string), cleaned_examples (string): preprocessed meaning and examples
+    + co_occur_score, w_vector_score (float): scores of the meaning, None if missing
+    + score (float): final score, missing scores counted as 1
+    + word_type_check (bool): True if the word type differs from the predicted POS tag (ranked after the others)
+    '''
+    __slots__ = ('index', 'word', 'word_type', 'meaning', 'examples', 'pred_word_type', 'cleaned_meaning', 'cleaned_examples',
+                 'co_occur_score', 'w_vector_score', 'score', 'word_type_check')
+
+    def __init__(self, index, row, pred_word_type, cleaned_meaning, cleaned_examples, co_occur_score, w_vector_score, weights):
+        self.index = index
+        (self.word, self.word_type, self.meaning, self.examples) = row
+        self.pred_word_type = pred_word_type
+        self.cleaned_meaning = cleaned_meaning
+        self.cleaned_examples = cleaned_examples
+        self.co_occur_score = co_occur_score
+        self.w_vector_score = w_vector_score
+        self.weight(weights)
+
+    def weight(self, weights):
+        '''
+        Compute the final score for the given weights
+        '''
+        co = 1.0 if self.co_occur_score is None else float(self.co_occur_score)
+        vec = 1.0 if self.w_vector_score is None else float(self.w_vector_score)
+        self.score = (co*weights[0] + vec*weights[1])/sum(weights)
+        self.word_type_check = self.word_type!=self.pred_word_type
+
+
+def score_meanings(senses, pred_word_type, co_occur_scores, w_vector_scores, weights):
+    '''
+    Return the scored meanings of a keyword, in the order of the dictionary entry
+    
+    Input: 
+    + senses (Senses): preprocessed dictionary entry of the keyword
+    + pred_word_type (string): predicted Vietnamese POS tag of the keyword
+    + co_occur_scores, w_vector_scores (list of float): scores of each meaning
+    + weights (list): weights of co-occurrence score and word vector scores in the calculation of final score
+    Output: meanings (list of Meaning)
+    '''
+    return [Meaning(i, senses.rows[i], pred_word_type, senses.cleaned_meanings[i], senses.cleaned_examples[i],
+                    co_occur_scores[i], w_vector_scores[i], weights) for i in range(len(senses))]
+
+
+def order_meanings(meanings):
+    '''
+    Return the meanings ordered as in the results: meanings of the predicted POS tag first, then by increasing final score
+    (the sort is stable, so ties keep the order of the dictionary entry)
+    '''
+    return sorted(meanings, key=lambda m: (m.word_type_check, m.score))
+
+
+def meanings_frame(meanings):
+    '''
+    Convert ordered meanings into the results dataframe (for display; the scoring itself does not use pandas)
+    
+    Input: meanings (list of Meaning) - ordered meanings
+    Output: results (dataframe) - one row per meaning, one column per field of Meaning ("index" first)
+    '''
+    return pd.DataFrame({c: [getattr(m, c) for m in meanings] for c in Meaning.__slots__})
+
+
+def rank_senses(senses, pred_word_type, co_occur_scores, w_vector_scores, weights):
+    '''
+    Return the list of ordered meanings from the co-occurrence and word vector scores of each meaning
+    
+    Input: 
+    + senses (Senses): preprocessed dictionary entry of the keyword
+    + pred_word_type (string): predicted Vietnamese POS tag of the keyword
+    + co_occur_scores, w_vector_scores (list of float): scores of each meaning
+    + weights (list): weights of co-occurrence score and word vector scores in the calculation of final score
+    Output: meanings (list of Meaning) - ordered meanings (see meanings_frame for the results dataframe)
+    '''
+    return order_meanings(score_meanings(senses, pred_word_type, co_occur_scores, w_vector_scores, weights))
+
+
+def example_rows(starts, n_rows, examples):
+    '''
+    Return the rows of the word vectors of some example sentences, and where each of them begins in these rows
+    
+    Input: 
+    + starts (numpy array): row where each example begins (see embed_examples)
+    + n_rows (int): number of rows of the word vectors
+    + examples (numpy array of int): selected examples
+    Output: (rows, sub_starts) - rows of the selected examples, example after example, and the start of each one in rows
+    '''
+    ends = np.append(starts[1:], n_rows)
+    lengths = ends[examples] - starts[examples]
+    sub_starts = np.cumsum(lengths) - lengths
+    rows = np.arange(lengths.sum()) + np.repeat(starts[examples] - sub_starts, lengths)
+    return (rows, sub_starts)
+
+
+class TopKRanking:
+    '''
+    Top-k ranking of the meanings of a keyword, computing the word vector scores of the meanings of the predicted POS tag first.
+
+    Meanings whose word type differs from the predicted POS tag are ranked after all the others, so the first k meanings
+    (k at most the number of meanings of the predicted POS tag) only depend on the scores of the matching meanings,
+    except through the norm N of the word vector scores over all meanings. The final score of a matching meaning is
+    A + B/N, linear in 1/N: the top-k is kept only if its order is the same, with a margin against rounding, at both ends
+    of the possible range of 1/N (the word vector score of an unscored meaning is bounded by the distances from the context
+    words to the first word of each of its examples, one distance per example instead of one per example word). Otherwise every meaning is scored and the top-k is the one of rank_senses.
+    The co-occurrence scores are cheap and computed for all meanings.
+
+    When the top-k was pruned, the word vector scores of the returned meanings are normalized over the scored meanings only
+    (the order is the same as rank_senses, the score values are not).
+    '''
+    def __init__(self, senses, pred_word_type, co_occur_scores, ctx_vectors, weights):
+        '''
+        Input: 
+        + senses (Senses): preprocessed dictionary entry of the keyword
+        + pred_word_type (string): predicted Vietnamese POS tag of the keyword
+        + co_occur_scores (list of float): co-occurrence scores of all meanings
+        + ctx_vectors (numpy matrix): word vectors of the in-vocabulary context words (see embed_tokens)
+        + weights (list): weights of co-occurrence score and word vector scores in the calculation of final score
+        '''
+        self.senses = senses
+        self.pred_word_type = pred_word_type
+        self.co_occur_scores = co_occur_scores
+        self.ctx_vectors = ctx_vectors
+        self.weights = weights
+        n_examples = len(senses.ex_starts)
+        self.check = np.array([row[1]!=pred_word_type for row in senses.rows], dtype=bool)
+        self._ex_scores = None
+        self._scored = np.zeros(n_examples, dtype=bool)
+        self._exact = None
+        self.counters = {'meanings': len(senses), 'matching_meanings': int((~self.check).sum()), 'examples': n_examples,
+                         'examples_scored': 0, 'distances': len(ctx_vectors)*len(senses.ex_vectors), 'distances_computed': 0,
+                         'pruned': 0, 'full': 0}
+        if len(ctx_vectors)==0 or n_examples==0:
+            # Nothing to score (see vector_scores)
+            self._exact = vector_scores(ctx_vectors, senses.ex_vectors, senses.ex_starts, senses.ex_owners, len(senses))
+            self._scored[:] = True
+
+    def _score_examples(self, meanings):
+        # Score the examples of the selected meanings (boolean mask) that are not scored yet
+        senses = self.senses
+        examples = np.flatnonzero(meanings[senses.ex_owners] & ~self._scored)
+        if len(examples)==0:
+            return
+        (rows, sub_starts) = example_rows(senses.ex_starts, len(senses.ex_vectors), examples)
+        sq_norms = senses.ex_sq_norms[rows] if senses.ex_sq_norms is not None else None
+        ex_scores = example_scores(self.ctx_vectors, senses.ex_vectors[rows], sub_starts, sq_norms)
+        if self._ex_scores is None:
+            self._ex_scores = np.zeros(len(senses.ex_starts), dtype=ex_scores.dtype)
+        self._ex_scores[examples] = ex_scores
+        self._scored[examples] = True
+        self.counters['examples_scored'] += len(examples)
+        self.counters['distances_computed'] += len(self.ctx_vectors)*len(rows)
+
+    def _exact_scores(self):
+        if self._exact is None:
+            self._score_examples(np.ones(len(self.senses), dtype=bool))
+            self._exact = vector_score_reduce(self._ex_scores, self.senses.ex_owners, len(self.senses))
+        return self._exact
+
+    def _partial_scores(self):
+        # Best example score of each meaning whose examples are all scored (None otherwise), and their norm
+        senses = self.senses
+        raw = [None]*len(senses)
+        if self._ex_scores is not None:
+            best = np.full(len(senses), np.inf, dtype=self._ex_scores.dtype)
+            np.minimum.at(best, senses.ex_owners[self._scored], self._ex_scores[self._scored])
+            for i in np.unique(senses.ex_owners[self._scored]):
+                raw[i] = best[i]
+        norm = float(np.linalg.norm([float(r) for r in raw if r is not None]))
+        return (raw, norm)
+
+    def _unscored_bound(self):
+        # Upper bound of the squared norm of the best example scores of the meanings not scored yet: the distance from a
+        # context word to the closest word of an example is at most its distance to the first word of the example
+        senses = self.senses
+        examples = np.flatnonzero(~self._scored)
+        if len(examples)==0:
+            return 0.0
+        first = senses.ex_starts[examples]
+        sq_norms = senses.ex_sq_norms[first] if senses.ex_sq_norms is not None else None
+        bounds = pairwise_distances(self.ctx_vectors, senses.ex_vectors[first], sq_norms).mean(axis=0)
+        self.counters['distances_computed'] += len(self.ctx_vectors)*len(first)
+        best = np.full(len(senses), np.inf)
+        np.minimum.at(best, senses.ex_owners[examples], bounds)
+        # Margin against the rounding of the float32 distances
+        return float(((best[np.isfinite(best)]*(1 + 1e-5))**2).sum())
+
+    def _certified(self, candidates, raw, norm, k):
+        # True if the first k of candidates are in the same order for every possible norm of the word vector scores
+        total = sum(self.weights)
+        if norm==0 or total==0:
+            return norm==0 and total!=0
+        co = np.array([1.0 if self.co_occur_scores[i] is None else float(self.co_occur_scores[i]) for i in candidates])
+        vec = np.array([0.0 if raw[i] is None else float(raw[i]) for i in candidates])
+        a = (co*self.weights[0] + np.where([raw[i] is None for i in candidates], 1.0, 0.0)*self.weights[1])/total
+        b = vec*self.weights[1]/total
+        (t_low, t_high) = (1/np.sqrt(norm**2 + self._unscored_bound()), 1/norm)
+        orders = []
+        for t in (t_low, t_high):
+            f = a + b*t
+            order = np.lexsort((candidates, f))
+            tol = 1e-6*(1 + np.abs(f).max())
+            for p in range(min(k, len(order) - 1)):
+                later = order[p+1:]
+                same = (a[later]==a[order[p]]) & (b[later]==b[order[p]])
+                if (~same & (f[later] - f[order[p]]<=tol)).any():
+                    return False
+            orders.append(list(order[:k]))
+        return orders[0]==orders[1]
+
+    def top(self, k):
+        '''
+        Return the first k ordered meanings (the same as rank_senses), scoring the other meanings only if needed
+        
+        Input: k (int) - number of meanings
+        Output: meanings (list of Meaning) - first k ordered meanings
+        '''
+        k = min(k, len(self.senses))
+        matching = ~self.check
+        if self._exact is None and k<=matching.sum():
+            self._score_examples(matching)
+            (raw, norm) = self._partial_scores()
+            candidates = np.flatnonzero(matching)
+            if self._certified(candidates, raw, norm, k):
+                self.counters['pruned'] += 1
+                w_vector_scores = [None if r is None else (r/norm if r else r) for r in raw]
+                return order_meanings(self._meanings(candidates, w_vector_scores))[:k]
+        self.counters['full'] += 1
+        return rank_senses(self.senses, self.pred_word_type, self.co_occur_scores, self._exact_scores(), self.weights)[:k]
+
+    def rest(self, k, fill='lazy'):
+        '''
+        Return the ordered meanings after the first k
+        
+        Input: 
+        + k (int): number of meanings already returned by top
+        + fill (string): "lazy" scores the meanings not scored yet (the same as rank_senses), "co_only" does not
+          (their word vector score is left out, and the other scores are normalized over the scored meanings only)
+        Output: meanings (list of Meaning) - ordered meanings after the first k
+        '''
+        if fill=='lazy' or self._exact is not None:
+            return rank_senses(self.senses, self.pred_word_type, self.co_occur_scores, self._exact_scores(), self.weights)[k:]
+        first = set(m.index for m in self.top(k))
+        (raw, norm) = self._partial_scores()
+        w_vector_scores = [None if r is None else (r/norm if r else r) for r in raw]
+        return order_meanings(self._meanings([i for i in range(len(self.senses)) if i not in first], w_vector_scores))
+
+    def _meanings(self, indices, w_vector_scores):
+        senses = self.senses
+        return [Meaning(i, senses.rows[i], self.pred_word_type, senses.cleaned_meanings[i], senses.cleaned_examples[i],
+                        self.co_occur_scores[i], w_vector_scores[i], self.weights) for i in indices]
+
+    def report(self):
+        '''
+        Return the counters and the share of the word vector work that was skipped
+        '''
+        report = dict(self.counters)
+        report['examples_skipped'] = report['examples'] - report['examples_scored']
+        report['distances_skipped'] = report['distances'] - report['distances_computed']
+        report['skipped_fraction'] = report['distances_skipped']/report['distances'] if report['distances']!=0 else 0.0
+        return report
@@ -0,0 +1,338 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Share of the work done after each stage of a job (see ScoringSession.update)
+STAGES = {'queued': 0.0, 'senses': 0.4, 'clean_tokenize': 0.5, 'pos_tag': 0.6, 'co_occur': 0.8, 'vector': 1.0}
+
+
+class JobCancelled(Exception):
+    '''
+    Raised in a scoring job when every session waiting for it submitted another query
+    '''
+
+
+class ScoringJob:
+    '''
+    Scoring of one query (keyword, context sentence, options) in the background, shared by every session that submits
+    the same query while it runs.
+
+    + state (string): "queued", "running", "done", "failed" or "cancelled"
+    + stage (string): last finished stage (see STAGES)
+    + session (ScoringSession): scoring session of the keyword, once it is looked up
+    + scores: scores known so far - after the "co_occur" stage the word vector scores are None (co-occurrence only)
+    + error (Exception): error of a failed job
+    '''
+    def __init__(self, key):
+        self.key = key
+        self.state = 'queued'
+        self.stage = 'queued'
+        self.session = None
+        self.scores = None
+        self.error = None
+        self.owners = set()
+        self.future = None
+        self.created = time.monotonic()
+        self.finished = None
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def progress(self):
+        return STAGES.get(self.stage, 0.0)
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        '''
+        Wait until the job is finished (done, failed or cancelled), return False if it is still running after timeout seconds
+        '''
+        return self._done.wait(timeout)
+
+    def meanings(self, weights):
+        '''
+        Return the ordered meanings from the scores known so far (None before the co-occurrence scores)
+        '''
+        from modules.score_calc import rank_senses
+        scores = self.scores
+        if scores is None:
+            return None
+        return rank_senses(self.session.senses, *scores, weights)
+
+    def frame(self, weights):
+        '''
+        Return the ordered meanings from the scores known so far as a dataframe (None before the co-occurrence scores)
+        '''
+        from modules.score_calc import meanings_frame
+        meanings = self.meanings(weights)
+        return meanings_frame(meanings) if meanings is not None else None
+
+    def _progress(self, stage, scores):
+        # Called by the worker thread after each stage
+        if self._cancelled.is_set():
+            raise JobCancelled()
+        if scores is not None:
+            self.scores = scores
+        self.stage = stage
+
+
+class ScoringExecutor:
+    '''
+    Process-wide pool of scoring jobs, so that scoring runs off the Streamlit script threads.
+
+    Identical queries in flight are scored once for all sessions. A session has at most one job: submitting a new query
+    releases its previous job, which is cancelled when no other session waits for it (before it starts, or between two
+    stages of the scoring).
+
+    The session of the last finished job of each (keyword, options) is kept in a bounded LRU, and the next job of the
+    same keyword and options starts from a copy of it (see ScoringSession.copy): the contributions of the context words
+    already seen are reused, and finished jobs are never modified. Sessions of a keyword without any meaning are not
+    kept, so that the next job looks the keyword up again (see empty_ttl in modules/sense_index.py).
+    '''
+    def __init__(self, make_session, max_workers=4, max_sessions=256):
+        '''
+        Input:
+        + make_session (function): function (keyword, options, tracer) returning a new ScoringSession of the keyword
+        + max_workers (int): number of scoring threads
+        + max_sessions (int): maximum number of (keyword, options) whose last session is kept
+        '''
+        self.make_session = make_session
+        self.max_workers = max_workers
+        self.max_sessions = max_sessions
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix='scoring')
+        self._jobs = {}
+        self._owned = {}
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'submitted': 0, 'deduplicated': 0, 'cancelled': 0, 'done': 0, 'failed': 0, 'reused_sessions': 0}
+
+    def submit(self, owner, word, text, options=None, tracer=None):
+        '''
+        Score a query for a session, joining the identical job in flight if there is one
+
+        Input:
+        + owner: identifier of the session
+        + word (string): keyword
+        + text (string): context sentence
+        + options: hashable options given to make_session (part of the identity of the query)
+        + tracer (Tracer): optional tracer timing the job, used if a new job is started (see modules/profiling.py)
+        Output: job (ScoringJob)
+        '''
+        key = (word, text, options)
+        with self._lock:
+            job = self._jobs.get(key)
+            previous = self._owned.get(owner)
+            if previous is not None and previous is not job:
+                self._release(owner, previous)
+            if job is None:
+                job = ScoringJob(key)
+                self._jobs[key] = job
+                self.counters['submitted'] += 1
+                job.future = self._pool.submit(self._run, job, word, text, options, tracer)
+            elif owner not in job.owners:
+                self.counters['deduplicated'] += 1
+            job.owners.add(owner)
+            self._owned[owner] = job
+        return job
+
+    def cancel(self, owner):
+        '''
+        Release the job of a session (e.g. when the user leaves the results), cancelling it if no other session waits for it
+        '''
+        with self._lock:
+            job = self._owned.get(owner)
+            if job is not None:
+                self._release(owner, job)
+
+    def forget(self, word):
+        '''
+        Drop the kept sessions of a keyword, e.g. when its dictionary entry or its feedback examples change
+        '''
+        with self._lock:
+            for key in [key for key in self._sessions if key[0]==word]:
+                del self._sessions[key]
+
+    def _session(self, word, options, tracer):
+        with self._lock:
+            kept = self._sessions.get((word, options))
+            if kept is not None:
+                self._sessions.move_to_end((word, options))
+                self.counters['reused_sessions'] += 1
+        return kept.copy() if kept is not None else self.make_session(word, options, tracer)
+
+    def _keep(self, word, options, session):
+        # Called with the lock held
+        self._sessions[(word, options)] = session
+        self._sessions.move_to_end((word, options))
+        while len(self._sessions)>self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _release(self, owner, job):
+        # Called with the lock held
+        job.owners.discard(owner)
+        if self._owned.get(owner) is job:
+            del self._owned[owner]
+        if job.owners or job.done() or job._cancelled.is_set():
+            return
+        job._cancelled.set()
+        if self._jobs.get(job.key) is job:
+            # A new identical query starts a new job
+            del self._jobs[job.key]
+        if job.future is not None and job.future.cancel():
+            self._finish(job, 'cancelled')
+
+    def _finish(self, job, state):
+        # Called with the lock held
+        job.state = state
+        job.finished = time.monotonic()
+        self.counters[state] += 1
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        job._done.set()
+
+    def _run(self, job, word, text, options, tracer):
+        state = 'done'
+        try:
+            if job._cancelled.is_set():
+                raise JobCancelled()
+            job.state = 'running'
+            job.session = self._session(word, options, tracer)
+            job._progress('senses', None)
+            job.session.update(text, tracer, job._progress)
+        except JobCancelled:
+            state = 'cancelled'
+        except Exception as e:
+            job.error = e
+            state = 'failed'
+        with self._lock:
+            if state=='done' and len(job.session.senses)!=0:
+                self._keep(word, options, job.session)
+            self._finish(job, state)
+
+    def stats(self):
+        '''
+        Return the counters and the numbers of queued and running jobs
+        '''
+        with self._lock:
+            stats = dict(self.counters, sessions=len(self._owned), kept_sessions=len(self._sessions))
+            stats['queued'] = sum(1 for job in self._jobs.values() if job.state=='queued')
+            stats['running'] = sum(1 for job in self._jobs.values() if job.state=='running')
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            for owner in list(self._owned):
+                self._release(owner, self._owned[owner])
+        self._pool.shutdown(wait=True)
+
+
+class DelayedScraper:
+    '''
+    Scrape function adding a delay to each lookup, to simulate slow dictionary pages
+    '''
+    def __init__(self, scrape, delay=0.05):
+        self.scrape = scrape
+        self.delay = delay
+
+    def __call__(self, word, results):
+        time.sleep(self.delay)
+        return self.scrape(word, results)
+
+
+def simulate_sessions(executor, pairs, reference, n_sessions=50, queries=5, supersede=0.3, weights=[1,2], seed=0):
+    '''
+    Simulate concurrent sessions submitting queries, some of them superseded at once by another query
+
+    Input:
+    + executor (ScoringExecutor): executor under test (options of every query: None)
+    + pairs (list of (string, string)): pairs of keyword - context sentence the queries are drawn from
+    + reference (function): function (word, text) returning the expected ordered list of meaning indices
+    + n_sessions (int): number of concurrent sessions
+    + queries (int): number of queries waited for by each session
+    + supersede (float): probability that a query is replaced by another one right after being submitted
+    + weights (list): weights of the scores
+    + seed (int): random seed
+    Output: report (dict) - numbers of waited queries, of wrong results and of failed or cancelled waited jobs,
+      latency of the waited queries and counters of the executor
+    '''
+    from modules.benchmark import summarize
+    expected = {}
+    lock = threading.Lock()
+    outcomes = []
+
+    def session(k):
+        rng = random.Random(seed + k)
+        for _ in range(queries):
+            (word, text) = rng.choice(pairs)
+            start = time.perf_counter()
+            job = executor.submit(k, word, text)
+            if rng.random()<supersede:
+                (word, text) = rng.choice(pairs)
+                job = executor.submit(k, word, text)
+            job.wait()
+            seconds = time.perf_counter() - start
+            with lock:
+                if (word, text) not in expected:
+                    expected[(word, text)] = reference(word, text)
+                target = expected[(word, text)]
+            result = [m.index for m in job.meanings(weights)] if job.state=='done' else None
+            with lock:
+                outcomes.append((job.state, result==target, seconds))
+        executor.cancel(k)
+
+    threads = [threading.Thread(target=session, args=(k,)) for k in range(n_sessions)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {'n_sessions': n_sessions, 'queries': len(outcomes), 'total_seconds': time.perf_counter() - start,
+            'wrong_results': sum(1 for (state, ok, _) in outcomes if state=='done' and not ok),
+            'not_done': sum(1 for (state, _, _) in outcomes if state!='done'),
+            'latency': summarize([s for (_, _, s) in outcomes]), 'executor': executor.stats()}
+
+
+def main(argv=None):
+    from modules import registry
+    from modules.benchmark import add_fixtures_arguments, fixtures_from_args, load_pairs
+    from modules.score_calc import rank_meanings
+    from modules.scoring_session import ScoringSession
+    from modules.sense_index import SenseIndex
+    parser = argparse.ArgumentParser(description='Many concurrent sessions scoring queries through the scoring executor')
+    add_fixtures_arguments(parser)
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds added to each dictionary lookup')
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument('--supersede', type=float, default=0.3)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    (co_matrix, w_dict, word_vectors) = (registry.get('co_matrix'), registry.get('w_dict'), registry.get('word_vectors'))
+    pairs = load_pairs()
+    scrape = DelayedScraper(fixtures_from_args(parser, args, [w for (w, _) in pairs]), args.delay)
+    tagger = registry.get('pos_tagger')
+
+    def make_session(word, options, tracer):
+        # No sense index: the first job of each keyword looks it up, as a cold start (later ones reuse its session)
+        return ScoringSession(word, co_matrix, w_dict, word_vectors, scrape, tagger=tagger, tracer=tracer)
+
+    def reference(word, text):
+        return [m.index for m in rank_meanings(word, text, co_matrix, w_dict, word_vectors, [1,2], scrape.scrape, tagger=tagger)]
+
+    executor = ScoringExecutor(make_session, args.workers)
+    try:
+        report = simulate_sessions(executor, pairs, reference, args.sessions, args.queries, args.supersede)
+    finally:
+        executor.shutdown()
+    print(json.dumps(report, indent=2))
+    return 0 if report['wrong_results']==0 and report['not_done']==0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
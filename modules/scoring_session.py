@@ -0,0 +1,209 @@
+import copy
+import numpy as np
+from underthesea import pos_tag
+from modules.co_matrix import as_co_store
+from modules.profiling import NULL_TRACER
+from modules.score_calc import (build_senses, clean_context, closest_distances, co_occur_rows, co_occur_score_reduce,
+                                embed_tokens, feedback_closest, index_tokens, meanings_frame, predict_pos_tag, rank_senses,
+                                vector_score_reduce)
+
+
+class ScoringSession:
+    '''
+    Stateful scoring of one keyword, for interactive use: the context sentence and the weights can change between calls.
+
+    Both scores are sums over the context words, so the session keeps the contribution of every context word seen so far
+    (its co-occurrence sum with each meaning and its distance to the closest word of each example sentence).
+    A new context sentence only computes the contributions of its new words; new weights only re-rank the last scores.
+    Results are the same as score_calc_phraser.
+    '''
+    def __init__(self, word, co_matrix, w_dict, word2vec_model, scrape, sense_cache=None, oov=None, tagger=None, tracer=None,
+                 tokenizer=None, feedback=None):
+        '''
+        Input:
+        + word (string): keyword
+        + co_matrix, w_dict, word2vec_model, scrape, sense_cache, oov, tagger: see score_calc_phraser
+        + tracer (Tracer): optional tracer timing the lookup of the keyword (see modules/profiling.py)
+        + tokenizer (ContextTokenizer): optional cached context tokenizer (see modules/tokenizing.py)
+        + feedback (FeedbackStore): optional examples added from user feedback (see modules/feedback.py), read once:
+          feedback recorded later is used by the next session
+        '''
+        if tracer is None:
+            tracer = NULL_TRACER
+        self.word = word
+        self.store = as_co_store(co_matrix)
+        self.size = min(self.store.shape)
+        self.w_dict = w_dict
+        self.word2vec_model = word2vec_model
+        self.oov = oov
+        self.tag = tagger if tagger is not None else pos_tag
+        self.tokenize = tokenizer.tokens if tokenizer is not None else clean_context
+        with tracer.request('scoring_session', word=word):
+            if sense_cache is None:
+                rows = []
+                with tracer.stage('scrape'):
+                    scrape(word, rows)
+                with tracer.stage('senses'):
+                    self.senses = build_senses(word, rows, w_dict, self.size, word2vec_model)
+            else:
+                with tracer.stage('scrape'):
+                    self.senses = sense_cache.get(word)
+            tracer.count('meanings', len(self.senses))
+            tracer.count('examples', len(self.senses.ex_starts))
+        # Feedback examples are scored after the examples of the dictionary, removed examples are skipped
+        n = len(self.senses)
+        self._feedback = feedback.examples(word) if feedback is not None else None
+        self._ex_owners = self.senses.ex_owners
+        self._live = None
+        if self._feedback is not None:
+            fb_owners = self._feedback[1]
+            self._live = np.concatenate([np.ones(len(self._ex_owners), dtype=bool), (fb_owners>=0) & (fb_owners<n)])
+            self._ex_owners = np.concatenate([self._ex_owners, fb_owners])[self._live]
+        # Contribution of each context word, None if the word is not in the corpus dictionary / Word2Vec vocabulary
+        self._co_rows = {}
+        self._vec_rows = {}
+        self.text = None
+        self._scores = None
+        self.counters = {'texts': 0, 'reweights': 0, 'new_tokens': 0, 'cached_tokens': 0}
+
+    def copy(self):
+        '''
+        Return a new session of the keyword starting from the contributions of the context words seen by this one
+
+        The copy shares the preprocessed dictionary entry and the contributions already computed (never modified);
+        updating it leaves this session unchanged.
+        '''
+        session = copy.copy(self)
+        session._co_rows = dict(self._co_rows)
+        session._vec_rows = dict(self._vec_rows)
+        session.counters = dict(self.counters)
+        return session
+
+    def _add_co_tokens(self, tokens):
+        new = [w for w in dict.fromkeys(tokens) if w not in self._co_rows]
+        self.counters['new_tokens'] += len(new)
+        self.counters['cached_tokens'] += len(tokens) - len(new)
+        if new==[]:
+            return
+        senses = self.senses
+        # Each token has at most one matrix index: read the rows of all new tokens together
+        idx = [index_tokens([w], self.w_dict, self.size, self.oov) for w in new]
+        co_known = [w for (w, i) in zip(new, idx) if len(i)!=0]
+        rows = {}
+        if co_known!=[]:
+            ctx_idx = np.concatenate([i for i in idx if len(i)!=0])
+            rows = dict(zip(co_known, co_occur_rows(ctx_idx, senses.meaning_idx, self.store, senses.co_profile)))
+        for w in new:
+            self._co_rows[w] = rows.get(w)
+
+    def _add_vec_tokens(self, tokens):
+        # Separate from the co-occurrence rows, so that an update stopped between the two stages leaves no missing row
+        for w in [w for w in dict.fromkeys(tokens) if w not in self._vec_rows]:
+            ctx_vectors = embed_tokens([w], self.word2vec_model, self.oov) if len(self._ex_owners)!=0 else []
+            self._vec_rows[w] = self._closest(ctx_vectors)[0] if len(ctx_vectors)!=0 else None
+
+    def _closest(self, ctx_vectors):
+        senses = self.senses
+        if len(senses.ex_starts)!=0:
+            closest = closest_distances(ctx_vectors, senses.ex_vectors, senses.ex_starts, senses.ex_sq_norms)
+        else:
+            closest = np.zeros((len(ctx_vectors), 0), dtype=np.float32)
+        if self._feedback is None:
+            return closest
+        closest = np.concatenate([closest, feedback_closest(ctx_vectors, self._feedback[0]).astype(closest.dtype)], axis=1)
+        return closest[:, self._live]
+
+    def update(self, text, tracer=None, progress=None):
+        '''
+        Score the meanings against a new context sentence, reusing the contributions of the words already seen
+
+        Input:
+        + text (string): context sentence
+        + tracer (Tracer): optional tracer timing each stage (see modules/profiling.py)
+        + progress (function): optional function called after each stage with the name of the stage and the scores known
+          so far (after "co_occur", the word vector scores are all None, i.e. the meanings are ranked by co-occurrence only).
+          It may raise an exception to stop the update, which leaves the last scores unchanged (see modules/scoring_jobs.py)
+        '''
+        if tracer is None:
+            tracer = NULL_TRACER
+        with tracer.request('scoring_session.update', word=self.word):
+            self._update(text, tracer, progress if progress is not None else (lambda stage, scores: None))
+
+    def _update(self, text, tracer, progress):
+        senses = self.senses
+        n = len(senses)
+        with tracer.stage('clean_tokenize'):
+            cleaned_text = self.tokenize(self.word, text)
+        tracer.count('tokens', len(cleaned_text))
+        progress('clean_tokenize', None)
+
+        with tracer.stage('pos_tag'):
+            pred_word_type = predict_pos_tag(text, self.word, tag=self.tag)
+        progress('pos_tag', None)
+
+        # Co-occurrence score
+        new_tokens = self.counters['new_tokens']
+        with tracer.stage('co_occur'):
+            self._add_co_tokens(cleaned_text)
+            co_rows = [self._co_rows[w] for w in cleaned_text if self._co_rows[w] is not None]
+            lengths = [len(mn) for mn in senses.meaning_idx]
+            sums = [int(x) for x in np.sum(co_rows, axis=0, dtype=np.int64)] if co_rows!=[] else [0]*n
+            co_occur_scores = co_occur_score_reduce(sums, [len(co_rows)*l for l in lengths])
+        tracer.count('new_tokens', self.counters['new_tokens'] - new_tokens)
+        progress('co_occur', (pred_word_type, co_occur_scores, [None]*n))
+
+        # Word vector score
+        with tracer.stage('vector'):
+            self._add_vec_tokens(cleaned_text)
+            vec_rows = [self._vec_rows[w] for w in cleaned_text if self._vec_rows[w] is not None]
+            if vec_rows==[]:
+                w_vector_scores = vector_score_reduce(np.zeros(0), self._ex_owners[:0], n)
+            else:
+                ex_scores = np.stack(vec_rows).sum(axis=0)/len(vec_rows)
+                w_vector_scores = vector_score_reduce(ex_scores, self._ex_owners, n)
+
+        self.text = text
+        self._scores = (pred_word_type, co_occur_scores, w_vector_scores)
+        self.counters['texts'] += 1
+        progress('vector', self._scores)
+
+    def meanings(self, weights):
+        '''
+        Return the ordered meanings of the last context sentence for the given weights (no score is recomputed)
+
+        Input: weights (list) - weights of co-occurrence score and word vector scores in the calculation of final score
+        Output: meanings (list of score_calc.Meaning) - ordered meanings
+        '''
+        self.counters['reweights'] += 1
+        return rank_senses(self.senses, *self._scores, weights)
+
+    def rank(self, weights, tracer=None):
+        '''
+        Return the ordered meanings of the last context sentence for the given weights, as a dataframe (see meanings)
+
+        Input:
+        + weights (list): weights of co-occurrence score and word vector scores in the calculation of final score
+        + tracer (Tracer): optional tracer timing the ranking (see modules/profiling.py)
+        Output: results (dataframe) - ordered list of meanings
+        '''
+        if tracer is None:
+            tracer = NULL_TRACER
+        with tracer.request('scoring_session.rank', word=self.word):
+            with tracer.stage('sort'):
+                meanings = self.meanings(weights)
+            with tracer.stage('frame'):
+                return meanings_frame(meanings)
+
+    def score(self, text, weights, tracer=None):
+        '''
+        Return the ordered meanings for a context sentence, updating the scores only if the sentence changed
+
+        Input:
+        + text (string): context sentence
+        + weights (list): weights of co-occurrence score and word vector scores in the calculation of final score
+        + tracer (Tracer): optional tracer timing each stage (see modules/profiling.py)
+        Output: results (dataframe) - ordered list of meanings
+        '''
+        if text!=self.text:
+            self.update(text, tracer)
+        return self.rank(weights, tracer)
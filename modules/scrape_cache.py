@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from modules.scrape_dict import dict_key
+
+
+class ScrapeCache:
+    '''
+    Cache around a scrape function (web_scraping, DictStore, ...) keeping the same (word, results) contract.
+
+    Entries live in an in-memory LRU with size and TTL eviction, and optionally in a folder of json files
+    which survives restarts. Concurrent misses for the same keyword are coalesced: only one call to the
+    scrape function runs, the other callers wait for its results.
+    '''
+    def __init__(self, scrape, maxsize=256, ttl=24*3600, disk_dir=None, clock=time.time):
+        '''
+        Input:
+        + scrape (function): scrape function to cache
+        + maxsize (int): maximum number of keywords kept in memory
+        + ttl (float): time to live of an entry in seconds, None to never expire
+        + disk_dir (string): optional folder of the on-disk cache
+        + clock (function): time source, returns the current time in seconds
+        '''
+        self.scrape = scrape
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.clock = clock
+        self._entries = OrderedDict()   # key -> (time, rows)
+        self._inflight = {}             # key -> (event, outcome)
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'expirations': 0}
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _expired(self, fetched_at):
+        return self.ttl is not None and self.clock() - fetched_at > self.ttl
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _disk_get(self, key):
+        try:
+            with open(self._disk_path(key), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['key']!=key or self._expired(entry['time']):
+            return None
+        return (entry['time'], entry['rows'])
+
+    def _disk_put(self, key, fetched_at, rows):
+        # Write then rename, so that a concurrent reader never sees a partial file
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'time': fetched_at, 'rows': rows}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _memory_put(self, key, fetched_at, rows):
+        # Called with the lock held
+        self._entries[key] = (fetched_at, rows)
+        self._entries.move_to_end(key)
+        while len(self._entries)>self.maxsize:
+            self._entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def _lookup(self, key):
+        # Called with the lock held; returns the cached rows or None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[0]):
+            del self._entries[key]
+            self.counters['expirations'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get_rows(self, word):
+        '''
+        Return the dictionary rows of a keyword, scraping it only if it is not cached
+
+        Input: word (string) - keyword to search
+        Output: rows (list) - rows [word, word_type, meaning, examples] (shared with the cache, do not modify)
+        '''
+        key = dict_key(word)
+        with self._lock:
+            rows = self._lookup(key)
+            if rows is not None:
+                self.counters['hits'] += 1
+                return rows
+            if key in self._inflight:
+                (event, outcome) = self._inflight[key]
+                self.counters['coalesced'] += 1
+                leader = False
+            else:
+                (event, outcome) = (threading.Event(), {})
+                self._inflight[key] = (event, outcome)
+                leader = True
+
+        if not leader:
+            event.wait()
+            if 'error' in outcome:
+                raise outcome['error']
+            return outcome['rows']
+
+        try:
+            entry = self._disk_get(key) if self.disk_dir is not None else None
+            if entry is not None:
+                with self._lock:
+                    self.counters['disk_hits'] += 1
+            else:
+                rows = []
+                self.scrape(word, rows)
+                entry = (self.clock(), [list(r) for r in rows])
+                if self.disk_dir is not None:
+                    self._disk_put(key, *entry)
+                with self._lock:
+                    self.counters['misses'] += 1
+            with self._lock:
+                self._memory_put(key, *entry)
+            outcome['rows'] = entry[1]
+            return entry[1]
+        except Exception as e:
+            outcome['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def __call__(self, word, results):
+        '''
+        Scrape dictionary database for the searched keyword, through the cache
+
+        Input:
+        + word (string): keyword to search
+        + results (list): result list to update the browsed results
+        Output: results (list) - updated result list after appending results of the searched keyword
+        '''
+        for row in self.get_rows(word):
+            results.append([word] + row[1:])
+
+    def stats(self):
+        '''
+        Return the cache counters and the number of keywords held in memory
+        '''
+        with self._lock:
+            return dict(self.counters, size=len(self._entries))
+
+    def clear(self):
+        '''
+        Empty the in-memory cache (the on-disk cache is kept)
+        '''
+        with self._lock:
+            self._entries.clear()
+
+
+def cached_scrape(maxsize=256, ttl=24*3600, disk_dir=None):
+    '''
+    Decorator caching a scrape function with ScrapeCache
+
+    Input: maxsize, ttl, disk_dir - see ScrapeCache
+    Output: decorator (function)
+    '''
+    def decorator(scrape):
+        return ScrapeCache(scrape, maxsize=maxsize, ttl=ttl, disk_dir=disk_dir)
+    return decorator
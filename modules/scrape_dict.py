@@ -1,21 +1,30 @@
 from bs4 import BeautifulSoup
 import requests
 
-def web_scraping(word, results):
+src_url='http://tratu.soha.vn/dict/vn_vn/'
+
+
+def dict_key(word):
     '''
-    Scrape dictionary database for the searched keyword
+    Return the key of the keyword in the Tra Tu dictionary (as used in its page urls)
+    
+    Input: word (string) - keyword
+    Output: key (string) - lowercased keyword with spaces replaced by "_"
+    '''
+    return '_'.join(str(word).lower().split(" "))
+
+
+def parse_dict_page(word, content, results):
+    '''
+    Parse a Tra Tu dictionary page of the searched keyword
     
     Input: 
-    + word (string): keyword to search
+    + word (string): searched keyword
+    + content (bytes or string): html content of the dictionary page
     + results (list): result list to update the browsed results
     Output: results (list) - updated result list after appending results of the searched keyword
     '''
-    src_url='http://tratu.soha.vn/dict/vn_vn/'
-    word_searched = '_'.join(str(word).lower().split(" "))
-    url = src_url + word_searched
-    result = requests.get(url)
-    c = result.content
-    soup = BeautifulSoup(c,"lxml")
+    soup = BeautifulSoup(content,"lxml")
     
     summary = soup.find('div',{'id':'bodyContent'})
     sections = summary.find_all('div', {'id': 'content-3'})
@@ -28,4 +37,19 @@ def web_scraping(word, results):
             examples = meanings[j].find_all('i')
             exps = " \n ".join(list(map(lambda x: x.get_text().strip(), examples)))
             results.append([word, word_type, mn, exps])
+
+
+def web_scraping(word, results):
+    '''
+    Scrape dictionary database for the searched keyword
+    
+    Input: 
+    + word (string): keyword to search
+    + results (list): result list to update the browsed results
+    Output: results (list) - updated result list after appending results of the searched keyword
+    '''
+    url = src_url + dict_key(word)
+    result = requests.get(url)
+    c = result.content
+    parse_dict_page(word, c, results)
             
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from modules.co_matrix import as_co_store
+from modules.score_calc import Senses, build_senses, keyed_vectors
+
+
+class SenseIndex:
+    '''
+    Index of preprocessed keywords (see score_calc.Senses), built lazily on first use or in bulk offline.
+
+    Keywords are kept in memory (LRU) and, if cache_dir is given, persisted as one ".npz" file per keyword.
+    Keywords without any meaning (missing word or failed lookup) are never persisted, and are looked up again after
+    empty_ttl seconds.
+    The persisted files depend on w_dict, the co-occurrence matrix size and the Word2Vec model:
+    use a new cache_dir whenever these are retrained.
+    '''
+    def __init__(self, scrape, w_dict, co_matrix, word2vec_model, cache_dir=None, maxsize=4096, profiles=None,
+                 empty_ttl=60, clock=time.monotonic):
+        '''
+        Input:
+        + scrape (function): function to scrape the Vietnamese dictionary database
+        + w_dict (dict): dictionary of all words in the trained corpus
+        + co_matrix (numpy matrix or co-occurrence store): trained word co-occurrence matrix
+        + word2vec_model: trained Word2Vec model
+        + cache_dir (string): optional folder of the persisted keywords
+        + maxsize (int): maximum number of keywords kept in memory
+        + profiles (SenseProfiles): optional precomputed co-occurrence profiles attached to the keywords they match
+          (see modules/sense_profiles.py)
+        + empty_ttl (float): time to live in seconds of a keyword without any meaning
+        + clock (function): time source, returns the current time in seconds
+        '''
+        self.scrape = scrape
+        self.w_dict = w_dict
+        self.size = min(as_co_store(co_matrix).shape)
+        self.word2vec_model = word2vec_model
+        self.cache_dir = cache_dir
+        self.maxsize = maxsize
+        self.profiles = profiles
+        self.empty_ttl = empty_ttl
+        self.clock = clock
+        self._senses = OrderedDict()
+        self._empty_until = {}
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+    def _remember(self, key, senses):
+        with self._lock:
+            self._senses[key] = senses
+            self._senses.move_to_end(key)
+            if len(senses)==0:
+                self._empty_until[key] = self.clock() + self.empty_ttl
+            else:
+                self._empty_until.pop(key, None)
+            while len(self._senses)>self.maxsize:
+                (old_key, _) = self._senses.popitem(last=False)
+                self._empty_until.pop(old_key, None)
+
+    def get(self, word):
+        '''
+        Return the preprocessed dictionary entry of a keyword, building it if needed
+
+        Input: word (string) - keyword
+        Output: senses (Senses)
+        '''
+        # Example cleaning removes the keyword as typed, so the key keeps its case
+        key = "_".join(word.split(" "))
+        with self._lock:
+            senses = self._senses.get(key)
+            if senses is not None and key in self._empty_until and self.clock()>=self._empty_until[key]:
+                # Look up again a keyword that had no meaning (the dictionary may have been unavailable)
+                del self._senses[key]
+                del self._empty_until[key]
+                senses = None
+            if senses is not None:
+                self._senses.move_to_end(key)
+                return senses
+
+        senses = self._load(key) if self.cache_dir is not None else None
+        if senses is None:
+            rows = []
+            self.scrape(word, rows)
+            senses = build_senses(word, rows, self.w_dict, self.size, self.word2vec_model)
+            if self.cache_dir is not None and len(senses)!=0:
+                self._save(key, senses)
+        if self.profiles is not None:
+            self.profiles.attach(key, senses)
+        self._remember(key, senses)
+        return senses
+
+    def build_many(self, words):
+        '''
+        Preprocess keywords in bulk (e.g. offline, before starting the application)
+
+        Input: words (iterable of string) - keywords
+        Output: n (int) - number of keywords processed
+        '''
+        n = 0
+        for word in words:
+            self.get(word)
+            n += 1
+        return n
+
+    def _save(self, key, senses):
+        meta = {'key': key, 'size': self.size, 'rows': senses.rows,
+                'cleaned_meanings': senses.cleaned_meanings, 'cleaned_examples': senses.cleaned_examples}
+        lengths = [len(mn) for mn in senses.meaning_idx]
+        meaning_idx = np.concatenate(senses.meaning_idx) if lengths!=[] else np.zeros(0, dtype=np.int64)
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+        np.savez(tmp_path, meta=np.array(json.dumps(meta, ensure_ascii=False)),
+                 meaning_idx=meaning_idx, meaning_len=np.array(lengths, dtype=np.int64),
+                 ex_vectors=senses.ex_vectors, ex_starts=senses.ex_starts, ex_owners=senses.ex_owners,
+                 **({'ex_sq_norms': senses.ex_sq_norms} if senses.ex_sq_norms is not None else {}))
+        os.replace(tmp_path, path)
+
+    def _load(self, key):
+        try:
+            data = np.load(self._path(key), allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        with data:
+            meta = json.loads(str(data['meta']))
+            if meta['key']!=key or meta['size']!=self.size or data['ex_vectors'].shape[1]!=keyed_vectors(self.word2vec_model).vector_size:
+                return None
+            bounds = np.cumsum(data['meaning_len'])[:-1]
+            meaning_idx = np.split(data['meaning_idx'], bounds) if len(data['meaning_len'])!=0 else []
+            return Senses(meta['rows'], meta['cleaned_meanings'], meta['cleaned_examples'], meaning_idx,
+                          data['ex_vectors'], data['ex_starts'], data['ex_owners'],
+                          data['ex_sq_norms'] if 'ex_sq_norms' in data.files else None)
+
+
+if __name__ == '__main__':
+    # Build the sense index offline for a list of keywords (one per line)
+    import sys
+    from modules import registry
+    from modules.dict_store import DictStore
+    index = SenseIndex(DictStore(sys.argv[2]), registry.get('w_dict'), registry.get('co_matrix'), registry.get('word_vectors'),
+                       cache_dir=sys.argv[3])
+    with open(sys.argv[1], encoding='utf-8') as f:
+        n = index.build_many(line.strip() for line in f if line.strip()!='')
+    print(f'Indexed {n} keywords into {sys.argv[3]}')
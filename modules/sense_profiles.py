@@ -0,0 +1,275 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+import scipy.sparse as sp
+from modules.co_matrix import as_co_store
+
+
+def profile_matrix(meaning_idx, co_matrix):
+    '''
+    Return the co-occurrence profile of each meaning over the vocabulary of the co-occurrence matrix
+
+    The profile of a meaning is, for every word v, the symmetric co-occurrence sum of v with all words of the meaning
+    (M[v, w] + M[w, v] summed over the words w of the meaning), so that the co-occurrence sum of a context sentence
+    with the meaning is the sum of the profile over the context words (see score_calc.co_occur_sums).
+
+    Input:
+    + meaning_idx (list of numpy array of int): matrix indices of the words of each meaning
+    + co_matrix (numpy matrix or co-occurrence store): trained word co-occurrence matrix
+    Output: profile (scipy CSR matrix of int64) - one row per meaning, one column per word of the matrix
+    '''
+    store = as_co_store(co_matrix)
+    size = min(store.shape)
+    n = len(meaning_idx)
+    lengths = [len(mn) for mn in meaning_idx]
+    if sum(lengths)==0:
+        return sp.csr_matrix((n, size), dtype=np.int64)
+    words = np.concatenate(meaning_idx)
+    vocab = np.arange(size)
+    per_word = store.block(words, vocab).astype(np.int64) + store.block(vocab, words).astype(np.int64).T
+    profile = np.zeros((n, size), dtype=np.int64)
+    np.add.at(profile, np.repeat(np.arange(n), lengths), per_word)
+    return sp.csr_matrix(profile)
+
+
+def fingerprint(meaning_idx):
+    '''
+    Return a fingerprint of the matrix indices of the words of each meaning, to check that a profile belongs to them
+    '''
+    h = hashlib.sha1()
+    for mn in meaning_idx:
+        h.update(np.asarray(mn, dtype=np.int64).tobytes())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+class CoProfile:
+    '''
+    Co-occurrence profiles of the meanings of one keyword (see profile_matrix), read by context words
+
+    The non-zero sums are kept sorted by (meaning, word), so that the sums of all meanings with all context words
+    are found with a single binary search.
+    '''
+    def __init__(self, matrix):
+        '''
+        Input: matrix (scipy CSR matrix) - one row per meaning, one column per word of the matrix, sorted column indices
+        '''
+        self.matrix = matrix
+        self.shape = matrix.shape
+        meanings = np.repeat(np.arange(matrix.shape[0], dtype=np.int64), np.diff(matrix.indptr))
+        self._keys = meanings*matrix.shape[1] + matrix.indices
+        self._data = matrix.data.astype(np.int64)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def rows(self, ctx_idx):
+        '''
+        Return the co-occurrence sum between every context word and every meaning (see score_calc.co_occur_rows)
+
+        Input: ctx_idx (numpy array of int) - matrix indices of the context words
+        Output: rows (numpy matrix of int64) - one row per context word, one column per meaning (zeros for the words
+          beyond the vocabulary of the profile)
+        '''
+        ctx_idx = np.asarray(ctx_idx, dtype=np.int64)
+        queries = np.arange(self.shape[0], dtype=np.int64)[None, :]*self.shape[1] + ctx_idx[:, None]
+        if len(self._keys)==0:
+            return np.zeros(queries.shape, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._keys, queries), len(self._keys) - 1)
+        # A word beyond the vocabulary would otherwise read the key of another meaning
+        known = ((ctx_idx>=0) & (ctx_idx<self.shape[1]))[:, None]
+        return np.where(known & (self._keys[pos]==queries), self._data[pos], 0)
+
+
+class SenseProfiles:
+    '''
+    Precomputed co-occurrence profiles (see profile_matrix) of the meanings of many keywords.
+
+    The profiles of all keywords are the rows of one sparse matrix; each keyword has a range of rows and the fingerprint
+    of its meanings, so that profiles built from another version of a dictionary entry are not used.
+    '''
+    def __init__(self, matrix, keys, starts, fingerprints):
+        '''
+        Input:
+        + matrix (scipy CSR matrix): profiles of all meanings of all keywords, keyword after keyword
+        + keys (list of string): keywords (spaces replaced by "_")
+        + starts (numpy array of int): first row of each keyword, followed by the number of rows
+        + fingerprints (list of string): fingerprint of the meanings of each keyword
+        '''
+        self.matrix = matrix
+        self.keys = list(keys)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.fingerprints = list(fingerprints)
+        self._positions = {key: i for (i, key) in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def get(self, key, meaning_idx):
+        '''
+        Return the profile of the meanings of a keyword
+
+        Input:
+        + key (string): keyword, spaces replaced by "_"
+        + meaning_idx (list of numpy array of int): matrix indices of the words of each meaning of the keyword
+        Output: profile (CoProfile) - None if the keyword has no profile or its profile was built from other meanings
+        '''
+        i = self._positions.get(key)
+        if i is None or self.fingerprints[i]!=fingerprint(meaning_idx):
+            return None
+        return CoProfile(self.matrix[self.starts[i]:self.starts[i+1]])
+
+    def attach(self, key, senses):
+        '''
+        Attach the profile of a keyword to its preprocessed dictionary entry (see score_calc.Senses)
+
+        Output: attached (bool) - False if the keyword has no matching profile
+        '''
+        if senses.co_profile is None:
+            senses.co_profile = self.get(key, senses.meaning_idx)
+        return senses.co_profile is not None
+
+
+def build_profiles(words, sense_cache, co_matrix):
+    '''
+    Build the co-occurrence profiles of the meanings of many keywords
+
+    Input:
+    + words (iterable of string): keywords
+    + sense_cache (SenseIndex): index of preprocessed keywords (see modules/sense_index.py)
+    + co_matrix (numpy matrix or co-occurrence store): trained word co-occurrence matrix
+    Output: profiles (SenseProfiles)
+    '''
+    store = as_co_store(co_matrix)
+    (keys, blocks, fingerprints, starts) = ([], [], [], [0])
+    for word in dict.fromkeys(words):
+        senses = sense_cache.get(word)
+        keys.append("_".join(word.split(" ")))
+        blocks.append(profile_matrix(senses.meaning_idx, store))
+        fingerprints.append(fingerprint(senses.meaning_idx))
+        starts.append(starts[-1] + len(senses))
+    size = min(store.shape)
+    matrix = sp.vstack(blocks, format='csr') if blocks!=[] else sp.csr_matrix((0, size), dtype=np.int64)
+    matrix.sort_indices()
+    return SenseProfiles(matrix, keys, starts, fingerprints)
+
+
+def save_profiles(profiles, path):
+    '''
+    Save co-occurrence profiles in a ".npz" file: the sparse matrix (data, indices, indptr and shape, the data as int32
+    when every sum fits) and the keywords with their rows and fingerprints
+    '''
+    matrix = profiles.matrix
+    data = matrix.data
+    if len(data)==0 or (data.min()>=np.iinfo(np.int32).min and data.max()<=np.iinfo(np.int32).max):
+        data = data.astype(np.int32)
+    meta = {'keys': profiles.keys, 'fingerprints': profiles.fingerprints}
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, data=data, indices=matrix.indices, indptr=matrix.indptr, shape=np.array(matrix.shape),
+             starts=profiles.starts, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+    os.replace(tmp_path, path)
+
+
+def load_profiles(path):
+    '''
+    Load co-occurrence profiles saved with save_profiles
+
+    Input: path (string) - ".npz" file
+    Output: profiles (SenseProfiles)
+    '''
+    with np.load(path, allow_pickle=False) as data:
+        # The sums are read as int64, as the co-occurrence sums of the matrix
+        matrix = sp.csr_matrix((data['data'].astype(np.int64), data['indices'], data['indptr']), shape=tuple(data['shape']))
+        matrix.sort_indices()
+        meta = json.loads(str(data['meta']))
+        return SenseProfiles(matrix, meta['keys'], data['starts'], meta['fingerprints'])
+
+
+def check_equivalence(pairs, sense_cache, profiles, w_dict, co_matrix):
+    '''
+    Compare the co-occurrence sums and scores read from the profiles with the ones read from the matrix
+
+    Input:
+    + pairs (list of (string, string)): pairs of keyword - context sentence
+    + sense_cache (SenseIndex): index of preprocessed keywords, without profiles attached
+    + profiles (SenseProfiles): profiles of the keywords
+    + w_dict, co_matrix: see score_calc_phraser
+    Output: report (dict) - whether the sums, pair counts and scores are identical (scores "10" of meanings whose word
+      pairs never co-occur included), the number of such scores and of missing scores, the pairs without a matching
+      profile and the mean time per pair in microseconds of each path
+    '''
+    from modules.score_calc import clean_context, co_occur_score_reduce, co_occur_sums, index_tokens
+    store = as_co_store(co_matrix)
+    size = min(store.shape)
+    inputs = []
+    missing = 0
+    for (word, text) in pairs:
+        senses = sense_cache.get(word)
+        profile = profiles.get("_".join(word.split(" ")), senses.meaning_idx)
+        if profile is None:
+            missing += 1
+            continue
+        inputs.append((index_tokens(clean_context(word, text), w_dict, size), senses.meaning_idx, profile))
+
+    identical = True
+    (sentinels, nones) = (0, 0)
+    for (ctx_idx, meaning_idx, profile) in inputs:
+        expected = co_occur_sums(ctx_idx, meaning_idx, store)
+        actual = co_occur_sums(ctx_idx, meaning_idx, store, profile)
+        scores = co_occur_score_reduce(*expected)
+        identical = identical and actual==expected and co_occur_score_reduce(*actual)==scores
+        sentinels += sum(1 for (s, c) in zip(*expected) if c!=0 and s==0)
+        nones += sum(1 for x in scores if x is None)
+
+    report = {'n_pairs': len(pairs), 'missing_profiles': missing, 'identical': identical,
+              'sentinel_scores': sentinels, 'missing_scores': nones}
+    for (name, use_profile) in (('matrix', False), ('profile', True)):
+        start = time.perf_counter()
+        for (ctx_idx, meaning_idx, profile) in inputs:
+            co_occur_sums(ctx_idx, meaning_idx, store, profile if use_profile else None)
+        report[f'{name}_us'] = 1e6*(time.perf_counter() - start)/max(len(inputs), 1)
+    return report
+
+
+def main(argv=None):
+    from modules import registry
+    from modules.sense_index import SenseIndex
+    parser = argparse.ArgumentParser(description='Co-occurrence profiles of the meanings of a list of keywords')
+    parser.add_argument('keywords', help='file of keywords, one per line')
+    parser.add_argument('--db', default=registry.DICT_DB_PATH, help='dictionary database (DictStore)')
+    parser.add_argument('--fixtures', help='json file of saved dictionary entries, used instead of the database')
+    parser.add_argument('--out', default=registry.SENSE_PROFILES_PATH)
+    parser.add_argument('--check', help='test data (xlsx) whose co-occurrence scores are compared with the matrix')
+    args = parser.parse_args(argv)
+
+    if args.fixtures is not None:
+        from modules.benchmark import FixtureScraper
+        scrape = FixtureScraper(args.fixtures)
+    else:
+        from modules.dict_store import DictStore
+        scrape = DictStore(args.db)
+    co_matrix = registry.get('co_matrix')
+    sense_cache = SenseIndex(scrape, registry.get('w_dict'), co_matrix, registry.get('word_vectors'))
+    with open(args.keywords, encoding='utf-8') as f:
+        words = [line.strip() for line in f if line.strip()!='']
+    profiles = build_profiles(words, sense_cache, co_matrix)
+    save_profiles(profiles, args.out)
+    print(f'Saved the profiles of {len(profiles)} keywords ({profiles.matrix.shape[0]} meanings, '
+          f'{profiles.matrix.nnz} non-zero sums) to {args.out}')
+    if args.check is not None:
+        from modules.benchmark import load_pairs
+        report = check_equivalence(load_pairs(args.check), sense_cache, profiles, registry.get('w_dict'), co_matrix)
+        print(json.dumps(report, indent=2))
+        return 0 if report['identical'] else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
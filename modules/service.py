@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+RESULT_COLUMNS = ['word', 'word_type', 'meaning', 'examples', 'pred_word_type', 'co_occur_score', 'w_vector_score', 'score']
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+               500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+# Scoring state of the worker processes, set in the parent before the pool is forked and shared copy-on-write
+_state = {}
+
+
+def load_state(fixtures=None):
+    '''
+    Load the models, the dictionary source and the caches used by the workers (in the parent process, before forking)
+
+    Input: fixtures (string) - optional fixtures json file (see benchmark.FixtureScraper) used instead of the dictionary
+    '''
+    from modules import registry
+    from modules.sense_index import SenseIndex
+    registry.preload(['co_matrix', 'w_dict', 'word_vectors', 'pos_tagger', 'context_tokenizer'])
+    _state['co_matrix'] = registry.get('co_matrix')
+    _state['w_dict'] = registry.get('w_dict')
+    _state['word_vectors'] = registry.get('word_vectors')
+    _state['tagger'] = registry.get('pos_tagger')
+    _state['tokenizer'] = registry.get('context_tokenizer')
+    if fixtures is not None:
+        from modules.benchmark import FixtureScraper
+        _state['scrape'] = FixtureScraper(fixtures)
+        _state['sense_cache'] = SenseIndex(_state['scrape'], _state['w_dict'], _state['co_matrix'], _state['word_vectors'])
+    else:
+        _state['scrape'] = registry.get('dictionary')
+        _state['sense_cache'] = registry.get('sense_index')
+    # Load the underthesea models now, so that the workers share them too
+    _state['tagger'].tag('khởi động')
+    _state['tokenizer'].tokens('khởi', 'khởi động')
+
+
+def _json_value(v):
+    if isinstance(v, (float, np.floating)):
+        return None if math.isnan(v) else float(v)
+    if isinstance(v, np.integer):
+        return int(v)
+    return v
+
+
+def result_records(meanings):
+    '''
+    Return the ordered meanings as a json-serializable list of dictionaries (missing scores are None)
+
+    Input: meanings (list of score_calc.Meaning) - ordered meanings
+    Output: records (list of dict)
+    '''
+    return [{c: _json_value(getattr(m, c)) for c in RESULT_COLUMNS} for m in meanings]
+
+
+def _ping():
+    return os.getpid()
+
+
+def _score_one(word, text, weights, top_k=None):
+    # Run in a worker process
+    from modules.score_calc import rank_meanings
+    meanings = rank_meanings(word, text, _state['co_matrix'], _state['w_dict'], _state['word_vectors'], weights,
+                                 _state['scrape'], sense_cache=_state['sense_cache'], tagger=_state['tagger'],
+                                 tokenizer=_state['tokenizer'], top_k=top_k)
+    return result_records(meanings)
+
+
+def _score_many(pairs, weights):
+    # Run in a worker process
+    from modules.batch import disambiguate_many
+    results = disambiguate_many(pairs, _state['co_matrix'], _state['w_dict'], _state['word_vectors'], weights, _state['scrape'],
+                                sense_cache=_state['sense_cache'], tagger=_state['tagger'], frames=False,
+                                tokenizer=_state['tokenizer'])
+    return [result_records(r) for (_, _, r) in results]
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ScoringService:
+    '''
+    Asynchronous HTTP/JSON service around score_calc_phraser, scoring in a pool of pre-forked worker processes.
+
+    Endpoints:
+    + POST /disambiguate: {"word": ..., "context": ..., "weights": [1, 2], "top_k": k (optional)} -> {"results": [meaning, ...]}
+    + POST /disambiguate/batch: {"pairs": [[word, context], ...], "weights": [1, 2]} -> {"results": [[meaning, ...], ...]}
+    + GET /health: status, number of workers and of pending requests
+    + GET /metrics: request counters and latencies (Prometheus text format)
+
+    At most max_pending requests are queued or scored at a time; further requests are rejected at once with a 503
+    status and a Retry-After header, so that clients back off instead of piling up behind a saturated pool.
+    '''
+    def __init__(self, workers=None, max_pending=None, max_batch=1000, max_body=1 << 20, read_timeout=10.0):
+        '''
+        Input:
+        + workers (int): number of worker processes, all cores if None
+        + max_pending (int): maximum number of requests queued or being scored, 4 per worker if None
+        + max_batch (int): maximum number of pairs of a batch request
+        + max_body (int): maximum size of a request body in bytes
+        + read_timeout (float): time allowed to a client to send a request, in seconds
+        '''
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.max_pending = max_pending if max_pending is not None else 4*self.workers
+        self.max_batch = max_batch
+        self.max_body = max_body
+        self.read_timeout = read_timeout
+        self.pending = 0
+        self.pool = None
+        self.started_at = None
+        self.requests = {}
+        self.latency = {}
+        self.rejected = 0
+
+    async def start(self, host='127.0.0.1', port=8000):
+        '''
+        Fork the worker pool (the state loaded by load_state is shared copy-on-write) and start listening
+        '''
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+        loop = asyncio.get_running_loop()
+        # Submitting one task per worker at once forks the whole pool now rather than on the first requests
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _ping) for _ in range(self.workers)])
+        self.started_at = time.time()
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if request_line==b'':
+            return None
+        parts = request_line.decode('latin-1').split()
+        if len(parts)!=3:
+            raise HttpError(400, 'malformed request line')
+        (method, path, version) = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            (name, _, value) = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400, 'invalid Content-Length header')
+        if length>self.max_body:
+            raise HttpError(413, 'request body too large')
+        body = await reader.readexactly(length) if length>0 else b''
+        keep_alive = headers.get('connection', '').lower()!='close' and version=='HTTP/1.1'
+        return (method, path.split('?')[0], body, keep_alive)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.read_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HttpError as e:
+                    await self._respond(writer, e.status, {'error': str(e)}, False)
+                    break
+                if request is None:
+                    break
+                (method, path, body, keep_alive) = request
+                start = time.perf_counter()
+                (status, payload, headers) = await self._dispatch(method, path, body)
+                self._record(path if status!=404 else 'other', status, time.perf_counter() - start)
+                await self._respond(writer, status, payload, keep_alive, headers)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive, headers=None):
+        if isinstance(payload, str):
+            (body, content_type) = (payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+        else:
+            (body, content_type) = (json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+        lines = [f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}', f'Content-Type: {content_type}',
+                 f'Content-Length: {len(body)}', 'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+        lines += [f'{name}: {value}' for (name, value) in (headers or {}).items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def _dispatch(self, method, path, body):
+        routes = {'/disambiguate': ('POST', self._disambiguate), '/disambiguate/batch': ('POST', self._disambiguate_batch),
+                  '/health': ('GET', self._health), '/metrics': ('GET', self._metrics)}
+        if path not in routes:
+            return (404, {'error': f'unknown path {path}'}, None)
+        (allowed, handler) = routes[path]
+        if method!=allowed:
+            return (405, {'error': f'{path} only accepts {allowed}'}, {'Allow': allowed})
+        try:
+            return (200, await handler(body), None)
+        except HttpError as e:
+            headers = {'Retry-After': '1'} if e.status==503 else None
+            return (e.status, {'error': str(e)}, headers)
+        except Exception as e:
+            return (500, {'error': repr(e)}, None)
+
+    async def _submit(self, func, *args):
+        # Backpressure: reject instead of queueing more than max_pending requests
+        if self.pending>=self.max_pending:
+            self.rejected += 1
+            raise HttpError(503, 'too many pending requests, retry later')
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+        finally:
+            self.pending -= 1
+
+    def _parse(self, body):
+        try:
+            request = json.loads(body)
+        except ValueError:
+            raise HttpError(400, 'the request body is not valid json')
+        if not isinstance(request, dict):
+            raise HttpError(400, 'the request body must be a json object')
+        weights = request.get('weights', [1, 2])
+        if (not isinstance(weights, list) or len(weights)!=2 or not all(isinstance(w, (int, float)) for w in weights)
+                or sum(weights)==0):
+            raise HttpError(400, '"weights" must be a list of 2 numbers with a non-zero sum')
+        return (request, weights)
+
+    async def _disambiguate(self, body):
+        (request, weights) = self._parse(body)
+        (word, text) = (request.get('word'), request.get('context'))
+        if not isinstance(word, str) or not isinstance(text, str) or word.strip()=='':
+            raise HttpError(400, '"word" and "context" must be strings')
+        top_k = request.get('top_k')
+        if top_k is not None and (not isinstance(top_k, int) or isinstance(top_k, bool) or top_k<1):
+            raise HttpError(400, '"top_k" must be a positive integer')
+        return {'word': word, 'context': text, 'results': await self._submit(_score_one, word, text, weights, top_k)}
+
+    async def _disambiguate_batch(self, body):
+        (request, weights) = self._parse(body)
+        pairs = request.get('pairs')
+        if (not isinstance(pairs, list)
+                or not all(isinstance(p, list) and len(p)==2 and all(isinstance(x, str) for x in p) for p in pairs)):
+            raise HttpError(400, '"pairs" must be a list of [word, context] pairs of strings')
+        if len(pairs)>self.max_batch:
+            raise HttpError(413, f'at most {self.max_batch} pairs per batch')
+        return {'results': await self._submit(_score_many, [tuple(p) for p in pairs], weights)}
+
+    async def _health(self, body):
+        return {'status': 'ok', 'workers': self.workers, 'pending': self.pending, 'max_pending': self.max_pending,
+                'uptime_seconds': time.time() - self.started_at}
+
+    def _record(self, path, status, seconds):
+        key = (path, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        (total, count) = self.latency.get(path, (0.0, 0))
+        self.latency[path] = (total + seconds, count + 1)
+
+    async def _metrics(self, body):
+        lines = ['# TYPE vn_dict_requests_total counter']
+        lines += [f'vn_dict_requests_total{{path="{path}",status="{status}"}} {n}' for ((path, status), n) in sorted(self.requests.items())]
+        lines.append('# TYPE vn_dict_request_seconds summary')
+        for (path, (total, count)) in sorted(self.latency.items()):
+            lines.append(f'vn_dict_request_seconds_sum{{path="{path}"}} {total}')
+            lines.append(f'vn_dict_request_seconds_count{{path="{path}"}} {count}')
+        lines += ['# TYPE vn_dict_rejected_total counter', f'vn_dict_rejected_total {self.rejected}',
+                  '# TYPE vn_dict_pending gauge', f'vn_dict_pending {self.pending}',
+                  '# TYPE vn_dict_workers gauge', f'vn_dict_workers {self.workers}']
+        return '\n'.join(lines) + '\n'
+
+
+async def serve(host='127.0.0.1', port=8000, workers=None, max_pending=None, fixtures=None):
+    '''
+    Load the models and run the scoring service until cancelled
+
+    Input:
+    + host, port: address to listen on
+    + workers, max_pending: see ScoringService
+    + fixtures (string): optional fixtures json file used instead of the dictionary (see load_state)
+    '''
+    load_state(fixtures)
+    service = ScoringService(workers, max_pending)
+    server = await service.start(host, port)
+    print(f'Listening on http://{host}:{port} with {service.workers} workers', flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP/JSON word sense disambiguation service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--max-pending', type=int)
+    parser.add_argument('--fixtures', help='json file of saved dictionary entries, used instead of the dictionary')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_pending, args.fixtures))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from underthesea import word_tokenize
+from modules.score_calc import context_window, index_tokens
+
+
+class ContextTokenizer:
+    '''
+    Context sentence preprocessing (see score_calc.clean_context) with an LRU cache of tokenized windows.
+
+    Windows are cached by their normalized text (the cleaned window around the keyword, see score_calc.context_window),
+    so the tokens are identical to clean_context, and different sentences sharing the same window are tokenized once.
+    If w_dict is given, the co-occurrence matrix indices of the tokens are computed once per window as well.
+    The returned tokens and indices are shared with the cache and must not be modified.
+    '''
+    def __init__(self, w_dict=None, size=None, maxsize=10000, tokenize=word_tokenize):
+        '''
+        Input:
+        + w_dict (dict): optional dictionary of all words in the trained corpus
+        + size (int): number of rows of the co-occurrence matrix (required with w_dict)
+        + maxsize (int): maximum number of cached windows
+        + tokenize (function): word tokenization function
+        '''
+        self.w_dict = w_dict
+        self.size = size
+        self.maxsize = maxsize
+        self._tokenize = tokenize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'hits': 0, 'misses': 0, 'tokenize_seconds': 0.0}
+
+    def _entry(self, window):
+        with self._lock:
+            self.counters['calls'] += 1
+            entry = self._cache.get(window)
+            if entry is not None:
+                self._cache.move_to_end(window)
+                self.counters['hits'] += 1
+                return entry
+        start = time.perf_counter()
+        tokens = self._tokenize(window)
+        seconds = time.perf_counter() - start
+        idx = None
+        if self.w_dict is not None:
+            idx = index_tokens(tokens, self.w_dict, self.size)
+            idx.flags.writeable = False
+        entry = (tokens, idx)
+        with self._lock:
+            self.counters['misses'] += 1
+            self.counters['tokenize_seconds'] += seconds
+            self._cache[window] = entry
+            while len(self._cache)>self.maxsize:
+                self._cache.popitem(last=False)
+        return entry
+
+    def context(self, word, text):
+        '''
+        Return the tokenized context words of the context sentence and their co-occurrence matrix indices
+
+        Input:
+        + word (string): keyword
+        + text (string): context sentence
+        Output: (cleaned_text, idx) - tokens (as clean_context) and their indices (as index_tokens), None without w_dict
+        '''
+        return self._entry(context_window(word, text))
+
+    def tokens(self, word, text):
+        '''
+        Return the tokenized context words of the context sentence (as clean_context)
+        '''
+        return self._entry(context_window(word, text))[0]
+
+    __call__ = tokens
+
+    def stats(self):
+        '''
+        Return the counters, the hit rate, the mean tokenization time of a cache miss in milliseconds and the cache size
+        '''
+        with self._lock:
+            stats = dict(self.counters, size=len(self._cache))
+        stats['hit_rate'] = stats['hits']/stats['calls'] if stats['calls']!=0 else 0.0
+        stats['mean_tokenize_ms'] = 1000*stats['tokenize_seconds']/stats['misses'] if stats['misses']!=0 else 0.0
+        return stats
@@ -0,0 +1,27 @@
+import numpy as np
+
+
+class FakeKeyedVectors:
+    '''
+    In-memory word vectors with the interface of gensim KeyedVectors used by the modules
+    '''
+    def __init__(self, words, vector_size=16, seed=0):
+        rng = np.random.default_rng(seed)
+        self.index_to_key = list(words)
+        self.key_to_index = {w: i for (i, w) in enumerate(self.index_to_key)}
+        self.vectors = rng.normal(size=(len(self.index_to_key), vector_size)).astype(np.float32)
+        self.vector_size = vector_size
+
+    def __getitem__(self, word):
+        return self.vectors[self.key_to_index[word]]
+
+    def __contains__(self, word):
+        return word in self.key_to_index
+
+
+class FakeModel:
+    '''
+    Word2Vec model holding FakeKeyedVectors
+    '''
+    def __init__(self, words, vector_size=16, seed=0):
+        self.wv = FakeKeyedVectors(words, vector_size, seed)
@@ -0,0 +1,103 @@
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip('underthesea')
+from modules import annotator as annotator_module
+from modules.annotator import Annotator, split_sentences, window_tokens
+from modules.score_calc import build_senses, clean_test_dat, context_window
+from tests.helpers import FakeModel
+
+# Letters only: digits are removed by the cleaning of the meanings, examples and context sentences
+VOCAB = ['w' + a + b for a in 'abcdefgh' for b in 'abcdefgh'][:60]
+
+LONG = 'một hai ba bốn năm sáu bảy tám chín mười tôi thích ăn cơm với gia đình mỗi ngày một hai ba bốn năm sáu bảy tám chín'
+
+
+def test_split_sentences():
+    lines = ['Tôi thích ăn cơm. Bạn', 'thích ăn phở!  Còn anh?', '', 'Không có dấu chấm', 'ở cuối']
+    assert list(split_sentences(lines))==['Tôi thích ăn cơm.', 'Bạn thích ăn phở!', 'Còn anh?',
+                                          'Không có dấu chấm ở cuối']
+    assert list(split_sentences(['  ', 'A… b.', '', '', 'c'])) == ['A…', 'b.', 'c']
+    assert list(split_sentences([])) == []
+
+
+def test_split_sentences_cuts_long_sentences():
+    sentences = list(split_sentences([' '.join(['từ']*50), ' '.join(['cơm']*50)], max_chars=40))
+    assert all(len(s)<=40 for s in sentences)
+    assert ' '.join(sentences).split()==['từ']*50 + ['cơm']*50
+    # No space to cut at
+    assert list(split_sentences(['x'*25], max_chars=10))==['x'*10, 'x'*10, 'x'*5]
+
+
+@pytest.mark.parametrize(('word', 'text'), [
+    ('ăn', 'Tôi thích ăn cơm với gia đình.'),
+    ('ăn', LONG),
+    ('ngày', LONG),
+    ('một', LONG),
+    # Missing keyword: the last 8 syllables
+    ('rơi', LONG),
+    # A keyword of several syllables is never found by context_window either
+    ('gia đình', LONG),
+])
+def test_window_tokens_matches_context_window(word, text):
+    # One token per syllable: the window is exactly the one of context_window
+    tokens = clean_test_dat(text).split()
+    assert window_tokens(word, tokens)==context_window(word, text).split(' ')
+
+
+def test_window_tokens_keeps_the_words_of_the_sentence():
+    tokens = ['một', 'hai', 'ba', 'bốn', 'năm', 'sáu', 'bảy', 'tám', 'chín', 'mười', 'tôi', 'thích', 'ăn cơm', 'với',
+              'gia đình', 'mỗi', 'ngày', 'một', 'hai', 'ba', 'bốn', 'năm', 'sáu', 'bảy', 'tám', 'chín']
+    # The keyword is removed from the word that includes it, the window counts syllables
+    for word in ('ăn', 'gia', 'mười'):
+        window = window_tokens(word, tokens)
+        assert ' '.join(window)==context_window(word, ' '.join(tokens))
+    assert window_tokens('ăn', tokens)[7:10]==['cơm', 'với', 'gia đình']
+    assert window_tokens('gia', tokens)[4:7]==['ăn cơm', 'với', 'đình']
+
+
+def test_window_tokens_matches_whole_syllables_only():
+    # Documented divergence: context_window finds "ăn" inside "văn" and removes it from there
+    text = 'tôi thích văn học và ăn cơm với gia đình mỗi ngày một hai ba bốn năm sáu bảy tám chín mười'
+    tokens = text.split()
+    assert context_window('ăn', text).split(' ')==['tôi', 'thích', 'v', 'học', 'và', 'cơm', 'với', 'gia', 'đình', 'mỗi',
+                                                    'ngày']
+    assert window_tokens('ăn', tokens)==['tôi', 'thích', 'văn', 'học', 'và', 'cơm', 'với', 'gia', 'đình', 'mỗi', 'ngày',
+                                         'một', 'hai', 'ba']
+
+
+def slow_tagger(text):
+    # Earlier sentences take longer, so that the worker processes finish them out of order
+    words = text.split()
+    time.sleep(0.02*int(words[0][1:]) if words[0].startswith('s') else 0)
+    return [(w, 'N') for w in words]
+
+
+class FakeSenseCache:
+    def __init__(self, model):
+        words = lambda *i: ' '.join(VOCAB[j] for j in i)
+        rows = [['w', 'Danh từ', words(1, 2), words(3, 4)], ['w', 'Danh từ', words(5), words(6, 7, 8)],
+                ['w', 'Động từ', words(9), words(10, 11)]]
+        self.senses = build_senses('w', rows, {w: i for (i, w) in enumerate(VOCAB)}, len(VOCAB), model)
+
+    def get(self, word):
+        # Only the words of the vocabulary are in the dictionary
+        return self.senses if word in VOCAB else []
+
+
+@pytest.mark.parametrize(('workers', 'max_pending'), [(1, None), (3, None), (3, 2)])
+def test_annotate_many_keeps_the_input_order(monkeypatch, workers, max_pending):
+    model = FakeModel(VOCAB)
+    # Stub tokenizer: one token per syllable
+    monkeypatch.setattr(annotator_module, 'word_tokenize', lambda text: text.split())
+    annotator = Annotator(np.ones((len(VOCAB), len(VOCAB)), dtype=np.int64), {w: i for (i, w) in enumerate(VOCAB)},
+                          model, None, sense_cache=FakeSenseCache(model), tagger=slow_tagger)
+    sentences = ['s%d %s %s %s' % (9 - i, VOCAB[i], VOCAB[i+1], VOCAB[2*i]) for i in range(10)]
+    records = list(annotator.annotate_many(iter(sentences), workers, max_pending))
+    assert [r['sentence'] for r in records]==list(range(10))
+    assert [r['text'] for r in records]==sentences
+    assert [r['tokens'] for r in records]==[4]*10
+    assert [[a['word'] for a in r['words']] for r in records]==[list(dict.fromkeys(s.split()[1:])) for s in sentences]
+    assert records==[{'sentence': i, 'text': s, 'tokens': n, 'words': annotator.annotate(s)[0]}
+                     for (i, (s, n)) in enumerate(zip(sentences, [4]*10))]
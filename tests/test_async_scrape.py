@@ -0,0 +1,207 @@
+import asyncio
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+import pytest
+import requests
+from modules import async_scrape
+from modules.async_scrape import CircuitBreaker, CircuitOpenError, DictFetcher
+from modules.scrape_dict import parse_dict_page
+
+PAGES = os.path.join(os.path.dirname(__file__), 'fixtures', 'pages')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    Dictionary website stub: each keyword key has a list of planned answers, consumed one per request
+    (the last one is repeated), "page" by default
+    '''
+    def do_GET(self):
+        key = unquote(self.path.lstrip('/'))
+        server = self.server
+        with server.lock:
+            server.requests.append(key)
+            plan = server.plans.get(key, ['page'])
+            action = plan.pop(0) if len(plan)>1 else plan[0]
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            self.answer(key, action)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def answer(self, key, action):
+        if action=='slow':
+            time.sleep(1)
+            action = 'page'
+        if action=='delay':
+            time.sleep(0.05)
+            action = 'page'
+        if action=='page':
+            path = os.path.join(PAGES, key + '.html')
+            body = open(path if os.path.exists(path) else os.path.join(PAGES, 'rơi.html'), 'rb').read()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif action=='error':
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif action=='redirect':
+            # Redirect loop: requests raises TooManyRedirects, which is not a network error
+            self.send_response(302)
+            self.send_header('Location', self.path)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    # Keywords without a page of their own get the page of "rơi"
+    (server.lock, server.plans, server.requests) = (threading.Lock(), {}, [])
+    (server.in_flight, server.max_in_flight) = (0, 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def page_rows(word, file_name):
+    rows = []
+    with open(os.path.join(PAGES, file_name), 'rb') as f:
+        parse_dict_page(word, f.read(), rows)
+    return rows
+
+
+def test_sync_adapter_returns_the_parsed_page(server):
+    fetcher = DictFetcher(server.url, retries=0)
+    results = []
+    fetcher('rơi', results)
+    assert results==page_rows('rơi', 'rơi.html') and len(results)>0
+    fetcher.scrape('thay đổi', results)
+    assert results==page_rows('rơi', 'rơi.html') + page_rows('thay đổi', 'thay_đổi.html')
+    assert server.requests==['rơi', 'thay_đổi']
+
+
+def test_timeouts_are_retried_with_backoff(server, monkeypatch):
+    delays = []
+    sleep = asyncio.sleep
+
+    async def recording_sleep(delay):
+        delays.append(delay)
+        await sleep(0)
+    monkeypatch.setattr(async_scrape.asyncio, 'sleep', recording_sleep)
+    monkeypatch.setattr(async_scrape.random, 'random', lambda: 1.0)
+    server.plans['rơi'] = ['slow', 'error', 'page']
+    fetcher = DictFetcher(server.url, timeout=0.2, retries=3, backoff=0.5)
+    start = time.monotonic()
+    assert asyncio.run(fetcher.fetch('rơi'))==page_rows('rơi', 'rơi.html')
+    assert time.monotonic() - start < 1
+    # Exponential backoff: 0.5s then 1s (random jitter at its maximum)
+    assert delays==[0.5, 1.0]
+    assert server.requests==['rơi']*3
+    assert fetcher.breaker.failures==0
+
+
+def test_retries_give_up_after_the_last_attempt(server, monkeypatch):
+    monkeypatch.setattr(async_scrape.random, 'random', lambda: 0.0)
+    server.plans['rơi'] = ['error']
+    fetcher = DictFetcher(server.url, retries=2, backoff=0.01, breaker=CircuitBreaker(failure_threshold=10))
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(fetcher.fetch('rơi'))
+    assert server.requests==['rơi']*3
+    assert fetcher.breaker.failures==3
+
+
+def test_breaker_opens_half_opens_and_closes(server):
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    fetcher = DictFetcher(server.url, retries=0, breaker=breaker)
+    server.plans['rơi'] = ['error', 'error', 'error', 'page']
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            asyncio.run(fetcher.fetch('rơi'))
+    # Open: no request is sent
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(fetcher.fetch('rơi'))
+    assert len(server.requests)==2
+    # Half-open: a failed trial opens the circuit again
+    clock.now = 31
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(fetcher.fetch('rơi'))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(fetcher.fetch('rơi'))
+    # A successful trial closes it
+    clock.now = 62
+    assert len(asyncio.run(fetcher.fetch('rơi')))>0
+    assert (breaker.opened_at, breaker.trial, breaker.failures)==(None, False, 0)
+    assert len(server.requests)==4
+
+
+def test_trial_failing_with_a_non_network_error_reopens_the_circuit(server):
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    fetcher = DictFetcher(server.url, retries=0, breaker=breaker)
+    # Each redirect of the loop is a request: requests gives up after 30
+    server.plans['rơi'] = ['error'] + ['redirect']*31 + ['page']
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(fetcher.fetch('rơi'))
+    clock.now = 31
+    with pytest.raises(requests.TooManyRedirects):
+        asyncio.run(fetcher.fetch('rơi'))
+    assert breaker.trial is False and breaker.opened_at==31
+    clock.now = 62
+    assert len(asyncio.run(fetcher.fetch('rơi')))>0
+    assert breaker.opened_at is None
+
+
+def test_cancelled_trial_lets_another_trial_through(server):
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    fetcher = DictFetcher(server.url, timeout=2, retries=0, breaker=breaker)
+    server.plans['rơi'] = ['error', 'slow', 'page']
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(fetcher.fetch('rơi'))
+    clock.now = 31
+
+    async def cancelled_trial():
+        task = asyncio.ensure_future(fetcher.fetch('rơi'))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancelled_trial())
+    assert breaker.trial is False
+    assert len(asyncio.run(fetcher.fetch('rơi')))>0
+
+
+def test_fetch_many_bounds_the_concurrency(server):
+    words = [f'từ{i}' for i in range(12)] + ['rơi', 'khôngcó']
+    for w in words:
+        server.plans[w.replace(' ', '_')] = ['delay']
+    server.plans['khôngcó'] = ['error']
+    fetcher = DictFetcher(server.url, max_concurrency=3, retries=0, breaker=CircuitBreaker(failure_threshold=100))
+    entries = asyncio.run(fetcher.fetch_many(words))
+    assert list(entries)==words
+    assert entries['rơi']==page_rows('rơi', 'rơi.html')
+    assert entries['từ0']==page_rows('từ0', 'rơi.html')
+    assert isinstance(entries['khôngcó'], requests.HTTPError)
+    assert server.max_in_flight<=3 and len(server.requests)==len(words)
@@ -0,0 +1,34 @@
+import random
+import numpy as np
+import pytest
+
+pytest.importorskip('underthesea')
+from modules.batch import vector_scores_many
+from modules.score_calc import build_senses, embed_tokens, vector_scores
+from tests.helpers import FakeModel
+
+# Letters only: digits are removed by the cleaning of the meanings, examples and context sentences
+VOCAB = ['w' + a + b for a in 'abcdefgh' for b in 'abcdefgh'][:60]
+
+
+def random_senses(rng, model):
+    words = VOCAB + ['x' + a for a in 'abcdefghij']
+    sentence = lambda k: " ".join(rng.choice(words) for _ in range(k))
+    rows = [['từ', 'Danh từ', sentence(3), " \n ".join(sentence(rng.randint(1, 8)) for _ in range(rng.randint(0, 3)))]
+            for _ in range(rng.randint(1, 6))]
+    return build_senses('từ', rows, {w: i for (i, w) in enumerate(VOCAB)}, len(VOCAB), model)
+
+
+@pytest.mark.parametrize('max_floats', [1, 2**22])
+def test_vector_scores_many_matches_vector_scores(max_floats):
+    model = FakeModel(VOCAB)
+    rng = random.Random(0)
+    for _ in range(100):
+        senses = random_senses(rng, model)
+        contexts = [[rng.choice(VOCAB + ['x']) for _ in range(rng.randint(0, 10))] for _ in range(rng.randint(1, 6))]
+        ctx_vectors = [embed_tokens(c, model) for c in contexts]
+        actual = vector_scores_many(ctx_vectors, senses, max_floats)
+        for (ctx, scores) in zip(ctx_vectors, actual):
+            expected = vector_scores(ctx, senses.ex_vectors, senses.ex_starts, senses.ex_owners, len(senses))
+            assert [s is None for s in scores]==[e is None for e in expected]
+            assert np.allclose([s for s in scores if s is not None], [e for e in expected if e is not None], rtol=1e-6)
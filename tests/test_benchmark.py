@@ -0,0 +1,51 @@
+import json
+import random
+import pytest
+from modules.benchmark import context_variant, fixture_scraper
+
+
+def test_context_variant_keeps_the_keyword_and_its_neighbours():
+    rng = random.Random(0)
+    text = 'hôm qua lá vàng rơi xuống đất rất nhiều ở sân trường'
+    for _ in range(50):
+        variant = context_variant('rơi', text, rng)
+        assert len(variant.split(' '))==len(text.split(' ')) - 1
+        assert 'vàng rơi xuống' in variant
+    assert context_variant('thay đổi', 'tôi thay đổi ý kiến', rng)=='tôi thay đổi ý kiến'
+
+
+def test_fixture_scraper_records_missing_keywords_once(tmp_path, monkeypatch):
+    from modules import dict_store
+    calls = []
+
+    class FakeStore:
+        def __init__(self, path):
+            pass
+
+        def __contains__(self, word):
+            return word!='khôngcó'
+
+        def __call__(self, word, results):
+            calls.append(word)
+            results.append([word, 'Động từ', f'nghĩa của {word}', ''])
+
+    monkeypatch.setattr(dict_store, 'DictStore', FakeStore)
+    path = str(tmp_path / 'fixtures.json')
+    scrape = fixture_scraper(path, ['rơi', 'thay đổi', 'rơi'], record_from='dict.db')
+    assert calls==['rơi', 'thay đổi']
+    rows = []
+    scrape('rơi', rows)
+    assert rows==[['rơi', 'Động từ', 'nghĩa của rơi', '']]
+    # Later runs read the file, and only record new keywords
+    fixture_scraper(path, ['rơi', 'thay đổi', 'bàn'], record_from='dict.db')
+    assert calls==['rơi', 'thay đổi', 'bàn']
+    with open(path, encoding='utf-8') as f:
+        assert len(json.load(f))==3
+    # Complete fixtures need no database
+    fixture_scraper(path, ['rơi', 'bàn'])
+    # Keywords are never recorded from the website, nor recorded empty
+    with pytest.raises(ValueError, match='--record-from'):
+        fixture_scraper(path, ['rơi', 'ăn'])
+    with pytest.raises(ValueError, match='khôngcó'):
+        fixture_scraper(path, ['khôngcó'], record_from='dict.db')
+    assert calls==['rơi', 'thay đổi', 'bàn']
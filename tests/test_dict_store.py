@@ -0,0 +1,88 @@
+import os
+import pytest
+import requests
+from modules.dict_store import DictStore, ingest_html_dir
+from modules.scrape_dict import parse_dict_page
+
+PAGES = os.path.join(os.path.dirname(__file__), 'fixtures', 'pages')
+
+
+@pytest.fixture(autouse=True)
+def no_network(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('network access')
+    monkeypatch.setattr(requests, 'get', fail)
+    monkeypatch.setattr(requests.Session, 'request', fail)
+
+
+def parsed_rows(word, file_name):
+    with open(os.path.join(PAGES, file_name), 'rb') as f:
+        rows = []
+        parse_dict_page(word, f.read(), rows)
+    return rows
+
+
+class CountingScraper:
+    def __init__(self, entries):
+        self.entries = entries
+        self.calls = []
+
+    def __call__(self, word, results):
+        self.calls.append(word)
+        for row in self.entries.get(word, []):
+            results.append([word] + row[1:])
+
+
+def test_ingest_returns_the_rows_of_the_parser(tmp_path):
+    db_path = str(tmp_path / 'dict.db')
+    (n_words, failed) = ingest_html_dir(PAGES, db_path)
+    assert n_words==2
+    assert failed==['khôngcó.html']
+
+    store = DictStore(db_path)
+    for (word, file_name) in [('rơi', 'rơi.html'), ('thay đổi', 'thay_đổi.html')]:
+        expected = parsed_rows(word, file_name)
+        assert len(expected)>0
+        rows = []
+        store(word, rows)
+        assert rows==expected
+        assert word in store
+    # Lookups ignore the case of the keyword, as the dictionary urls
+    rows = []
+    store('Rơi', rows)
+    assert [r[1:] for r in rows]==[r[1:] for r in parsed_rows('rơi', 'rơi.html')]
+    assert len(store)==2
+
+
+def test_missing_word_goes_to_fallback_once(tmp_path):
+    db_path = str(tmp_path / 'dict.db')
+    ingest_html_dir(PAGES, db_path)
+    fallback = CountingScraper({'ăn': [['ăn', 'Động từ', 'cho vào miệng', 'ăn cơm']], 'xyz': []})
+    store = DictStore(db_path, fallback=fallback)
+
+    rows = []
+    store('ăn', rows)
+    assert rows==[['ăn', 'Động từ', 'cho vào miệng', 'ăn cơm']]
+    rows = []
+    store('ăn', rows)
+    assert rows==[['ăn', 'Động từ', 'cho vào miệng', 'ăn cơm']]
+    assert fallback.calls==['ăn']
+
+    # Words found in the store never reach the fallback
+    store('rơi', [])
+    assert fallback.calls==['ăn']
+
+    # A keyword without any meaning is remembered too
+    rows = []
+    store('xyz', rows)
+    store('xyz', rows)
+    assert rows==[]
+    assert fallback.calls==['ăn', 'xyz']
+
+
+def test_store_without_fallback_returns_no_rows(tmp_path):
+    store = DictStore(str(tmp_path / 'dict.db'))
+    rows = []
+    store('rơi', rows)
+    assert rows==[]
+    assert 'rơi' not in store
@@ -0,0 +1,157 @@
+import random
+import numpy as np
+import pytest
+
+pytest.importorskip('underthesea')
+from modules.feedback import FeedbackIndex, FeedbackLog, FeedbackStore, KeywordExamples
+from modules.score_calc import build_senses, embed_tokens, vector_scores
+from tests.helpers import FakeModel
+
+# Letters only: digits are removed by the cleaning of the context sentences
+VOCAB = ['w' + a + b for a in 'abcdefgh' for b in 'abcdefgh'][:60]
+WORD = 'từ'
+
+
+def example(i, max_tokens=4, vector_size=3):
+    # Example i: every vector holds i, so the kept examples can be told apart
+    return np.full((max_tokens, vector_size), i, dtype=np.float32)
+
+
+def kept(examples, meaning_index):
+    (vectors, owners) = examples.examples()
+    return sorted(int(v[0, 0]) for v in vectors[owners==meaning_index])
+
+
+def test_reservoir_keeps_at_most_max_examples():
+    examples = KeywordExamples(4, 3, 5, random.Random(0))
+    for i in range(1000):
+        examples.add(i % 2, example(i))
+    (_, owners) = examples.examples()
+    assert (owners==0).sum()==(owners==1).sum()==5
+    assert examples.seen=={0: 500, 1: 500}
+    assert examples.used - examples.removed==10
+    assert all(v % 2==0 for v in kept(examples, 0)) and all(v % 2==1 for v in kept(examples, 1))
+
+
+def test_reservoir_replacement_is_uniform():
+    (n, max_examples, trials) = (20, 5, 2000)
+    counts = np.zeros(n)
+    rng = random.Random(0)
+    for _ in range(trials):
+        examples = KeywordExamples(4, 3, max_examples, rng)
+        for i in range(n):
+            examples.add(0, example(i))
+        counts[kept(examples, 0)] += 1
+    # Every example is kept with probability max_examples/n
+    assert counts.sum()==trials*max_examples
+    assert np.allclose(counts/trials, max_examples/n, atol=0.04)
+
+
+def test_compact_remaps_the_slots():
+    examples = KeywordExamples(4, 3, 3, random.Random(1))
+    for i in range(40):
+        examples.add(i % 3, example(i))
+    before = {m: kept(examples, m) for m in range(3)}
+    slot_values = {m: [int(examples.vectors[s, 0, 0]) for s in slots] for (m, slots) in examples.slots.items()}
+    # Examples not sampled take no slot, replaced ones are removed
+    removed = examples.removed
+    assert removed==examples.used - 9>0
+    assert examples.compact()==removed
+    assert (examples.used, examples.removed)==(9, 0)
+    assert (examples.examples()[1]>=0).all()
+    for (m, slots) in examples.slots.items():
+        assert [int(examples.vectors[s, 0, 0]) for s in slots]==slot_values[m]
+        assert (examples.owners[slots]==m).all()
+        assert kept(examples, m)==before[m]
+    assert examples.compact()==0
+    # Replacements after the compaction remove a slot of the same meaning
+    for i in range(40, 100):
+        examples.add(i % 3, example(i))
+        (_, owners) = examples.examples()
+        assert [(owners==m).sum() for m in range(3)]==[3, 3, 3]
+
+
+def test_returned_examples_are_never_modified():
+    examples = KeywordExamples(4, 3, 2, random.Random(2))
+    for i in range(3):
+        examples.add(0, example(i))
+    (vectors, owners) = examples.examples()
+    (vectors_copy, owners_copy) = (vectors.copy(), owners.copy())
+    for i in range(3, 50):
+        examples.add(i % 2, example(i))
+        if i % 10==0:
+            examples.compact()
+    assert np.array_equal(vectors, vectors_copy) and np.array_equal(owners, owners_copy)
+
+
+def test_log_read_skips_the_partial_last_line(tmp_path):
+    path = str(tmp_path / 'feedback' / 'log.jsonl')
+    log = FeedbackLog(path)
+    assert log.read()==([], 0)
+    log.append({'word': 'a', 'meaning_index': 0})
+    log.append({'word': 'b', 'meaning_index': 1})
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"word": "c", "meaning_')
+    (records, offset) = log.read()
+    assert [r['word'] for r in records]==['a', 'b']
+    # The record being written is read once complete
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('index": 2}\n')
+    (records, offset) = log.read(offset)
+    assert records==[{'word': 'c', 'meaning_index': 2}]
+    assert log.read(offset)==([], offset)
+
+
+def test_replay_follows_the_log_order(tmp_path):
+    path = str(tmp_path / 'log.jsonl')
+    model = FakeModel(VOCAB)
+    store = FeedbackStore(path, model, compact_interval=None)
+    other = FeedbackLog(path)
+    meanings = [2, 0, 1, 0, 3]
+    for (i, m) in enumerate(meanings):
+        # Written by another process
+        other.append({'word': WORD, 'context': VOCAB[i] + ' ' + WORD + ' ' + VOCAB[i+10], 'meaning_index': m})
+    assert store.examples(WORD) is None
+    assert store.replay()==len(meanings)
+    store.record(WORD, VOCAB[20] + ' ' + WORD, 1)
+    assert store.replay()==0
+    (vectors, owners) = store.examples(WORD)
+    assert list(owners)==meanings + [1]
+    expected = [embed_tokens([VOCAB[i], VOCAB[i+10]], model) for i in range(len(meanings))]
+    for (v, e) in zip(vectors, expected):
+        assert np.array_equal(v[:2], e)
+    # A new store replays the whole log in the same order
+    assert list(FeedbackStore(path, model, compact_interval=None).examples(WORD)[1])==meanings + [1]
+    store.close()
+
+
+def test_feedback_scores_as_a_dictionary_example():
+    model = FakeModel(VOCAB)
+    words = lambda *i: " ".join(VOCAB[j] for j in i)
+    rows = [[WORD, 'Danh từ', words(1, 2), words(3, 4, 5)], [WORD, 'Danh từ', words(6), words(7, 8)],
+            [WORD, 'Động từ', words(9), ''], [WORD, 'Động từ', words(10), words(11, 12, 13, 14)]]
+    senses = build_senses(WORD, rows, {w: i for (i, w) in enumerate(VOCAB)}, len(VOCAB), model)
+    index = FeedbackIndex(model, max_examples=1, seed=1)
+    texts = [(0, words(30, 31) + ' ' + WORD + ' ' + words(32)), (2, words(33, 34, 35, 36, 37) + ' ' + WORD),
+             (0, words(40) + ' ' + WORD + ' ' + words(41, 42))]
+    for (m, text) in texts:
+        index.add(WORD, m, text)
+    (fb_vectors, fb_owners) = index.examples(WORD)
+    # The second example of meaning 0 replaced the first one, whose slot is removed
+    assert list(fb_owners)==[-1, 2, 0]
+
+    vectors = senses.ex_vectors
+    (starts, owners) = (list(senses.ex_starts), list(senses.ex_owners))
+    for (m, text) in texts:
+        ex_vectors = index.embed(WORD, text)
+        if any(np.array_equal(v[:len(ex_vectors)], ex_vectors) for v in fb_vectors[fb_owners>=0]):
+            starts.append(len(vectors))
+            owners.append(m)
+            vectors = np.concatenate([vectors, ex_vectors])
+    for ctx in ([31, 35, 50], [1, 2, 3], [12], []):
+        ctx_vectors = embed_tokens([VOCAB[i] for i in ctx], model)
+        actual = vector_scores(ctx_vectors, senses.ex_vectors, senses.ex_starts, senses.ex_owners, len(senses),
+                               feedback=(fb_vectors, fb_owners))
+        expected = vector_scores(ctx_vectors, vectors, np.array(starts), np.array(owners), len(senses))
+        assert [a is None for a in actual]==[e is None for e in expected]
+        assert np.allclose([a for a in actual if a is not None], [e for e in expected if e is not None], rtol=1e-5)
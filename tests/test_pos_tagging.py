@@ -0,0 +1,90 @@
+import pytest
+
+underthesea = pytest.importorskip('underthesea')
+from modules.benchmark import load_test_data
+from modules.pos_tagging import PosTagger
+from modules.score_calc import predict_pos_tag, vn_pos_tag
+
+# POS tags of underthesea
+TAGS = ['N', 'Np', 'Nc', 'Ny', 'Nu', 'Nb', 'M', 'L', 'A', 'Ab', 'V', 'Vy', 'Vb', 'P', 'R', 'T', 'I', 'E', 'C', 'CC', 'Z',
+        'X', 'CH', 'Y', 'S']
+
+
+def nested_vn_pos_tag(tag):
+    # Nested lookup of the original implementation
+    pos_dict = {
+               ('N', 'Np', 'Nc', 'Ny', 'Nu', 'M', 'L'): 'Danh từ',
+               'A': 'Tính từ',
+               ('V', 'Vy'): 'Động từ',
+               'P': 'Đại từ',
+               'R': 'Phụ từ',
+               'T': 'Trợ từ',
+               'I': 'Cảm từ',
+                ('E', 'C', 'CC'): 'Kết từ',
+                ('Z', 'X'): 'Không rõ'
+               }
+    for (en_tag, vn_tag) in pos_dict.items():
+        if (tag==en_tag) or (tag in en_tag):
+            return vn_tag
+
+
+def nested_predict_pos_tag(text, word):
+    # Original implementation, calling underthesea pos_tag directly
+    pos_res = underthesea.pos_tag(text.lower())
+    for (w, w_type) in pos_res:
+        if w==word:
+            return nested_vn_pos_tag(w_type)
+    for (w, w_type) in pos_res:
+        if word in w:
+            pos_res2 = underthesea.pos_tag(word)
+            for (w2, w_type2) in pos_res2:
+                if w2==word:
+                    return nested_vn_pos_tag(w_type2)
+            return nested_vn_pos_tag(w_type)
+    idx = text.index(word)
+    i=0
+    check_len = 0
+    while check_len<idx:
+        check_len += len(pos_res[i][0]) + 1
+        i+=1
+    return nested_vn_pos_tag(pos_res[i-1][1])
+
+
+def outcome(function, *args):
+    # Result of a call, or the type of the error it raised
+    try:
+        return function(*args)
+    except Exception as e:
+        return type(e)
+
+
+@pytest.fixture(scope='module')
+def pairs():
+    return [(word, text) for (word, text, _) in load_test_data()]
+
+
+def test_flat_table_matches_nested_lookup():
+    for tag in TAGS:
+        assert vn_pos_tag(tag)==nested_vn_pos_tag(tag), tag
+
+
+def test_tagger_returns_the_tags_of_pos_tag(pairs):
+    sentences = [text.lower() for (_, text) in pairs]
+    expected = [underthesea.pos_tag(s) for s in sentences]
+    tagger = PosTagger(maxsize=len(sentences)//2)
+    # Cold, then partly evicted cache
+    for _ in range(2):
+        assert [tagger.tag(s) for s in sentences]==expected
+    batched = PosTagger()
+    assert batched.tag_many(sentences + sentences[:10])==expected + expected[:10]
+    assert batched.tag_many(sentences)==expected
+    stats = batched.stats()
+    assert stats['misses']==len(set(sentences)) and stats['hits']==len(set(sentences))
+
+
+def test_predict_pos_tag_matches_nested_lookup(pairs):
+    tagger = PosTagger()
+    for (word, text) in pairs:
+        expected = outcome(nested_predict_pos_tag, text, word)
+        assert outcome(predict_pos_tag, text, word)==expected, (word, text)
+        assert outcome(tagger.predict, text, word)==expected, (word, text)
@@ -0,0 +1,238 @@
+import json
+import os
+import threading
+import numpy as np
+import pytest
+from modules.scoring_jobs import DelayedScraper, ScoringExecutor, simulate_sessions
+from modules.scrape_dict import dict_key, parse_dict_page
+from tests.helpers import FakeModel
+
+PAGES = os.path.join(os.path.dirname(__file__), 'fixtures', 'pages')
+
+STAGES = ['clean_tokenize', 'pos_tag', 'co_occur', 'vector']
+
+
+class FakeSession:
+    '''
+    Scoring session going through the stages of ScoringSession.update, each stage optionally blocked until released
+    '''
+    def __init__(self, word, gates=None, senses=('nghĩa',)):
+        self.word = word
+        self.gates = gates if gates is not None else {}
+        self.senses = list(senses)
+        self.reached = {stage: threading.Event() for stage in STAGES}
+        self.seen = set()
+        self.text = None
+
+    def copy(self):
+        session = FakeSession(self.word, self.gates, self.senses)
+        session.seen = set(self.seen)
+        return session
+
+    def update(self, text, tracer=None, progress=None):
+        for stage in STAGES:
+            self.reached[stage].set()
+            if stage in self.gates:
+                self.gates[stage].wait(5)
+            if stage=='co_occur':
+                self.seen.update(text.split(" "))
+            progress(stage, ('Danh từ', [0.5], [None] if stage!='vector' else [0.5]) if stage in ('co_occur', 'vector') else None)
+        self.text = text
+
+
+class FakeFactory:
+    '''
+    make_session of the executor, counting the sessions it builds (the keywords of empty have no meaning)
+    '''
+    def __init__(self, gates=None, empty=()):
+        self.gates = gates
+        self.empty = set(empty)
+        self.calls = []
+        self.sessions = []
+        self._made = threading.Condition()
+
+    def __call__(self, word, options, tracer):
+        session = FakeSession(word, self.gates, () if word in self.empty else ('nghĩa',))
+        with self._made:
+            self.calls.append((word, options))
+            self.sessions.append(session)
+            self._made.notify_all()
+        return session
+
+    def session(self, i):
+        # Wait until the worker thread built the i-th session
+        with self._made:
+            assert self._made.wait_for(lambda: len(self.sessions)>i, 5)
+            return self.sessions[i]
+
+
+@pytest.fixture
+def executor():
+    executors = []
+
+    def make(factory, **kwargs):
+        executors.append(ScoringExecutor(factory, **kwargs))
+        return executors[-1]
+    yield make
+    for e in executors:
+        e.shutdown()
+
+
+def test_identical_queries_share_one_job(executor):
+    gate = threading.Event()
+    factory = FakeFactory({'co_occur': gate})
+    ex = executor(factory)
+    jobs = [ex.submit(owner, 'rơi', 'lá rơi xuống đất') for owner in range(5)]
+    assert all(job is jobs[0] for job in jobs)
+    gate.set()
+    assert jobs[0].wait(5) and jobs[0].state=='done'
+    assert len(factory.calls)==1
+    stats = ex.stats()
+    assert (stats['submitted'], stats['deduplicated'], stats['done'], stats['cancelled'])==(1, 4, 1, 0)
+    # Resubmitting the same query as the same owner is not a duplicate
+    ex.submit(0, 'rơi', 'lá rơi xuống đất').wait(5)
+    assert ex.stats()['deduplicated']==4
+
+
+def test_superseded_job_is_cancelled_between_stages(executor):
+    gate = threading.Event()
+    factory = FakeFactory({'pos_tag': gate})
+    ex = executor(factory)
+    first = ex.submit('a', 'rơi', 'lá rơi')
+    assert factory.session(0).reached['pos_tag'].wait(5)
+    second = ex.submit('a', 'bàn', 'bàn gỗ')
+    gate.set()
+    assert first.wait(5) and second.wait(5)
+    assert first.state=='cancelled' and first.stage=='clean_tokenize' and first.scores is None
+    assert second.state=='done' and second.stage=='vector'
+    assert not factory.session(0).reached['co_occur'].is_set()
+    stats = ex.stats()
+    assert (stats['submitted'], stats['cancelled'], stats['done'])==(2, 1, 1)
+
+
+def test_cancel_by_the_last_owner_cancels_the_job(executor):
+    gate = threading.Event()
+    factory = FakeFactory({'pos_tag': gate})
+    ex = executor(factory)
+    job = ex.submit('a', 'rơi', 'lá rơi')
+    ex.submit('b', 'rơi', 'lá rơi')
+    assert factory.session(0).reached['pos_tag'].wait(5)
+    ex.cancel('a')
+    assert not job._cancelled.is_set()
+    ex.cancel('b')
+    gate.set()
+    assert job.wait(5) and job.state=='cancelled'
+    # A new identical query starts a new job
+    again = ex.submit('c', 'rơi', 'lá rơi')
+    assert again is not job and again.wait(5) and again.state=='done'
+    assert ex.stats()['cancelled']==1
+
+
+def test_queued_job_is_cancelled_before_it_starts(executor):
+    gate = threading.Event()
+    factory = FakeFactory({'clean_tokenize': gate})
+    ex = executor(factory, max_workers=1)
+    running = ex.submit('a', 'rơi', 'lá rơi')
+    assert factory.session(0).reached['clean_tokenize'].wait(5)
+    queued = ex.submit('b', 'bàn', 'bàn gỗ')
+    assert ex.stats()['queued']==1
+    ex.cancel('b')
+    assert queued.done() and queued.state=='cancelled'
+    gate.set()
+    assert running.wait(5) and running.state=='done'
+    assert factory.calls==[('rơi', None)]
+
+
+def test_failed_job_reports_its_error(executor):
+    def failing(word, options, tracer):
+        raise KeyError(word)
+    ex = executor(failing)
+    job = ex.submit('a', 'rơi', 'lá rơi')
+    assert job.wait(5) and job.state=='failed' and isinstance(job.error, KeyError)
+    assert ex.stats()['failed']==1
+
+
+def test_jobs_start_from_a_copy_of_the_kept_session(executor):
+    factory = FakeFactory()
+    ex = executor(factory, max_sessions=1)
+    first = ex.submit('a', 'rơi', 'lá rơi')
+    first.wait(5)
+    second = ex.submit('a', 'rơi', 'mưa rơi')
+    second.wait(5)
+    assert len(factory.calls)==1 and second.session is not first.session
+    # The finished job is unchanged, the new one kept the words of the previous one
+    assert first.session.text=='lá rơi' and first.session.seen=={'lá', 'rơi'}
+    assert second.session.seen=={'lá', 'rơi', 'mưa'}
+    # Other options build another session; the oldest kept session is evicted
+    ex.submit('a', 'rơi', 'lá rơi', options=True).wait(5)
+    ex.submit('a', 'rơi', 'lá rơi').wait(5)
+    assert factory.calls==[('rơi', None), ('rơi', True), ('rơi', None)]
+    ex.forget('rơi')
+    ex.submit('a', 'rơi', 'mưa rơi').wait(5)
+    assert len(factory.calls)==4
+    stats = ex.stats()
+    assert (stats['reused_sessions'], stats['kept_sessions'])==(1, 1)
+
+
+def test_sessions_without_meanings_are_not_kept(executor):
+    factory = FakeFactory(empty={'khôngcó'})
+    ex = executor(factory)
+    for text in ('tôi khôngcó', 'anh khôngcó', 'tôi khôngcó'):
+        job = ex.submit('a', 'khôngcó', text)
+        assert job.wait(5) and job.state=='done'
+    # Every job looks the keyword up again, so that a new dictionary entry is found once the sense index expires it
+    assert factory.calls==[('khôngcó', None)]*3
+    stats = ex.stats()
+    assert (stats['reused_sessions'], stats['kept_sessions'])==(0, 0)
+    ex.submit('a', 'rơi', 'lá rơi').wait(5)
+    ex.submit('a', 'rơi', 'mưa rơi').wait(5)
+    assert ex.stats()['reused_sessions']==1
+
+
+def page_rows(word, file_name):
+    rows = []
+    with open(os.path.join(PAGES, file_name), 'rb') as f:
+        parse_dict_page(word, f.read(), rows)
+    return rows
+
+
+def test_simulated_sessions_get_the_results_of_rank_meanings(tmp_path):
+    pytest.importorskip('underthesea')
+    from modules.benchmark import FixtureScraper
+    from modules.score_calc import clean_test_dat, rank_meanings
+    from modules.scoring_session import ScoringSession
+    entries = {dict_key('rơi'): page_rows('rơi', 'rơi.html'), dict_key('thay đổi'): page_rows('thay đổi', 'thay_đổi.html'),
+               dict_key('khôngcó'): []}
+    path = str(tmp_path / 'fixtures.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False)
+    fixtures = FixtureScraper(path)
+    scrape = DelayedScraper(fixtures, 0.01)
+
+    # Context sentences: the examples of the dictionary entries
+    pairs = [(word, ex) for word in ('rơi', 'thay đổi') for row in entries[dict_key(word)] for ex in row[3].split('\n')
+             if word in ex][:12] + [('khôngcó', 'tôi khôngcó gì')]
+    assert len(pairs)>6
+    vocab = sorted(set(clean_test_dat(' '.join([' '.join(r[2:]) for rows in entries.values() for r in rows] +
+                                              [text for (_, text) in pairs])).split()))
+    model = FakeModel(vocab)
+    w_dict = {w: i for (i, w) in enumerate(vocab)}
+    co_matrix = np.random.default_rng(0).integers(0, 5, size=(len(vocab), len(vocab)))
+    tag = lambda text: [(w, 'N') for w in text.split()]
+
+    def make_session(word, options, tracer):
+        return ScoringSession(word, co_matrix, w_dict, model, scrape, tagger=tag, tracer=tracer)
+
+    def reference(word, text):
+        return [m.index for m in rank_meanings(word, text, co_matrix, w_dict, model, [1, 2], fixtures, tagger=tag)]
+
+    ex = ScoringExecutor(make_session, max_workers=4, max_sessions=2)
+    try:
+        report = simulate_sessions(ex, pairs, reference, n_sessions=30, queries=4, supersede=0.3)
+    finally:
+        ex.shutdown()
+    assert report['queries']==120
+    assert (report['wrong_results'], report['not_done'])==(0, 0)
+    stats = report['executor']
+    assert stats['reused_sessions']>0 and stats['done']>0
+    assert stats['kept_sessions']<=2 and stats['sessions']==0
@@ -0,0 +1,129 @@
+import random
+import numpy as np
+import pytest
+
+pytest.importorskip('underthesea')
+from modules.score_calc import rank_meanings, score_calc_phraser
+from modules.scoring_session import ScoringSession
+from tests.helpers import FakeModel
+
+# Letters only: digits are removed by the cleaning of the meanings, examples and context sentences
+VOCAB = ['w' + a + b for a in 'abcdefgh' for b in 'abcdefgh'][:50]
+WORD = 'từ'
+WEIGHTS = [0.5, 0.5]
+
+
+def tag(text):
+    # Every word is a noun, so the word type check depends only on the dictionary rows
+    return [(w, 'N') for w in text.split(' ')]
+
+
+class FakeFeedback:
+    '''
+    Feedback examples of the keyword, with a removed example (-1) and one of a meaning missing from the entry
+    '''
+    def __init__(self, model, n, seed=0):
+        rng = np.random.default_rng(seed)
+        words = rng.integers(0, len(model.wv.index_to_key), size=(5, 3))
+        self.vectors = model.wv.vectors[words]
+        self.owners = np.array([0, -1, n - 1, n + 2, 0])
+
+    def examples(self, word):
+        return (self.vectors, self.owners)
+
+
+def make_world(seed=0):
+    rng = random.Random(seed)
+    model = FakeModel(VOCAB[:40])
+    # The last words are in the corpus dictionary but outside the matrix
+    w_dict = {w: i for (i, w) in enumerate(VOCAB)}
+    co_matrix = np.random.default_rng(seed).integers(0, 5, size=(45, 45))
+    words = VOCAB + ['x' + a for a in 'abcde']
+    sentence = lambda k: " ".join(rng.choice(words) for _ in range(k))
+    rows = [[WORD, rng.choice(['Danh từ', 'Động từ']), sentence(rng.randint(1, 6)),
+             " \n ".join(sentence(rng.randint(1, 6)) + ' ' + WORD for _ in range(rng.randint(0, 3)))] for _ in range(6)]
+    scrape = lambda word, r: r.extend([list(row) for row in rows])
+    texts = [sentence(rng.randint(2, 8)) + ' ' + WORD + ' ' + sentence(rng.randint(0, 8)) for _ in range(8)]
+    return (co_matrix, w_dict, model, scrape, texts)
+
+
+def assert_same_meanings(actual, expected):
+    assert [m.index for m in actual]==[m.index for m in expected]
+    for (a, e) in zip(actual, expected):
+        for field in ('co_occur_score', 'w_vector_score', 'score'):
+            (x, y) = (getattr(a, field), getattr(e, field))
+            assert (x is None)==(y is None)
+            if y is not None:
+                assert float(x)==pytest.approx(float(y), rel=1e-5, abs=1e-6)
+
+
+def test_session_matches_rank_meanings_across_texts():
+    (co_matrix, w_dict, model, scrape, texts) = make_world()
+    session = ScoringSession(WORD, co_matrix, w_dict, model, scrape, tagger=tag)
+    for text in texts + texts[:2]:
+        session.update(text)
+        expected = rank_meanings(WORD, text, co_matrix, w_dict, model, WEIGHTS, scrape, tagger=tag)
+        assert_same_meanings(session.meanings(WEIGHTS), expected)
+    # The texts share their words: only the words never seen before are scored
+    assert session.counters['texts']==len(texts) + 2
+    assert session.counters['cached_tokens']>0
+    assert session.counters['new_tokens']==len(session._co_rows)==len(session._vec_rows)
+
+
+def test_score_matches_score_calc_phraser():
+    (co_matrix, w_dict, model, scrape, texts) = make_world(1)
+    session = ScoringSession(WORD, co_matrix, w_dict, model, scrape, tagger=tag)
+    for text in texts:
+        actual = session.score(text, WEIGHTS)
+        expected = score_calc_phraser(WORD, text, co_matrix, w_dict, model, WEIGHTS, scrape, tagger=tag)
+        assert list(actual['index'])==list(expected['index'])
+        assert np.allclose(actual['score'].astype(float), expected['score'].astype(float), rtol=1e-5)
+
+
+def test_rank_under_new_weights_recomputes_nothing():
+    (co_matrix, w_dict, model, scrape, texts) = make_world(2)
+    session = ScoringSession(WORD, co_matrix, w_dict, model, scrape, tagger=tag)
+    session.update(texts[0])
+    counters = dict(session.counters)
+    for weights in ([1, 0], [0, 1], [0.2, 0.8]):
+        expected = rank_meanings(WORD, texts[0], co_matrix, w_dict, model, weights, scrape, tagger=tag)
+        assert list(session.rank(weights)['index'])==[m.index for m in expected]
+    # Same text: score only re-ranks
+    session.score(texts[0], [0.7, 0.3])
+    assert session.counters['reweights']==counters['reweights'] + 4
+    assert {k: v for (k, v) in session.counters.items() if k!='reweights'}=={k: v for (k, v) in counters.items()
+                                                                                 if k!='reweights'}
+
+
+def test_copy_leaves_the_session_unchanged():
+    (co_matrix, w_dict, model, scrape, texts) = make_world(3)
+    session = ScoringSession(WORD, co_matrix, w_dict, model, scrape, tagger=tag)
+    session.update(texts[0])
+    before = [(m.index, m.score) for m in session.meanings(WEIGHTS)]
+    (co_rows, vec_rows, counters) = (dict(session._co_rows), dict(session._vec_rows), dict(session.counters))
+
+    other = session.copy()
+    for text in texts[1:]:
+        other.update(text)
+        expected = rank_meanings(WORD, text, co_matrix, w_dict, model, WEIGHTS, scrape, tagger=tag)
+        assert_same_meanings(other.meanings(WEIGHTS), expected)
+    assert session.text==texts[0]
+    assert session._co_rows.keys()==co_rows.keys() and session._vec_rows.keys()==vec_rows.keys()
+    assert session.counters==counters
+    assert [(m.index, m.score) for m in session.meanings(WEIGHTS)]==before
+    # The copy starts from the words already seen
+    assert other.counters['cached_tokens']>counters['cached_tokens']
+
+
+def test_feedback_skips_removed_examples():
+    (co_matrix, w_dict, model, scrape, texts) = make_world(4)
+    rows = []
+    scrape(WORD, rows)
+    feedback = FakeFeedback(model, len(rows))
+    session = ScoringSession(WORD, co_matrix, w_dict, model, scrape, tagger=tag, feedback=feedback)
+    # The removed example and the example of a missing meaning are masked out
+    assert session._live.sum()==len(session._ex_owners)==len(session.senses.ex_owners) + 3
+    for text in texts:
+        session.update(text)
+        expected = rank_meanings(WORD, text, co_matrix, w_dict, model, WEIGHTS, scrape, tagger=tag, feedback=feedback)
+        assert_same_meanings(session.meanings(WEIGHTS), expected)
@@ -0,0 +1,127 @@
+import threading
+import time
+from modules.scrape_cache import ScrapeCache
+
+
+class CountingScraper:
+    '''
+    Fake scrape function counting its calls, optionally blocked until released
+    '''
+    def __init__(self, gate=None):
+        self.calls = []
+        self.gate = gate
+        self._lock = threading.Lock()
+
+    def __call__(self, word, results):
+        with self._lock:
+            self.calls.append(word)
+        if self.gate is not None:
+            self.gate.wait(5)
+        results.append([word, 'Danh từ', f'nghĩa của {word}', f'ví dụ {word}'])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def lookup(cache, word):
+    rows = []
+    cache(word, rows)
+    return rows
+
+
+def test_lru_hit_and_eviction():
+    scraper = CountingScraper()
+    cache = ScrapeCache(scraper, maxsize=2, ttl=None)
+    assert lookup(cache, 'a')==[['a', 'Danh từ', 'nghĩa của a', 'ví dụ a']]
+    lookup(cache, 'b')
+    lookup(cache, 'a')
+    assert scraper.calls==['a', 'b']
+    # "b" is the least recently used keyword
+    lookup(cache, 'c')
+    lookup(cache, 'a')
+    assert scraper.calls==['a', 'b', 'c']
+    lookup(cache, 'b')
+    assert scraper.calls==['a', 'b', 'c', 'b']
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size'])==(2, 4, 2, 2)
+
+
+def test_ttl_expiry():
+    scraper = CountingScraper()
+    clock = FakeClock()
+    cache = ScrapeCache(scraper, maxsize=10, ttl=60, clock=clock)
+    lookup(cache, 'a')
+    clock.now += 59
+    lookup(cache, 'a')
+    assert scraper.calls==['a']
+    clock.now += 2
+    lookup(cache, 'a')
+    assert scraper.calls==['a', 'a']
+    assert cache.stats()['expirations']==1
+
+
+def test_concurrent_misses_are_coalesced():
+    gate = threading.Event()
+    scraper = CountingScraper(gate)
+    cache = ScrapeCache(scraper, maxsize=10)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(lookup(cache, 'a'))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    # Wait until the followers are waiting for the leader
+    deadline = time.monotonic() + 5
+    while cache.stats()['coalesced']<7 and time.monotonic()<deadline:
+        time.sleep(0.01)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert scraper.calls==['a']
+    assert len(results)==8 and all(r==results[0] for r in results)
+    stats = cache.stats()
+    assert (stats['misses'], stats['coalesced'])==(1, 7)
+
+
+def test_errors_reach_every_waiting_caller():
+    def failing(word, results):
+        raise ValueError('page not available')
+    cache = ScrapeCache(failing)
+    for _ in range(2):
+        try:
+            lookup(cache, 'a')
+            assert False
+        except ValueError:
+            pass
+    assert cache.stats()['size']==0
+
+
+def test_reload_from_disk(tmp_path):
+    scraper = CountingScraper()
+    cache = ScrapeCache(scraper, disk_dir=str(tmp_path))
+    rows = lookup(cache, 'thay đổi')
+    # A new process (new cache) reads the entry from the disk tier
+    reloaded = ScrapeCache(scraper, disk_dir=str(tmp_path))
+    assert lookup(reloaded, 'thay đổi')==rows
+    assert scraper.calls==['thay đổi']
+    assert reloaded.stats()['disk_hits']==1 and reloaded.stats()['misses']==0
+    # Expired entries on disk are scraped again
+    clock = FakeClock()
+    clock.now = time.time() + 3600
+    expired = ScrapeCache(scraper, ttl=60, disk_dir=str(tmp_path), clock=clock)
+    lookup(expired, 'thay đổi')
+    assert scraper.calls==['thay đổi', 'thay đổi']
+
+
+def test_counters():
+    scraper = CountingScraper()
+    cache = ScrapeCache(scraper, maxsize=1)
+    for word in ['a', 'a', 'b', 'a', 'a']:
+        lookup(cache, word)
+    assert cache.stats()=={'hits': 2, 'disk_hits': 0, 'misses': 3, 'coalesced': 0, 'evictions': 2, 'expirations': 0,
+                           'size': 1}
+    cache.clear()
+    assert cache.stats()['size']==0
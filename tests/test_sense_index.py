@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('underthesea')
+from modules.sense_index import SenseIndex
+from tests.helpers import FakeModel
+
+WORDS = ['rơi', 'xuống', 'đất', 'lá', 'cây', 'mưa']
+
+
+class FlakyScraper:
+    '''
+    Fake scrape function failing to find any meaning until the dictionary is back
+    '''
+    def __init__(self):
+        self.available = False
+        self.calls = 0
+
+    def __call__(self, word, results):
+        self.calls += 1
+        if self.available:
+            results.append([word, 'Động từ', 'rơi xuống đất', 'lá cây rơi xuống đất'])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_index(scrape, tmp_path, clock):
+    w_dict = {w: i for (i, w) in enumerate(WORDS)}
+    co_matrix = np.ones((len(WORDS), len(WORDS)))
+    return SenseIndex(scrape, w_dict, co_matrix, FakeModel(WORDS), cache_dir=str(tmp_path), empty_ttl=60, clock=clock)
+
+
+def test_empty_senses_are_not_persisted_and_expire(tmp_path):
+    (scrape, clock) = (FlakyScraper(), FakeClock())
+    index = make_index(scrape, tmp_path, clock)
+    assert len(index.get('rơi'))==0
+    assert list(tmp_path.iterdir())==[]
+    # Kept in memory for empty_ttl seconds
+    clock.now = 59
+    assert len(index.get('rơi'))==0 and scrape.calls==1
+    scrape.available = True
+    clock.now = 61
+    assert len(index.get('rơi'))==1 and scrape.calls==2
+    assert len(list(tmp_path.iterdir()))==1
+    # Entries with meanings never expire, and a new index reads them from disk
+    clock.now = 10**6
+    assert len(index.get('rơi'))==1 and scrape.calls==2
+    assert len(make_index(scrape, tmp_path, clock).get('rơi'))==1 and scrape.calls==2
+
+
+def test_empty_senses_are_looked_up_again_by_a_new_index(tmp_path):
+    (scrape, clock) = (FlakyScraper(), FakeClock())
+    make_index(scrape, tmp_path, clock).get('rơi')
+    scrape.available = True
+    assert len(make_index(scrape, tmp_path, clock).get('rơi'))==1 and scrape.calls==2
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+pytest.importorskip('underthesea')
+from modules.co_matrix import as_co_store
+from modules.score_calc import co_occur_rows, co_occur_score_reduce, co_occur_sums, co_occur_sums_many, index_tokens
+from modules.sense_profiles import CoProfile, SenseProfiles, fingerprint, load_profiles, profile_matrix, save_profiles
+
+# Words of the vocabulary beyond the matrix (indices at or above its size) are dropped by index_tokens
+SIZE = 40
+VOCAB = 50
+
+
+def random_case(rng):
+    # Meanings: empty, never co-occurring with the context (score sentinel 10), at the edges of the matrix, random
+    meanings = [np.zeros(0, dtype=np.int64), np.array([0, SIZE - 1]), np.array([SIZE - 2])]
+    meanings += [rng.integers(0, SIZE, rng.integers(1, 6)) for _ in range(rng.integers(1, 5))]
+    tokens = [f'w{i}' for i in rng.integers(0, VOCAB, rng.integers(0, 12))] + ['unknown']
+    return (meanings, tokens)
+
+
+def dense_matrix(rng):
+    matrix = rng.integers(0, 4, (SIZE, SIZE))*(rng.random((SIZE, SIZE))<0.2)
+    # Rows and columns of the words SIZE-2 and SIZE-1 are empty: their meanings never co-occur
+    matrix[SIZE-2:, :] = 0
+    matrix[:, SIZE-2:] = 0
+    return matrix
+
+
+def test_profile_sums_match_the_matrix():
+    rng = np.random.default_rng(0)
+    w_dict = {f'w{i}': i for i in range(VOCAB)}
+    sentinels = 0
+    for k in range(200):
+        matrix = dense_matrix(rng)
+        store = as_co_store(matrix if k%2==0 else sp.csr_matrix(matrix))
+        (meanings, tokens) = random_case(rng)
+        ctx_idx = index_tokens(tokens, w_dict, SIZE)
+        profile = CoProfile(profile_matrix(meanings, store))
+        expected = co_occur_sums(ctx_idx, meanings, store)
+        assert co_occur_sums(ctx_idx, meanings, store, profile)==expected
+        assert co_occur_score_reduce(*co_occur_sums(ctx_idx, meanings, store, profile))==co_occur_score_reduce(*expected)
+        assert (co_occur_rows(ctx_idx, meanings, store, profile)==co_occur_rows(ctx_idx, meanings, store)).all()
+        contexts = [ctx_idx, ctx_idx[:2], np.zeros(0, dtype=np.int64)]
+        assert co_occur_sums_many(contexts, meanings, store, profile)==co_occur_sums_many(contexts, meanings, store)
+        sentinels += sum(1 for score in co_occur_score_reduce(*expected) if score==10)
+    # The cases include meanings scored with the sentinel
+    assert sentinels>0
+
+
+def test_words_beyond_the_vocabulary_read_no_sums():
+    rng = np.random.default_rng(1)
+    store = as_co_store(dense_matrix(rng))
+    meanings = [rng.integers(0, SIZE, 4) for _ in range(3)]
+    profile = CoProfile(profile_matrix(meanings, store))
+    known = rng.integers(0, SIZE, 6)
+    rows = profile.rows(np.concatenate([known, [SIZE, SIZE + 1, 2*SIZE - 1, VOCAB]]))
+    assert (rows[:len(known)]==co_occur_rows(known, meanings, store)).all()
+    assert (rows[len(known):]==0).all()
+
+
+def test_saved_profiles_match_the_matrix(tmp_path):
+    rng = np.random.default_rng(2)
+    store = as_co_store(dense_matrix(rng))
+    keywords = [[rng.integers(0, SIZE, rng.integers(0, 5)) for _ in range(rng.integers(1, 4))] for _ in range(5)]
+    blocks = [profile_matrix(meanings, store) for meanings in keywords]
+    starts = np.cumsum([0] + [len(meanings) for meanings in keywords])
+    matrix = sp.vstack(blocks, format='csr')
+    matrix.sort_indices()
+    path = str(tmp_path / 'profiles.npz')
+    save_profiles(SenseProfiles(matrix, [f'k{i}' for i in range(5)], starts, [fingerprint(m) for m in keywords]), path)
+    profiles = load_profiles(path)
+    ctx_idx = np.arange(SIZE)
+    for (i, meanings) in enumerate(keywords):
+        profile = profiles.get(f'k{i}', meanings)
+        assert co_occur_sums(ctx_idx, meanings, store, profile)==co_occur_sums(ctx_idx, meanings, store)
+    # A profile built from other meanings is not used
+    assert profiles.get('k0', keywords[0] + [np.array([1])]) is None
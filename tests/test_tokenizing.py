@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('underthesea')
+from underthesea import word_tokenize
+from modules.score_calc import clean_context, index_tokens
+from modules.tokenizing import ContextTokenizer
+
+WORDS = ['tôi', 'thích', 'văn', 'học', 'và', 'ăn', 'cơm', 'với', 'gia', 'đình', 'thay', 'đổi', 'ý', 'kiến', 'mỗi', 'ngày']
+W_DICT = {w: i for (i, w) in enumerate(WORDS)}
+# The last words are in the corpus dictionary but outside the matrix
+SIZE = 12
+
+CASES = [
+    ('ăn', 'Tôi thích ăn cơm với gia đình.'),
+    # Missing keyword: the window is the first 8 words
+    ('rơi', 'Tôi thích văn học và ăn cơm với gia đình mỗi ngày, thay đổi ý kiến.'),
+    # Multi-syllable keyword
+    ('thay đổi', 'Mỗi ngày tôi thay đổi ý kiến về văn học.'),
+    # Keyword inside an earlier word ("ăn" in "văn")
+    ('ăn', 'Tôi thích văn học và ăn cơm với gia đình mỗi ngày.'),
+    ('ăn', ''),
+]
+
+
+def baseline(word, text):
+    tokens = clean_context(word, text)
+    return (tokens, index_tokens(tokens, W_DICT, SIZE))
+
+
+@pytest.mark.parametrize(('word', 'text'), CASES)
+def test_context_matches_clean_context(word, text):
+    tokenizer = ContextTokenizer(W_DICT, SIZE)
+    (expected_tokens, expected_idx) = baseline(word, text)
+    for _ in range(2):
+        (tokens, idx) = tokenizer.context(word, text)
+        assert tokens==expected_tokens
+        assert np.array_equal(idx, expected_idx)
+        assert tokenizer.tokens(word, text)==expected_tokens
+    assert ContextTokenizer().context(word, text)==(expected_tokens, None)
+
+
+def test_cached_indices_are_read_only():
+    tokenizer = ContextTokenizer(W_DICT, SIZE)
+    (_, idx) = tokenizer.context(*CASES[0])
+    with pytest.raises(ValueError):
+        idx[0] = 0
+
+
+def test_lru_eviction():
+    calls = []
+    tokenize = lambda window: calls.append(window) or word_tokenize(window)
+    tokenizer = ContextTokenizer(W_DICT, SIZE, maxsize=2, tokenize=tokenize)
+    (a, b, c) = CASES[:3]
+    for (word, text) in (a, b, a, c):
+        assert tokenizer.tokens(word, text)==clean_context(word, text)
+    # a was used after b, so b is evicted by c
+    assert tokenizer.stats()['size']==2
+    assert (tokenizer.stats()['hits'], tokenizer.stats()['misses'])==(1, 3)
+    for (word, text) in (a, c):
+        (tokens, idx) = tokenizer.context(word, text)
+        assert np.array_equal(idx, baseline(word, text)[1])
+    assert len(calls)==3
+    assert tokenizer.context(*b)[0]==baseline(*b)[0]
+    stats = tokenizer.stats()
+    assert (stats['calls'], stats['hits'], stats['misses'], len(calls))==(7, 3, 4, 4)
+    assert stats['hit_rate']==pytest.approx(3/7)
+    # b evicted a; another sentence with the same window as c is a hit ("." is removed by the cleaning)
+    assert tokenizer.tokens(c[0], c[1].rstrip('.'))==clean_context(*c)
+    assert tokenizer.stats()['hits']==4
@@ -0,0 +1,123 @@
+import random
+import numpy as np
+import pytest
+
+pytest.importorskip('underthesea')
+from modules.score_calc import TopKRanking, build_senses, embed_tokens, rank_senses, vector_scores
+from tests.helpers import FakeModel
+
+# Letters only: digits are removed by the cleaning of the meanings, examples and context sentences
+VOCAB = ['w' + a + b for a in 'abcdefgh' for b in 'abcdefgh'][:60]
+TYPES = ['Danh từ', 'Động từ']
+
+
+def random_case(rng, model, duplicates=False):
+    words = VOCAB + ['x' + a for a in 'abcdefghij']
+    sentence = lambda k: " ".join(rng.choice(words) for _ in range(k))
+    rows = [['từ', rng.choice(TYPES), sentence(3), " \n ".join(sentence(rng.randint(1, 8)) for _ in range(rng.randint(0, 3)))]
+            for _ in range(rng.randint(1, 8))]
+    if duplicates:
+        # Ties: the same meaning several times, ranked in the order of the dictionary entry
+        rows = rows + [list(r) for r in rows]
+    senses = build_senses('từ', rows, {w: i for (i, w) in enumerate(VOCAB)}, len(VOCAB), model)
+    co_occur_scores = [None if rng.random()<0.2 else rng.random() for _ in rows]
+    if duplicates:
+        co_occur_scores = co_occur_scores[:len(rows)//2]*2
+    ctx_vectors = embed_tokens([rng.choice(words) for _ in range(rng.randint(0, 10))], model)
+    return (senses, co_occur_scores, ctx_vectors)
+
+
+def full_ranking(senses, pred_word_type, co_occur_scores, ctx_vectors, weights):
+    scores = vector_scores(ctx_vectors, senses.ex_vectors, senses.ex_starts, senses.ex_owners, len(senses))
+    return [m.index for m in rank_senses(senses, pred_word_type, co_occur_scores, scores, weights)]
+
+
+def check_case(senses, pred_word_type, co_occur_scores, ctx_vectors, weights):
+    n = len(senses)
+    expected = full_ranking(senses, pred_word_type, co_occur_scores, ctx_vectors, weights)
+    for k in range(1, n + 3):
+        ranking = TopKRanking(senses, pred_word_type, co_occur_scores, ctx_vectors, weights)
+        top = [m.index for m in ranking.top(k)]
+        assert top==expected[:k]
+        check_report(ranking, senses, pred_word_type, ctx_vectors)
+
+        rest = ranking.rest(k, fill='co_only')
+        # Without the word vector scores of the meanings not scored, only the meanings after the first k are known
+        assert sorted(m.index for m in rest)==sorted(expected[k:])
+        assert [m.word_type_check for m in rest]==sorted(m.word_type_check for m in rest)
+        if ranking.report()['full']!=0:
+            assert [m.index for m in rest]==expected[k:]
+
+        assert [m.index for m in ranking.rest(k, fill='lazy')]==expected[k:]
+        if len(ctx_vectors)!=0:
+            assert ranking.report()['examples_skipped']==0
+
+
+def check_report(ranking, senses, pred_word_type, ctx_vectors):
+    report = ranking.report()
+    (t, n_examples) = (len(ctx_vectors), len(senses.ex_starts))
+    assert report['distances']==t*len(senses.ex_vectors)
+    if t==0 or n_examples==0:
+        assert report['distances_computed']==report['examples_scored']==0
+        return
+    if report['full']!=0:
+        assert report['examples_skipped']==0
+        return
+    # Pruned: only the examples of the meanings of the predicted POS tag are scored, the others are bounded by the
+    # distance to their first word
+    assert report['pruned']==1
+    mismatched = np.array([row[1]!=pred_word_type for row in senses.rows])[senses.ex_owners]
+    lengths = np.diff(np.append(senses.ex_starts, len(senses.ex_vectors)))
+    assert report['examples_skipped']==mismatched.sum()
+    bounded = mismatched.sum() if (~mismatched).any() else 0
+    assert report['distances_skipped']==t*(lengths[mismatched].sum() - bounded)
+    assert report['skipped_fraction']==report['distances_skipped']/report['distances']
+
+
+@pytest.mark.parametrize('weights', [[0.5, 0.5], [1, 0], [0, 1], [0.2, 0.8]])
+def test_top_k_matches_full_ranking(weights):
+    model = FakeModel(VOCAB)
+    rng = random.Random(0)
+    for _ in range(100):
+        (senses, co_occur_scores, ctx_vectors) = random_case(rng, model)
+        check_case(senses, 'Danh từ', co_occur_scores, ctx_vectors, weights)
+
+
+def test_ties_keep_the_dictionary_order():
+    model = FakeModel(VOCAB)
+    rng = random.Random(1)
+    for _ in range(50):
+        (senses, co_occur_scores, ctx_vectors) = random_case(rng, model, duplicates=True)
+        check_case(senses, 'Danh từ', co_occur_scores, ctx_vectors, [0.5, 0.5])
+
+
+def test_all_meanings_mismatched():
+    model = FakeModel(VOCAB)
+    rng = random.Random(2)
+    for _ in range(50):
+        (senses, co_occur_scores, ctx_vectors) = random_case(rng, model)
+        check_case(senses, 'Tính từ', co_occur_scores, ctx_vectors, [0.5, 0.5])
+        ranking = TopKRanking(senses, 'Tính từ', co_occur_scores, ctx_vectors, [0.5, 0.5])
+        ranking.top(1)
+        assert ranking.report()['pruned']==0
+
+
+def test_pruning_skips_the_mismatched_examples():
+    model = FakeModel(VOCAB)
+    words = lambda *i: " ".join(VOCAB[j] for j in i)
+    rows = [['từ', 'Danh từ', words(1, 2, 3), words(1, 2, 3, 4)], ['từ', 'Danh từ', words(5, 6), words(40, 41, 42, 43, 44)],
+            ['từ', 'Động từ', words(7, 8), words(10, 11, 12, 13, 14)], ['từ', 'Động từ', words(9), words(15, 16, 17)],
+            ['từ', 'Động từ', words(18), words(20, 21, 22, 23)]]
+    senses = build_senses('từ', rows, {w: i for (i, w) in enumerate(VOCAB)}, len(VOCAB), model)
+    ctx_vectors = embed_tokens(words(1, 2, 3).split(' '), model)
+    ranking = TopKRanking(senses, 'Danh từ', [0.1, 0.9, 0.5, 0.5, 0.5], ctx_vectors, [0.5, 0.5])
+    assert [m.index for m in ranking.top(1)]==[0]
+    report = ranking.report()
+    assert (report['pruned'], report['full'])==(1, 0)
+    assert (report['examples'], report['examples_scored'], report['examples_skipped'])==(5, 2, 3)
+    # 9 example words scored, 3 first words bounded, out of 21 example words
+    assert (report['distances'], report['distances_computed'], report['distances_skipped'])==(63, 36, 27)
+    assert len(ranking.rest(1, fill='co_only'))==4
+    assert ranking.report()['examples_skipped']==3
+    ranking.rest(1, fill='lazy')
+    assert ranking.report()['examples_skipped']==0
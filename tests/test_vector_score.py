@@ -0,0 +1,95 @@
+import random
+import numpy as np
+import pytest
+
+pytest.importorskip('underthesea')
+from modules.score_calc import closest_distances, embed_examples, embed_tokens, vector_score_calc
+from tests.helpers import FakeModel
+
+# Vectorized scores are computed in float32 in another summation order than the loop: they match it to this tolerance
+RTOL = 1e-5
+ATOL = 1e-6
+
+VOCAB = ['w%d' % i for i in range(60)]
+
+
+def loop_vector_score_calc(text, examples, word2vec_model):
+    # Per-example loop of the original implementation
+    n = len(examples)
+    scores = np.array([None]*n)
+    for i in range(n):
+        ex_score = []
+        for ex in examples[i].split("\n"):
+            ex = ex.split(" ")
+            (ex_sum, ex_cnt) = (0, 0)
+            for w in text:
+                w_sum = []
+                for w2 in ex:
+                    try:
+                        w_sum.append(np.linalg.norm(word2vec_model.wv[w] - word2vec_model.wv[w2]))
+                    except KeyError:
+                        continue
+                if w_sum!=[]:
+                    ex_sum += min(w_sum)
+                    ex_cnt += 1
+            if ex_cnt!=0:
+                ex_score.append(ex_sum/ex_cnt)
+        if ex_score!=[]:
+            scores[i] = min(ex_score)
+    try:
+        norm = np.linalg.norm(np.array(scores)[scores!=None])
+        for i in range(n):
+            if scores[i]:
+                scores[i] = scores[i]/norm
+        return scores
+    except Exception:
+        return scores
+
+
+def random_case(rng):
+    # Words outside the vocabulary (never scored) are mixed with known words
+    words = VOCAB + ['oov%d' % i for i in range(10)]
+    text = [rng.choice(words) for _ in range(rng.randint(0, 10))]
+    examples = [" \n ".join(" ".join(rng.choice(words) for _ in range(rng.randint(1, 8))) for _ in range(rng.randint(0, 3)))
+                for _ in range(rng.randint(1, 6))]
+    return (text, examples)
+
+
+def assert_same_scores(actual, expected):
+    assert len(actual)==len(expected)
+    for (a, e) in zip(actual, expected):
+        assert (a is None)==(e is None)
+        if e is not None:
+            assert float(a)==pytest.approx(float(e), rel=RTOL, abs=ATOL)
+
+
+def test_vector_score_calc_matches_loop():
+    model = FakeModel(VOCAB)
+    rng = random.Random(0)
+    for _ in range(500):
+        (text, examples) = random_case(rng)
+        assert_same_scores(vector_score_calc(text, examples, model), loop_vector_score_calc(text, examples, model))
+
+
+def test_closest_distances_matches_loop():
+    model = FakeModel(VOCAB)
+    rng = random.Random(1)
+    for _ in range(100):
+        (text, examples) = random_case(rng)
+        ctx_vectors = embed_tokens(text, model)
+        (vectors, starts, owners) = embed_examples(examples, model)
+        if len(ctx_vectors)==0 or len(starts)==0:
+            continue
+        closest = closest_distances(ctx_vectors, vectors, starts)
+        bounds = list(starts[1:]) + [len(vectors)]
+        for (j, (start, end)) in enumerate(zip(starts, bounds)):
+            for (i, v) in enumerate(ctx_vectors):
+                expected = min(np.linalg.norm(v - w) for w in vectors[start:end])
+                assert closest[i, j]==pytest.approx(expected, rel=RTOL, abs=ATOL)
+
+
+def test_unscored_meanings_are_none():
+    model = FakeModel(VOCAB)
+    scores = vector_score_calc(['w1', 'w2'], ['w3 w4', 'oov1 oov2', ''], model)
+    assert scores[0] is not None and scores[1] is None and scores[2] is None
+    assert list(vector_score_calc(['oov1'], ['w3 w4'], model))==[None]